@@ -0,0 +1,192 @@
+"""Keep-alive HTTP client for calls between the services.
+
+battery_controller, db_writer and daily_target talk to modbus_api over
+HTTP.  A bare ``requests.get`` opens and tears down a TCP connection per
+call — one per controller step and per actuation — which shows up as
+connection churn in uvicorn's log and the container's conntrack table.
+``ApiClient`` wraps one pooled ``requests.Session`` per caller instead:
+
+  * connections are kept alive and reused (uvicorn must keep them open
+    longer than the callers' interval — see ``--timeout-keep-alive`` in
+    compose.yaml);
+  * every endpoint (URL path) can have its own timeout, so a slow one
+    such as the full /registers image doesn't widen the controller's;
+  * failed connects and timeouts are retried from a *retry budget*: each
+    call earns a fraction of a retry, each retry spends one, so a dead
+    server costs at most ~``retry_ratio`` extra calls instead of doubling
+    the load (plus a small reserve so an isolated stale connection is
+    always retried).  GETs are retried; writes only when the caller says
+    they are idempotent;
+  * each call's latency is recorded per endpoint for ``stats_dict()`` /
+    ``summary()``.
+
+Log levels
+----------
+  DEBUG  — every call: method, path, status, latency, retry
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from log_config import get_logger
+
+log = get_logger("api_client")
+
+Timeout = Union[float, Tuple[float, float]]   # as requests takes it: total or (connect, read)
+
+DEFAULT_TIMEOUT: Timeout = (3.05, 5.0)
+RETRY_DELAY_S:   float   = 0.2
+
+
+class RetryBudget:
+    """Retries as a bounded fraction of calls: *ratio* retries earned per call.
+
+    Starts with *reserve* retries, and never holds more than that, so a long
+    healthy stretch doesn't bank a retry storm for the next outage.
+    """
+
+    def __init__(self, ratio: float = 0.2, reserve: float = 3.0) -> None:
+        self.ratio   = ratio
+        self.reserve = reserve
+        self.tokens  = reserve
+
+    def deposit(self) -> None:
+        self.tokens = min(self.reserve, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class _EndpointStats:
+    __slots__ = ("calls", "errors", "retries", "total_s", "max_s", "last_s")
+
+    def __init__(self) -> None:
+        self.calls   = 0
+        self.errors  = 0
+        self.retries = 0
+        self.total_s = 0.0
+        self.max_s   = 0.0
+        self.last_s  = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls":   self.calls,
+            "errors":  self.errors,
+            "retries": self.retries,
+            "mean_ms": round(self.total_s / self.calls * 1000, 1) if self.calls else None,
+            "max_ms":  round(self.max_s * 1000, 1),
+            "last_ms": round(self.last_s * 1000, 1),
+        }
+
+
+class ApiClient:
+    """Pooled session with per-endpoint timeouts, a retry budget and latency stats.
+
+    Safe to share between threads; a caller holding a long-lived streaming
+    response should still use its own client so it doesn't pin a pooled
+    connection the others are waiting for.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeouts: Optional[Mapping[str, Timeout]] = None,
+        default_timeout: Timeout = DEFAULT_TIMEOUT,
+        retry_ratio: float = 0.2,
+        retry_reserve: float = 3.0,
+        pool_size: int = 2,
+    ) -> None:
+        self.name            = name
+        self.timeouts        = dict(timeouts or {})   # URL path → timeout
+        self.default_timeout = default_timeout
+        self.budget          = RetryBudget(retry_ratio, retry_reserve)
+        self.session         = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock  = threading.Lock()
+        self._stats: Dict[str, _EndpointStats] = {}
+
+    def timeout_for(self, path: str) -> Timeout:
+        return self.timeouts.get(path, self.default_timeout)
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def request(
+        self, method: str, url: str, *, idempotent: Optional[bool] = None, **kwargs: Any,
+    ) -> requests.Response:
+        """Send one request; raises requests.RequestException like requests does.
+
+        A connect error or timeout is retried once if *idempotent* (default:
+        true for GET/HEAD) and the retry budget allows.  HTTP error statuses
+        are returned as-is for the caller's raise_for_status().
+        """
+        path = urlsplit(url).path or "/"
+        kwargs.setdefault("timeout", self.timeout_for(path))
+        if idempotent is None:
+            idempotent = method in ("GET", "HEAD")
+        with self._lock:
+            stats = self._stats.setdefault(f"{method} {path}", _EndpointStats())
+            self.budget.deposit()
+        retried = False
+        started = time.perf_counter()
+        try:
+            while True:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                    break
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if retried or not idempotent:
+                        raise
+                    with self._lock:
+                        if not self.budget.withdraw():
+                            raise
+                        stats.retries += 1
+                    retried = True
+                    log.debug("%s: %s %s failed (%s) — retrying", self.name, method, path, e)
+                    time.sleep(RETRY_DELAY_S)
+        except requests.RequestException:
+            self._record(stats, time.perf_counter() - started, error=True)
+            raise
+        elapsed = time.perf_counter() - started
+        self._record(stats, elapsed, error=response.status_code >= 500)
+        log.debug("%s: %s %s → %d in %.1f ms%s", self.name, method, path,
+                  response.status_code, elapsed * 1000, " (retried)" if retried else "")
+        return response
+
+    def _record(self, stats: _EndpointStats, elapsed: float, error: bool) -> None:
+        with self._lock:
+            stats.calls   += 1
+            stats.errors  += error
+            stats.total_s += elapsed
+            stats.max_s    = max(stats.max_s, elapsed)
+            stats.last_s   = elapsed
+
+    def stats_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "endpoints":    {k: s.as_dict() for k, s in self._stats.items()},
+                "retry_tokens": round(self.budget.tokens, 2),
+            }
+
+    def summary(self) -> str:
+        """Every endpoint's counts and latency on one line, for a periodic log message."""
+        with self._lock:
+            return "; ".join(
+                f"{key} {s.calls} call(s), {s.errors} failed, {s.retries} retried, "
+                f"mean {s.total_s / s.calls * 1000:.0f} ms, max {s.max_s * 1000:.0f} ms"
+                for key, s in self._stats.items() if s.calls
+            ) or "no calls"
@@ -1,12 +1,28 @@
 """Battery charge controller.
 
-Polls the inverter every POLL_INTERVAL_S seconds via modbus_api, computes
+Runs one control step per fresh inverter reading: modbus_api pushes every
+new fast-register read over /stream (every ~2 s), the controller computes
 the desired output priority and charge current, and pushes changes back.
+A voltage crossing is acted on as soon as the bus read that saw it
+completes, and each actuation logs how long after that read it landed.
+
+If no reading arrives for POLL_INTERVAL_S seconds — the stream is down, or
+modbus_api is up but the bus isn't — a watchdog tick polls
+/limited_registers instead, like the old fixed 5 s loop but on monotonic
+deadlines (TickScheduler), so the period doesn't stretch by the fetch and
+actuation time; failed watchdog ticks count towards FAIL_SAFE_TICKS as
+before.  Overruns, skipped ticks and wake-up jitter are logged hourly with
+the API call statistics.
+
+targets.json is read through a cached view (ControllerConfig): a step
+stats the file once and re-parses it only when it changed, and the writes
+a step makes (daily values, full-charge bookkeeping, expired-override
+pruning) go out together as one locked write when the step ends.
 
 Log levels
 ----------
   DEBUG  — raw register values, SoC estimator steps, grid-limit arithmetic,
-           charge-taper table lookups, per-tick loop heartbeat
+           charge-taper table lookups, per-sample loop heartbeat
   INFO   — state transitions, charge-current changes, priority changes,
            config reloads, startup/shutdown
   WARNING — fetch failures, config-file errors (non-fatal)
@@ -17,19 +33,26 @@ from __future__ import annotations
 import json
 import math
 import os
+import threading
 import time
+from dataclasses import dataclass
 from datetime import date, datetime, timezone
 from enum import Enum, IntEnum
+from typing import Mapping
 
 import requests
 
+from api_client import ApiClient
 from log_config import get_logger
+from regpack import ACCEPT_HEADER, decode as decode_registers
+from targets_store import TargetsStore
 
 log = get_logger("battery_controller")
 
 # ── Hardware / system constants ───────────────────────────────────────────────
 
-POLL_INTERVAL_S: int = 5
+POLL_INTERVAL_S: int = 5       # watchdog: poll when no reading arrived for this long
+STATS_INTERVAL_S: int = 3600   # how often call and tick statistics are logged
 
 # Battery bank parameters — update these if the pack is replaced.
 BATTERY_CAPACITY_AH: float = 520.0
@@ -39,11 +62,10 @@ BATTERY_CAPACITY_AH: float = 520.0
 BATTERY_WH_PER_SOC_CHARGING:    float = 270.0   # 520 Ah × 52 V / 100
 BATTERY_WH_PER_SOC_DISCHARGING: float = 255.0   # 520 Ah × 49 V / 100
 
-# Pre-computed: SoC (%) change per amp per polling tick.
-# Derivation: 100 % / (capacity_Ah × 3600 s/h) × POLL_INTERVAL_S
-_SOC_DELTA_PER_A_PER_TICK: float = (
-    100.0 / (BATTERY_CAPACITY_AH * 3600.0) * POLL_INTERVAL_S
-)
+# Pre-computed: SoC (%) change per amp per second; the estimator multiplies
+# by the time between the two bus reads it compares.
+# Derivation: 100 % / (capacity_Ah × 3600 s/h)
+_SOC_DELTA_PER_A_PER_S: float = 100.0 / (BATTERY_CAPACITY_AH * 3600.0)
 
 GRID_MAX_POWER_W: float    = 9000.0    # Maximum grid power budget (W)
 HYSTERESIS_SOC:   float    = 2.0       # SoC hysteresis band (%)
@@ -53,8 +75,8 @@ SBU_RETURN_MIN_SOC: float  = 13.0      # Minimum SoC (%) to (re)enter SBU during
                                        # V>51.6 V on a barely-recovered battery doesn't
                                        # flap back into SBU only to trip out again.
 SBU_TO_UTI_COOLDOWN_S: int = 30 * 60   # Minimum seconds between SBU→UTI switches
-FAIL_SAFE_TICKS:       int = 60        # After this many consecutive fetch failures
-                                       # (60 × 5 s = 5 min), force SBU → UTI_STOPPED
+FAIL_SAFE_TICKS:       int = 60        # After this many consecutive failed watchdog
+                                       # ticks (60 × 5 s = 5 min), force SBU → UTI_STOPPED
                                        # to stop discharging the battery without monitoring.
 
 # ── Full-charge (LFP balancing / SoC sync) constants ─────────────────────────
@@ -74,13 +96,20 @@ SYNC_TIMEOUT_MINUTES:  int   = 15     # Maximum SYNC duration
 # ── Runtime configuration ─────────────────────────────────────────────────────
 
 CONFIG_PATH = os.getenv("CONFIG_PATH", "/app/targets.json")
+_targets    = TargetsStore(CONFIG_PATH)
 
 _API_PORT: int = int(os.getenv("MODBUS_API_PORT", "5004"))
 _API_BASE: str = f"http://modbus_api:{_API_PORT}"
 
 LIMITED_REGISTERS_URL:   str = f"{_API_BASE}/limited_registers"
+STREAM_URL:              str = f"{_API_BASE}/stream?scope=limited"
 SET_CHARGE_CURRENT_URL:  str = f"{_API_BASE}/set_charge_current"
 SET_OUTPUT_PRIORITY_URL: str = f"{_API_BASE}/set_output_priority"
+WRITE_BATCH_URL:         str = f"{_API_BASE}/write_batch"
+
+# PowMr configuration registers (raw values; charge current in 0.1 A units).
+REG_OUTPUT_PRIORITY: int = 0xE204
+REG_CHARGE_CURRENT:  int = 0xE205
 
 _AUTH_USER = os.getenv("BASIC_AUTH_USER")
 _AUTH_PASS = os.getenv("BASIC_AUTH_PASS")
@@ -88,6 +117,23 @@ _API_AUTH: tuple[str, str] | None = (
     (_AUTH_USER, _AUTH_PASS) if _AUTH_USER and _AUTH_PASS else None
 )
 
+# One pooled keep-alive session for the polls and writes; the stream has its
+# own (SampleFeed) so its long-lived response never holds up an actuation.
+_api = ApiClient(
+    "battery_controller",
+    timeouts={
+        "/limited_registers":   3.0,
+        "/set_charge_current":  3.0,
+        "/set_output_priority": 3.0,
+        "/write_batch":         5.0,
+    },
+)
+
+# modbus_api sends an SSE keepalive every 15 s; a silent connection is
+# treated as dead after this long and re-opened.
+STREAM_READ_TIMEOUT_S: float = 40.0
+STREAM_MAX_BACKOFF_S:  float = 60.0
+
 # ── Enums ─────────────────────────────────────────────────────────────────────
 
 
@@ -156,30 +202,193 @@ def _to_signed_16(raw: int) -> int:
 # ── I/O helpers ───────────────────────────────────────────────────────────────
 
 
-def fetch_registers() -> dict | None:
-    """Fetch the limited register set from modbus_api. Returns None on failure."""
+@dataclass(frozen=True)
+class Sample:
+    """One fast-register reading and when the bus read behind it completed."""
+    registers: Mapping[str, int]
+    seq:       int | None    # modbus_api snapshot number
+    read_at:   float         # time.monotonic() of the bus read (receipt minus snapshot age)
+    source:    str           # "stream" or "poll"
+
+
+def fetch_registers() -> Sample | None:
+    """Fetch the limited register set from modbus_api. Returns None on failure.
+
+    Asks for the binary regpack format; falls back to JSON from older servers.
+    """
     try:
-        r = requests.get(LIMITED_REGISTERS_URL, timeout=3)
+        r = _api.get(LIMITED_REGISTERS_URL, headers={"Accept": ACCEPT_HEADER})
+        received = time.monotonic()
         r.raise_for_status()
-        data = r.json()
+        try:
+            data = decode_registers(r.headers.get("Content-Type", ""), r.content)
+        except ValueError as e:
+            log.warning("Undecodable register payload: %s", e)
+            return None
+        if data is None:
+            data = r.json()
         log.debug(
             "Registers fetched: SoC=%s%%  raw_V=%s  raw_I=%s  load_L1=%s W  load_L2=%s W",
             data.get("0x0100"), data.get("0x0101"),
             data.get("0x0102"), data.get("0x021c"), data.get("0x0234"),
         )
-        return data
+        try:
+            age = float(r.headers.get("X-Snapshot-Age", 0.0))
+            seq = int(r.headers["X-Snapshot-Seq"]) if "X-Snapshot-Seq" in r.headers else None
+        except ValueError:
+            age, seq = 0.0, None
+        return Sample(data, seq, received - age, "poll")
     except requests.RequestException as e:
         log.warning("Register fetch failed: %s", e)
         return None
 
 
+class TickScheduler:
+    """Fixed-rate watchdog ticks on time.monotonic() deadlines.
+
+    Each deadline is the previous one plus the period, not "now plus the
+    period" after the step's work, so polling never drifts by the fetch and
+    actuation time.  A tick taken after its deadline had already passed when
+    the caller came back for it is an *overrun*; whole periods that slipped
+    by meanwhile are *skipped* (not caught up in a burst).  *Jitter* is how
+    late a tick woke from its wait.  A stream reading re-arms the watchdog
+    a full period out.
+    """
+
+    def __init__(self, period_s: float) -> None:
+        self.period_s     = period_s
+        self.deadline     = time.monotonic()   # first tick: right away
+        self.ticks        = 0
+        self.overruns     = 0
+        self.skipped      = 0
+        self.jitter_s     = 0.0   # last
+        self.max_jitter_s = 0.0
+        self._jitter_sum  = 0.0
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def rearm(self) -> None:
+        self.deadline = time.monotonic() + self.period_s
+
+    def fire(self, entered_at: float) -> None:
+        """Account for the tick due at self.deadline and schedule the next.
+
+        *entered_at* is when the caller started waiting for this tick.
+        """
+        now = time.monotonic()
+        if self.ticks and entered_at > self.deadline:
+            self.overruns += 1
+            log.debug("Watchdog tick overran by %.0f ms", (entered_at - self.deadline) * 1000)
+        else:
+            self.jitter_s      = max(0.0, now - self.deadline)
+            self.max_jitter_s  = max(self.max_jitter_s, self.jitter_s)
+            self._jitter_sum  += self.jitter_s
+        self.ticks    += 1
+        self.deadline += self.period_s
+        if now >= self.deadline:
+            missed = int((now - self.deadline) // self.period_s) + 1
+            self.skipped  += missed
+            self.deadline += missed * self.period_s
+            log.debug("Watchdog skipped %d tick(s)", missed)
+
+    def summary(self) -> str:
+        waited = self.ticks - self.overruns
+        mean   = self._jitter_sum / waited if waited else 0.0
+        return (f"{self.ticks} tick(s), {self.overruns} overrun, {self.skipped} skipped, "
+                f"jitter mean {mean * 1000:.1f} ms / max {self.max_jitter_s * 1000:.1f} ms")
+
+
+class SampleFeed:
+    """Fresh readings pushed by modbus_api's /stream, with a polling watchdog.
+
+    A daemon thread keeps an SSE subscription to /stream?scope=limited open
+    (re-connecting with backoff) and leaves the newest reading in a one-slot
+    mailbox. next() returns it as soon as it lands; if nothing arrived within
+    POLL_INTERVAL_S it polls /limited_registers instead (None on failure),
+    on TickScheduler deadlines so a stream outage polls at a steady 5 s.
+    """
+
+    def __init__(self, url: str = STREAM_URL, watchdog_s: float = POLL_INTERVAL_S) -> None:
+        self.url            = url
+        self.watchdog_s     = watchdog_s
+        self.stream_samples = 0
+        self.poll_ticks     = 0
+        self.skipped        = 0   # stream samples replaced before the loop took them
+        self._cond          = threading.Condition()
+        self._latest: Sample | None = None
+        self.ticks          = TickScheduler(watchdog_s)
+        self._api           = ApiClient("battery_controller.stream", pool_size=1)
+        self._thread        = threading.Thread(target=self._run, name="stream", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def next(self) -> Sample | None:
+        """Block until the next fresh reading, or poll once at the watchdog deadline."""
+        entered_at = time.monotonic()
+        with self._cond:
+            while self._latest is None:
+                remaining = self.ticks.remaining()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            sample, self._latest = self._latest, None
+        if sample is not None:
+            self.ticks.rearm()
+            return sample
+        self.ticks.fire(entered_at)
+        self.poll_ticks += 1
+        log.debug("No stream reading for %.0f s — polling", self.watchdog_s)
+        return fetch_registers()
+
+    def _offer(self, sample: Sample) -> None:
+        with self._cond:
+            if self._latest is not None:
+                self.skipped += 1
+            self._latest = sample
+            self.stream_samples += 1
+            self._cond.notify()
+
+    def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                # No client retry: the backoff below is the retry policy here.
+                with self._api.get(self.url, stream=True, timeout=(3, STREAM_READ_TIMEOUT_S),
+                                   idempotent=False,
+                                   headers={"Accept": "text/event-stream"}) as r:
+                    r.raise_for_status()
+                    log.info("Subscribed to %s", self.url)
+                    backoff = 1.0
+                    data: list[str] = []
+                    for line in r.iter_lines(decode_unicode=True):
+                        if line:
+                            if line.startswith("data:"):
+                                data.append(line[5:].lstrip())
+                            continue   # id:, event:, retry:, ": keepalive"
+                        if data:
+                            payload = json.loads("\n".join(data))
+                            data = []
+                            self._offer(Sample(
+                                payload["registers"], payload.get("seq"),
+                                time.monotonic() - float(payload.get("age", 0.0)), "stream",
+                            ))
+                log.warning("Stream closed by modbus_api — reconnecting in %.0f s", backoff)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                log.warning("Stream unavailable (%s) — retrying in %.0f s; "
+                            "polling every %d s meanwhile", e, backoff, self.watchdog_s)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, STREAM_MAX_BACKOFF_S)
+
+
 def set_charge_current(current: float) -> bool:
     try:
-        r = requests.post(
+        r = _api.post(
             SET_CHARGE_CURRENT_URL,
             json={"value": current},
-            timeout=3,
             auth=_API_AUTH,
+            idempotent=True,   # absolute register values: a repeat is harmless
         )
         r.raise_for_status()
         result = r.json()
@@ -196,11 +405,11 @@ def set_charge_current(current: float) -> bool:
 def set_output_priority(priority: int) -> bool:
     priority_name = OutputPriority(priority).name if priority in [e.value for e in OutputPriority] else str(priority)
     try:
-        r = requests.post(
+        r = _api.post(
             SET_OUTPUT_PRIORITY_URL,
             json={"value": priority},
-            timeout=3,
             auth=_API_AUTH,
+            idempotent=True,
         )
         r.raise_for_status()
         result = r.json()
@@ -214,99 +423,219 @@ def set_output_priority(priority: int) -> bool:
         return False
 
 
-def _read_targets_file() -> dict:
-    """Read targets.json; return {} on any error."""
+def write_batch(writes: list[tuple[int, int]]) -> dict[int, bool] | None:
+    """POST several raw register writes to /write_batch in one request.
+
+    Returns {register: succeeded} per item, or None if the request itself
+    failed (the caller then falls back to the single-write endpoints).
+    """
     try:
-        with open(CONFIG_PATH) as f:
-            return json.load(f)
-    except Exception:
-        return {}
+        r = _api.post(
+            WRITE_BATCH_URL,
+            json={"writes": [{"register": f"0x{a:04X}", "value": v} for a, v in writes]},
+            auth=_API_AUTH,
+            idempotent=True,
+        )
+        r.raise_for_status()
+        results = r.json().get("results", [])
+        out = {int(res["register"], 16): res.get("status") != "failed" for res in results}
+        for res in results:
+            if res.get("status") == "failed":
+                log.warning("write_batch: %s=%s failed: %s",
+                            res["register"], res["value"], res.get("error"))
+        log.info("Batch write: %s", ", ".join(
+            f"{res['register']}={res['value']} {res.get('status')}" for res in results))
+        return out
+    except (requests.RequestException, ValueError, KeyError) as e:
+        log.warning("write_batch request failed: %s", e)
+        return None
+
+
+def apply_actuations(
+    priority: OutputPriority | None, charge_current: float | None,
+) -> tuple[bool, bool]:
+    """Push a new output priority and/or charge current; None means unchanged.
+
+    Both together go out as one /write_batch (one lock hold, one FC 0x10
+    write on the inverter); a lone change uses its own endpoint. Returns
+    (priority_ok, current_ok) — an item that wasn't requested reports False.
+    """
+    if priority is not None and charge_current is not None:
+        results = write_batch([
+            (REG_OUTPUT_PRIORITY, int(priority)),
+            (REG_CHARGE_CURRENT,  int(charge_current * 10)),
+        ])
+        if results is not None:
+            return results.get(REG_OUTPUT_PRIORITY, False), results.get(REG_CHARGE_CURRENT, False)
+    priority_ok = priority is not None and set_output_priority(priority)
+    current_ok  = charge_current is not None and set_charge_current(charge_current)
+    return priority_ok, current_ok
+
+
+# ── Targets (targets.json) ───────────────────────────────────────────────────
+#
+# The loop reads targets.json through one ControllerConfig: refresh() at the
+# top of each step is the step's only file access (a stat — TargetsStore
+# re-parses only when the file changed), the derived values — including the
+# parsed override expiry — are rebuilt only when the content version moves,
+# and writes queued during the step go out as one locked write at its end.
+
+
+@dataclass(frozen=True)
+class _Override:
+    state:   State
+    expires: datetime
+    raw:     Mapping      # as found in the file, to prune only this override
+
+
+class ControllerConfig:
+    """The control loop's view of targets.json: one stat per step, parsed on change."""
+
+    def __init__(self, store: TargetsStore) -> None:
+        self.store   = store
+        self.error: str | None = None          # why the last refresh failed, if it did
+        self.targets: Mapping = {}
+        self.override: _Override | None = None
+        self._version = -1
+        self._pending: list[tuple[str, object]] = []   # (log message, mutate)
+        self._pruned: Mapping | None = None
+
+    def refresh(self) -> None:
+        try:
+            version = self.store.refresh()
+        except Exception as e:
+            if str(e) != self.error:
+                log.warning("Failed to load targets.json: %s — keeping previous targets", e)
+            self.error = str(e)
+            return
+        if self.error is not None:
+            log.info("targets.json readable again")
+            self.error = None
+        if version == self._version:
+            return
+        self._version = version
+        self.targets  = self.store.load()
+        self.override = self._parse_override(self.targets.get("manual_override"))
+        log.info(
+            "Targets reloaded (version %d): target_soc=%s%%  daily_charge_current=%s A  "
+            "full_charge=%s  override=%s",
+            version, self.targets.get("target_soc"), self.targets.get("daily_charge_current"),
+            bool(self.targets.get("full_charge", False)),
+            self.override.state.value if self.override else "none",
+        )
+
+    @staticmethod
+    def _parse_override(raw: Mapping | None) -> _Override | None:
+        if not raw:
+            return None
+        try:
+            return _Override(State(raw["state"]), datetime.fromisoformat(raw["expires_at"]), raw)
+        except Exception as e:
+            log.warning("Invalid manual_override (%s) — ignoring", e)
+            return None
+
+    def prune_override(self, override: _Override) -> None:
+        """Queue removal of an expired *override*, once."""
+        if self._pruned is override.raw:
+            return
+        self._pruned = override.raw
+        raw = override.raw
+
+        def _prune(t: dict) -> None:
+            # Only if nobody set a new override since we read this one.
+            if t.get("manual_override") == raw:
+                t.pop("manual_override", None)
+
+        self.queue(
+            f"Manual override expired (was {override.state.value}) — cleared from targets.json",
+            _prune,
+        )
+
+    def queue(self, message: str, mutate) -> None:
+        """Apply *mutate* to targets.json at the next flush(), logging *message*."""
+        self._pending.append((message, mutate))
+
+    def flush(self) -> None:
+        """Write every change queued this step as one atomic update."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+
+        def _apply(targets: dict) -> None:
+            for _, mutate in pending:
+                mutate(targets)
+
+        try:
+            self.store.update(_apply)
+        except Exception as e:
+            log.warning("Failed to write targets.json (%s): %s",
+                        "; ".join(m for m, _ in pending), e)
+            return
+        for message, _ in pending:
+            log.info("%s", message)
+
+
+_config = ControllerConfig(_targets)
 
 
 def update_targets_json(daily_charge_current: float, target_soc: float) -> None:
     """Write daily_charge_current and target_soc to targets.json, preserving other keys
     (full_charge, last_full_charge) so the full-charge bookkeeping isn't clobbered."""
-    targets = _read_targets_file()
-    targets["target_soc"] = target_soc
-    targets["daily_charge_current"] = daily_charge_current
-    try:
-        with open(CONFIG_PATH, "w") as f:
-            json.dump(targets, f)
-        log.info(
-            "targets.json updated: target_soc=%.0f%%  daily_charge_current=%.0f A",
-            target_soc, daily_charge_current,
-        )
-    except Exception as e:
-        log.warning("Failed to write targets.json: %s", e)
+    _config.queue(
+        f"targets.json updated: target_soc={target_soc:.0f}%  "
+        f"daily_charge_current={daily_charge_current:.0f} A",
+        lambda t: t.update(target_soc=target_soc, daily_charge_current=daily_charge_current),
+    )
 
 
 def _complete_full_charge() -> None:
     """Mark full-charge as completed: clear the flag and record today's date."""
-    targets = _read_targets_file()
-    targets["full_charge"] = False
-    targets["last_full_charge"] = date.today().isoformat()
-    try:
-        with open(CONFIG_PATH, "w") as f:
-            json.dump(targets, f)
-        log.info(
-            "Full charge completed: cleared full_charge flag, last_full_charge=%s",
-            targets["last_full_charge"],
-        )
-    except Exception as e:
-        log.warning("Failed to write targets.json on full-charge completion: %s", e)
+    today = date.today().isoformat()
+    _config.queue(
+        f"Full charge completed: cleared full_charge flag, last_full_charge={today}",
+        lambda t: t.update(full_charge=False, last_full_charge=today),
+    )
 
 
 def load_manual_override() -> tuple[State, datetime] | None:
-    """Read manual_override from targets.json; return (state, expires_at) or None.
+    """The manual_override from targets.json as (state, expires_at), or None.
 
     A malformed or expired override is treated as absent.  An expired override
-    is also pruned from the file so it doesn't keep getting parsed each tick.
+    is also pruned from the file (once) so the form shows it as gone.
     """
-    targets = _read_targets_file()
-    raw = targets.get("manual_override")
-    if not raw:
+    override = _config.override
+    if override is None:
         return None
-    try:
-        state   = State(raw["state"])
-        expires = datetime.fromisoformat(raw["expires_at"])
-    except Exception as e:
-        log.warning("Invalid manual_override (%s) — ignoring", e)
-        return None
-
+    expires = override.expires
     now = datetime.now(expires.tzinfo) if expires.tzinfo else datetime.now()
-    if now >= expires:
-        targets.pop("manual_override", None)
-        try:
-            with open(CONFIG_PATH, "w") as f:
-                json.dump(targets, f)
-            log.info("Manual override expired (was %s) — cleared from targets.json", state.value)
-        except Exception as e:
-            log.warning("Failed to clear expired override: %s", e)
-        return None
-    return state, expires
+    if now < expires:
+        return override.state, expires
+    _config.prune_override(override)
+    return None
 
 
 def load_targets_from_file(
     current_daily_charge_current: float,
     current_target_soc: float,
 ) -> tuple[float, float, bool]:
+    """(daily_charge_current, target_soc, full_charge) from the cached targets.
+
+    The current values are kept for keys the file lacks; while targets.json
+    is unreadable they are kept and full_charge reads False, as before.
+    """
+    if _config.error is not None:
+        return current_daily_charge_current, current_target_soc, False
+    targets = _config.targets
     try:
-        with open(CONFIG_PATH) as f:
-            targets = json.load(f)
         daily = float(targets.get("daily_charge_current", current_daily_charge_current))
         soc   = float(targets.get("target_soc", current_target_soc))
-        full_charge = bool(targets.get("full_charge", False))
-        log.debug(
-            "Targets loaded from file: target_soc=%.0f%%  daily_charge_current=%.0f A  full_charge=%s",
-            soc, daily, full_charge,
-        )
-        return daily, soc, full_charge
-    except Exception as e:
+    except (TypeError, ValueError) as e:
         log.warning(
-            "Failed to load targets.json: %s — keeping target_soc=%.0f%%  daily_charge_current=%.0f A",
-            e, current_target_soc, current_daily_charge_current,
+            "Invalid targets in targets.json: %s — keeping target_soc=%.0f%%  "
+            "daily_charge_current=%.0f A", e, current_target_soc, current_daily_charge_current,
         )
         return current_daily_charge_current, current_target_soc, False
+    return daily, soc, bool(targets.get("full_charge", False))
 
 
 # ── Control logic ─────────────────────────────────────────────────────────────
@@ -560,7 +889,7 @@ def determine_output_priority(state: State) -> OutputPriority:
 def main() -> None:
     log.info("=" * 60)
     log.info("Battery charge controller starting")
-    log.info("  Poll interval : %d s", POLL_INTERVAL_S)
+    log.info("  Readings      : pushed via %s, watchdog poll after %d s", STREAM_URL, POLL_INTERVAL_S)
     log.info("  Battery       : %.0f Ah", BATTERY_CAPACITY_AH)
     log.info("  Grid budget   : %.0f W", GRID_MAX_POWER_W)
     log.info("  SBU→UTI cooldown: %d s", SBU_TO_UTI_COOLDOWN_S)
@@ -588,13 +917,21 @@ def main() -> None:
     consecutive_failures: int                    = 0
     charge_mode:          ChargeMode             = ChargeMode.NORMAL
     sync_start_time:      datetime | None        = None
+    last_read_at:         float | None           = None
+
+    feed = SampleFeed()
+    feed.start()
+    next_stats = time.monotonic() + STATS_INTERVAL_S
 
     while True:
+        sample = feed.next()
+
+        _config.refresh()
         daily_charge_current, target_soc, full_charge = load_targets_from_file(
             daily_charge_current, target_soc
         )
 
-        limited_data = fetch_registers()
+        limited_data = sample.registers if sample is not None else None
 
         # Validate all required keys are present before parsing.
         if limited_data is not None:
@@ -614,6 +951,11 @@ def main() -> None:
                 consecutive_failures = 0
 
             last_battery_soc = battery_soc
+            # Time between the bus reads being compared, not the nominal
+            # interval — readings arrive every ~2 s from the stream, 5 s+
+            # from watchdog polls.
+            elapsed_s = max(0.0, sample.read_at - last_read_at) if last_read_at is not None else 0.0
+            last_read_at = sample.read_at
 
             # Register keys use modbus_api v2 hex-address schema:
             #   0x0100 = battery SoC (%)
@@ -652,13 +994,13 @@ def main() -> None:
                     and last_battery_soc == battery_soc
                     and battery_current != 0
                 ):
-                    delta = battery_current * _SOC_DELTA_PER_A_PER_TICK
+                    delta = battery_current * _SOC_DELTA_PER_A_PER_S * elapsed_s
                     estimated_soc += delta
                     estimated_soc = max(battery_soc - 0.5, min(battery_soc + 0.5, estimated_soc))
 
                 log.debug(
-                    "SoC estimator: hw=%d%%  est %.3f%% → %.3f%%  I=%+.1f A",
-                    int(battery_soc), prev_est, estimated_soc, battery_current,
+                    "SoC estimator: hw=%d%%  est %.3f%% → %.3f%%  I=%+.1f A over %.1f s",
+                    int(battery_soc), prev_est, estimated_soc, battery_current, elapsed_s,
                 )
 
         else:
@@ -802,6 +1144,7 @@ def main() -> None:
             sync_start_time = None
 
         # ── Output priority ───────────────────────────────────────────
+        new_priority: OutputPriority | None = None
         desired_priority = determine_output_priority(current_state)
         if last_output_priority != desired_priority:
             log.info(
@@ -809,10 +1152,10 @@ def main() -> None:
                 last_output_priority.name if last_output_priority is not None else "None",
                 desired_priority.name,
             )
-            if set_output_priority(desired_priority):
-                last_output_priority = desired_priority
+            new_priority = desired_priority
 
         # ── Charge current (only with fresh data) ─────────────────────
+        new_current: float | None = None
         if limited_data:
             target_charge_current = adjust_battery_charge(
                 battery_soc, load_power, battery_voltage, daily_charge_current, current_state,
@@ -823,10 +1166,34 @@ def main() -> None:
                     "Charge current: %.0f A → %.0f A",
                     last_charge_current, target_charge_current,
                 )
-                if set_charge_current(target_charge_current):
-                    last_charge_current = target_charge_current
+                new_current = target_charge_current
+
+        # ── Actuate (priority first, then current — batched when both) ─
+        if new_priority is not None or new_current is not None:
+            priority_ok, current_ok = apply_actuations(new_priority, new_current)
+            if priority_ok:
+                last_output_priority = new_priority
+            if current_ok:
+                last_charge_current = new_current
+            if sample is not None:
+                log.info(
+                    "Actuation done %.0f ms after the bus read (%s, snapshot #%s)",
+                    (time.monotonic() - sample.read_at) * 1000, sample.source, sample.seq,
+                )
+        elif sample is not None:
+            log.debug(
+                "Step done %.0f ms after the bus read (%s, snapshot #%s) — nothing to actuate",
+                (time.monotonic() - sample.read_at) * 1000, sample.source, sample.seq,
+            )
+
+        # ── targets.json writes queued this step, as one update ───────
+        _config.flush()
 
-        time.sleep(POLL_INTERVAL_S)
+        if time.monotonic() >= next_stats:
+            next_stats += STATS_INTERVAL_S
+            log.info("modbus_api calls since start: %s", _api.summary())
+            log.info("Readings since start: %d streamed (%d superseded), %d watchdog polls — %s",
+                     feed.stream_samples, feed.skipped, feed.poll_ticks, feed.ticks.summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,358 @@
+"""Prometheus-format telemetry for the Modbus buses.
+
+A deliberately small, dependency-free subset of the Prometheus client:
+counters, gauges and histograms with labels, rendered in the text exposition
+format (version 0.0.4) by ``Registry.render()``.  modbus_api serves it on
+``/metrics``; Prometheus, Telegraf's ``inputs.prometheus`` or an InfluxDB 2
+scraper can all pull it straight into the existing InfluxDB.
+
+``MeteredClient`` wraps a pymodbus client for the duration of one
+transaction and records, per Modbus request/response pair:
+
+  * latency, by device / function / block (histogram);
+  * request count, and errors split into exception responses and I/O
+    failures (no/short response, framer errors);
+  * bytes on the wire, computed from the RTU frame layout rather than
+    measured — pymodbus does not expose its byte counts.
+
+Metrics are updated from the bus worker threads and read from the event
+loop, so every metric guards its samples with a lock.
+
+Log levels
+----------
+  (none — this module never logs)
+"""
+from __future__ import annotations
+
+import math
+import threading
+import time
+from typing import Any, Callable, Collection, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+LabelValues = Tuple[str, ...]
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Serial transaction latencies: a single register at 9600 baud is ~25 ms,
+# a 96-register block ~250 ms, a timeout 1 s.
+LATENCY_BUCKETS: Tuple[float, ...] = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Lock waits: ~0 when idle, up to a full /registers cycle under contention.
+WAIT_BUCKETS: Tuple[float, ...] = (0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# ── Metric primitives ─────────────────────────────────────────────────────────
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name   = name
+        self.help   = help
+        self.labels = tuple(labels)
+        self._lock  = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: expected labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def _label_str(self, key: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.labels, key)]
+        if extra is not None:
+            pairs.append(f'{extra[0]}="{extra[1]}"')
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{self._label_str(k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: Sequence[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values → (per-bucket counts, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, n = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, n + 1)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(c), s, n)) for k, (c, s, n) in self._values.items())
+        out: List[str] = []
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for upper, c in zip(self.buckets, counts):
+                cumulative += c
+                out.append(f"{self.name}_bucket{self._label_str(key, ('le', _fmt(upper)))} {cumulative}")
+            out.append(f"{self.name}_sum{self._label_str(key)} {_fmt(total)}")
+            out.append(f"{self.name}_count{self._label_str(key)} {n}")
+        return out
+
+
+M = TypeVar("M", bound=_Metric)
+
+
+class Registry:
+    """Ordered collection of metrics; ``render()`` produces the /metrics body."""
+
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: M) -> M:
+        self._metrics.append(metric)
+        return metric
+
+    def on_collect(self, fn: Callable[[], None]) -> None:
+        """Run *fn* before every render — for gauges sampled at scrape time."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        for fn in self._collectors:
+            fn()
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+# ── RTU frame sizes ───────────────────────────────────────────────────────────
+#
+# Every RTU frame is slave id (1) + function code (1) + payload + CRC (2).
+# An exception response is slave + fc|0x80 + exception code + CRC = 5 bytes.
+
+FC_READ_HOLDING    = 0x03
+FC_READ_INPUT      = 0x04
+FC_WRITE_SINGLE    = 0x06
+FC_WRITE_MULTIPLE  = 0x10
+EXCEPTION_RESPONSE_BYTES = 5
+
+
+def rtu_request_bytes(fc: int, count: int = 1) -> int:
+    if fc == FC_WRITE_MULTIPLE:
+        return 9 + 2 * count          # addr(2) qty(2) byte count(1) data
+    return 8                          # addr(2) + qty or value(2)
+
+
+def rtu_response_bytes(fc: int, count: int = 1) -> int:
+    if fc in (FC_READ_HOLDING, FC_READ_INPUT):
+        return 5 + 2 * count          # byte count(1) + data
+    return 8                          # echo of addr + qty/value
+
+
+# ── Bus metrics ───────────────────────────────────────────────────────────────
+
+
+class BusMetrics:
+    """The metric families modbus_api exports, on one registry."""
+
+    def __init__(self) -> None:
+        self.registry = r = Registry()
+        self.request_seconds = r.register(Histogram(
+            "modbus_request_seconds",
+            "Latency of one Modbus request/response pair on the serial bus.",
+            ("device", "function", "block"),
+        ))
+        self.requests = r.register(Counter(
+            "modbus_requests_total",
+            "Modbus requests sent, by outcome (ok, exception, io_error).",
+            ("device", "function", "result"),
+        ))
+        self.transaction_seconds = r.register(Histogram(
+            "modbus_transaction_seconds",
+            "Open → requests → close time of one bus transaction.",
+            ("device",),
+        ))
+        self.lock_wait_seconds = r.register(Histogram(
+            "modbus_lock_wait_seconds",
+            "Time spent waiting for the device's bus slot, by operation.",
+            ("device", "op"), buckets=WAIT_BUCKETS,
+        ))
+        self.queue_wait_seconds = r.register(Histogram(
+            "modbus_queue_wait_seconds",
+            "Time queued for the bus slot, by priority class.",
+            ("device", "class"), buckets=WAIT_BUCKETS,
+        ))
+        self.queue_depth = r.register(Gauge(
+            "modbus_queue_depth",
+            "Waiters queued for the bus slot at scrape time, by priority class.",
+            ("device", "class"),
+        ))
+        self.bulk_yields = r.register(Counter(
+            "modbus_bulk_yields_total",
+            "Bulk reads that gave up the bus between blocks to more urgent work.",
+            ("device",),
+        ))
+        self.range_rejections = r.register(Counter(
+            "modbus_range_rejections_total",
+            "Reads rejected because a register value fell outside its known band.",
+            ("device", "register"),
+        ))
+        self.rebuilds = r.register(Counter(
+            "modbus_client_rebuilds_total",
+            "ModbusSerialClient objects discarded and rebuilt after failures.",
+            ("device",),
+        ))
+        self.rebuild_seconds = r.register(Histogram(
+            "modbus_client_rebuild_seconds",
+            "Time to discard a ModbusSerialClient and build its replacement "
+            "(port lookup included).",
+            ("device",), buckets=WAIT_BUCKETS,
+        ))
+        self.wire_bytes = r.register(Counter(
+            "modbus_wire_bytes_total",
+            "RTU bytes on the wire (computed from frame sizes).",
+            ("device", "direction"),
+        ))
+        self.config_writes = r.register(Counter(
+            "modbus_config_writes_total",
+            "Configuration register writes, by result (written, skipped, failed).",
+            ("register", "result"),
+        ))
+        self.session_health = r.register(Gauge(
+            "modbus_session_health",
+            "Persistent-session health score (see modbus_bus.HEALTH_MAX).",
+            ("device",),
+        ))
+        self.gateway_requests = r.register(Counter(
+            "modbus_gateway_requests_total",
+            "Modbus TCP gateway requests, by result (ok or the exception returned).",
+            ("device", "function", "result"),
+        ))
+        self.gateway_clients = r.register(Gauge(
+            "modbus_gateway_clients",
+            "Modbus TCP gateway connections open at scrape time.",
+        ))
+        self.snapshot_age_seconds = r.register(Gauge(
+            "modbus_snapshot_age_seconds",
+            "Age of each snapshot region at scrape time.",
+            ("region",),
+        ))
+
+    def render(self) -> str:
+        return self.registry.render()
+
+
+class MeteredClient:
+    """Per-transaction proxy around a pymodbus client that records every request.
+
+    *blocks* are the planned (start, count) reads; other reads (ad-hoc
+    /raw_read probes) are labelled block="other" to keep cardinality bounded.
+    Attributes other than the four request methods pass straight through.
+    """
+
+    def __init__(
+        self, client: Any, device: str, metrics: BusMetrics,
+        blocks: Collection[Tuple[int, int]] = (),
+    ) -> None:
+        self._client  = client
+        self._device  = device
+        self._metrics = metrics
+        self._blocks  = blocks
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+    def _call(self, fc: int, block: str, count: int, fn: Callable[[], Any]) -> Any:
+        m, dev, func = self._metrics, self._device, f"0x{fc:02x}"
+        m.wire_bytes.inc(rtu_request_bytes(fc, count), device=dev, direction="tx")
+        started = time.perf_counter()
+        try:
+            rr = fn()
+        except Exception:
+            m.requests.inc(device=dev, function=func, result="io_error")
+            raise
+        finally:
+            m.request_seconds.observe(time.perf_counter() - started,
+                                      device=dev, function=func, block=block)
+        if hasattr(rr, "isError") and rr.isError():
+            # pymodbus returns an ExceptionResponse for a device exception,
+            # and a ModbusIOException object for a missing reply.
+            if getattr(rr, "exception_code", None) is not None:
+                m.requests.inc(device=dev, function=func, result="exception")
+                m.wire_bytes.inc(EXCEPTION_RESPONSE_BYTES, device=dev, direction="rx")
+            else:
+                m.requests.inc(device=dev, function=func, result="io_error")
+            return rr
+        m.requests.inc(device=dev, function=func, result="ok")
+        m.wire_bytes.inc(rtu_response_bytes(fc, count), device=dev, direction="rx")
+        return rr
+
+    def _block(self, address: int, count: int) -> str:
+        return f"0x{address:04x}/{count}" if (address, count) in self._blocks else "other"
+
+    def read_holding_registers(self, address: int, count: int = 1, **kw: Any) -> Any:
+        return self._call(FC_READ_HOLDING, self._block(address, count), count,
+                          lambda: self._client.read_holding_registers(address=address, count=count, **kw))
+
+    def read_input_registers(self, address: int, count: int = 1, **kw: Any) -> Any:
+        return self._call(FC_READ_INPUT, self._block(address, count), count,
+                          lambda: self._client.read_input_registers(address=address, count=count, **kw))
+
+    def write_register(self, address: int, value: int, **kw: Any) -> Any:
+        return self._call(FC_WRITE_SINGLE, f"0x{address:04x}", 1,
+                          lambda: self._client.write_register(address, value, **kw))
+
+    def write_registers(self, address: int, values: Sequence[int], **kw: Any) -> Any:
+        return self._call(FC_WRITE_MULTIPLE, f"0x{address:04x}/{len(values)}", len(values),
+                          lambda: self._client.write_registers(address, values, **kw))
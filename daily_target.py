@@ -15,7 +15,6 @@ Log levels
 from __future__ import annotations
 
 import argparse
-import json
 import math
 import os
 import sys
@@ -23,7 +22,9 @@ from datetime import date, datetime, timedelta
 
 import requests
 
+from api_client import ApiClient
 from log_config import get_logger
+from targets_store import TargetsStore
 
 log = get_logger("daily_target")
 
@@ -37,7 +38,10 @@ LIMITED_REGISTERS_URL: str = f"{_API_BASE}/limited_registers"
 # 280000 = Osaka prefecture.  Edit for your region if needed.
 WEATHER_API_URL = "https://www.jma.go.jp/bosai/forecast/data/forecast/280000.json"
 
+_api = ApiClient("daily_target", timeouts={"/limited_registers": 5.0}, default_timeout=10.0)
+
 CONFIG_PATH = os.getenv("CONFIG_PATH", "/app/targets.json")
+_targets    = TargetsStore(CONFIG_PATH)
 
 # ── Battery constants ─────────────────────────────────────────────────────────
 
@@ -56,7 +60,7 @@ AVERAGE_LOAD_W:            float = 1000.0  # assumed average load for SoC-drain
 
 def fetch_registers() -> dict | None:
     try:
-        r = requests.get(LIMITED_REGISTERS_URL, timeout=5)
+        r = _api.get(LIMITED_REGISTERS_URL)
         r.raise_for_status()
         return r.json()
     except requests.RequestException as e:
@@ -71,7 +75,7 @@ def fetch_tomorrow_weather_code() -> int:
     """Return tomorrow's JMA weather code, defaulting to 200 (cloudy) on any failure."""
     try:
         log.debug("Fetching weather from %s", WEATHER_API_URL)
-        r = requests.get(WEATHER_API_URL, timeout=10)
+        r = _api.get(WEATHER_API_URL)
         r.raise_for_status()
         weather_data = r.json()
 
@@ -143,9 +147,7 @@ FULL_CHARGE_MIN_INTERVAL_DAYS: int = 30
 def _load_last_full_charge() -> date | None:
     """Read the last successful full-charge date from targets.json, if recorded."""
     try:
-        with open(CONFIG_PATH) as f:
-            targets = json.load(f)
-        s = targets.get("last_full_charge")
+        s = _targets.load().get("last_full_charge")
         if not s:
             return None
         return date.fromisoformat(s)
@@ -350,19 +352,21 @@ def main() -> None:
     # their values. The flag is keyed by date (skip_next_auto = "YYYY-MM-DD")
     # so it self-expires after the night it covers.
     try:
-        with open(CONFIG_PATH) as f:
-            existing = json.load(f)
+        existing = _targets.load()
     except Exception:
         existing = {}
-    if existing.get("skip_next_auto") == date.today().isoformat():
+    today_iso = date.today().isoformat()
+    if existing.get("skip_next_auto") == today_iso:
         log.info(
             "skip_next_auto matches today — exiting without modifying targets.json"
         )
         if not args.dry_run:
-            existing.pop("skip_next_auto", None)
+            def _clear_skip(t: dict) -> None:
+                if t.get("skip_next_auto") == today_iso:
+                    t.pop("skip_next_auto", None)
+
             try:
-                with open(CONFIG_PATH, "w") as f:
-                    json.dump(existing, f)
+                _targets.update(_clear_skip)
                 log.info("Cleared skip_next_auto from %s", CONFIG_PATH)
             except Exception as e:
                 log.error("Failed to clear skip_next_auto: %s", e)
@@ -433,16 +437,9 @@ def main() -> None:
     # Preserve last_full_charge (set by battery_controller on completion); only the
     # full_charge flag and the daily values are owned by this script.
     try:
-        with open(CONFIG_PATH) as f:
-            targets = json.load(f)
-    except Exception:
-        targets = {}
-    targets["target_soc"] = target_soc
-    targets["daily_charge_current"] = daily_charge_current
-    targets["full_charge"] = full_charge
-    try:
-        with open(CONFIG_PATH, "w") as f:
-            json.dump(targets, f)
+        _targets.update(lambda t: t.update(target_soc=target_soc,
+                                           daily_charge_current=daily_charge_current,
+                                           full_charge=full_charge))
         log.info(
             "Wrote targets to %s: target_soc=%d%%  daily_charge_current=%.0f A  full_charge=%s",
             CONFIG_PATH, target_soc, daily_charge_current, full_charge,
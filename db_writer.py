@@ -8,9 +8,20 @@ The raw-tier dump (Growatt regs 0–95, INFLUX_BUCKET_RAW) is only written on
 the minute boundary — high-resolution truth isn't useful for unknown-register
 recovery, and it's the heaviest write per tick.
 
+After the first fetch, each tick asks modbus_api only for what changed
+(``/registers?since=<seq>``) and merges that into a local copy of the
+image, so a quiet tick transfers and decodes a handful of registers instead
+of all of them. A restart of either side, or a gap longer than modbus_api's
+snapshot ring, falls back to one full fetch.
+
+Registers of additional inverters (devices.yaml) arrive with a device
+prefix ("growatt2:17"); they are mapped through the same regmap.yaml entries
+and written with a `device` tag. The original two inverters' keys are bare
+and their points untagged, so existing series continue unchanged.
+
 Log levels
 ----------
-  DEBUG  — raw register dict, per-point transforms, schema misses
+  DEBUG  — raw register dict, per-point transforms, schema misses, delta sizes
   INFO   — startup configuration, per-tick write summary (N points, elapsed time)
   WARNING — fetch failure, empty result sets
   ERROR  — InfluxDB write failure
@@ -21,7 +32,7 @@ import os
 import time
 import atexit
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Mapping, Optional, Tuple
 
 import requests
 import yaml
@@ -30,7 +41,9 @@ import influxdb_client
 from influxdb_client import Point
 from influxdb_client.client.write_api import SYNCHRONOUS
 
+from api_client import ApiClient
 from log_config import get_logger
+from regpack import ACCEPT_HEADER, decode as decode_registers
 
 log = get_logger("db_writer")
 
@@ -39,6 +52,9 @@ log = get_logger("db_writer")
 _API_PORT: int = int(os.getenv("MODBUS_API_PORT", "5004"))
 API_URL: str   = f"http://modbus_api:{_API_PORT}/registers"
 
+# Keep-alive session: a 30 s tick reuses one connection instead of opening one.
+_api = ApiClient("db_writer", timeouts={"/registers": 8.0})
+
 SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regmap.yaml")
 
 INFLUX_URL        = os.environ["INFLUX_URL"]
@@ -54,6 +70,9 @@ INFLUX_BUCKET_RAW = os.getenv("INFLUX_BUCKET_RAW") or None
 # input range. PowMr regs (hex-keyed "0x...") are never in this set.
 GROWATT_RAW_KEYS = frozenset(str(n) for n in range(0, 96))
 
+# Raw-tier device tag for the unprefixed decimal-keyed registers.
+LEGACY_RAW_DEVICE = "growatt"
+
 # ── InfluxDB client ───────────────────────────────────────────────────────────
 
 _influx_client = influxdb_client.InfluxDBClient(
@@ -66,16 +85,78 @@ atexit.register(lambda: _influx_client.close())
 # ── Fetch ─────────────────────────────────────────────────────────────────────
 
 
-def fetch_registers() -> Optional[Dict[str, int]]:
+class RegisterMirror:
+    """Local copy of modbus_api's register image, kept current from deltas."""
+
+    def __init__(self) -> None:
+        self.values: Dict[str, int] = {}
+        self.seq:    Optional[str]  = None   # X-Snapshot-Seq of the last response
+        self.epoch:  Optional[str]  = None
+
+    def params(self) -> Dict[str, str]:
+        """Query parameters for the next fetch: a delta request once synced."""
+        if self.seq is None:
+            return {}
+        params = {"since": self.seq}
+        if self.epoch is not None:
+            params["epoch"] = self.epoch
+        return params
+
+    def reset(self) -> None:
+        self.values, self.seq, self.epoch = {}, None, None
+
+    def apply(self, data: Mapping[str, int], headers: Mapping[str, str]) -> bool:
+        """Merge a /registers response; False if it was a delta against another base."""
+        base = headers.get("X-Snapshot-Base")
+        if base is None:
+            self.values = dict(data)
+        elif base == self.seq:
+            self.values.update(data)
+        else:
+            return False
+        self.seq   = headers.get("X-Snapshot-Seq")
+        self.epoch = headers.get("X-Snapshot-Epoch")
+        log.debug("Snapshot #%s: %s %d register(s)", self.seq,
+                  "full image," if base is None else f"delta from #{base},", len(data))
+        return True
+
+
+_mirror = RegisterMirror()
+
+
+def fetch_registers() -> Optional[Tuple[Mapping[str, int], float]]:
+    """Fetch all registers; return (data, age_s) or None on failure.
+
+    *data* maps "0x0100" / "17" keys to ints: the full image, assembled from
+    the delta modbus_api sent (any payload regpack.decode understands, or
+    JSON). *age_s* is how old modbus_api's snapshot was when it answered
+    (its X-Snapshot-Age header; 0 for a server without the snapshot store).
+    """
     try:
-        r = requests.get(API_URL, timeout=8)
+        r = _api.get(API_URL, params=_mirror.params(), headers={"Accept": ACCEPT_HEADER})
         r.raise_for_status()
-        data = r.json()
-        if not isinstance(data, dict):
+        try:
+            data = decode_registers(r.headers.get("Content-Type", ""), r.content)
+        except ValueError as e:
+            log.warning("Undecodable register payload from modbus_api: %s", e)
+            return None
+        if data is None:
+            data = r.json()
+        if not isinstance(data, Mapping):
             log.warning("Unexpected response type from modbus_api: %s", type(data).__name__)
             return None
-        log.debug("Fetched %d registers from modbus_api", len(data))
-        return data
+        if not _mirror.apply(data, r.headers):
+            log.warning("Delta from modbus_api does not match snapshot #%s — refetching in full",
+                        _mirror.seq)
+            _mirror.reset()
+            return fetch_registers()
+        try:
+            age_s = float(r.headers.get("X-Snapshot-Age", 0.0))
+        except ValueError:
+            age_s = 0.0
+        log.debug("Fetched %d registers from modbus_api (snapshot age %.1f s)",
+                  len(_mirror.values), age_s)
+        return _mirror.values, age_s
     except requests.RequestException as e:
         log.warning("Register fetch failed: %s", e)
         return None
@@ -117,6 +198,24 @@ def combine_auto(reg_key: str, left_val: int, right_val: int) -> int:
     return combine_uint32(left_val, right_val)
 
 
+# ── Device namespaces ─────────────────────────────────────────────────────────
+
+
+def split_by_device(data: Mapping[str, int]) -> Dict[str, Mapping[str, int]]:
+    """Group "<device>:<key>" registers by device, prefix stripped.
+
+    Bare keys (the original PowMr + Growatt) are grouped under "". When
+    nothing is prefixed, *data* itself is returned as that group.
+    """
+    if not any(":" in k for k in data):
+        return {"": data}
+    groups: Dict[str, Dict[str, int]] = {}
+    for k, v in data.items():
+        device, _, reg = k.rpartition(":")
+        groups.setdefault(device, {})[reg] = v
+    return groups
+
+
 # ── Point construction ────────────────────────────────────────────────────────
 
 
@@ -126,6 +225,7 @@ def build_point(
     meta: Dict[str, Any],
     value: float,
     raw_int: int,
+    device: Optional[str] = None,
 ) -> Point:
     # Tags are case-sensitive in InfluxDB. regmap.yaml + modbus_api now both
     # produce lowercase reg keys, so .lower() is a no-op under normal flow —
@@ -137,18 +237,22 @@ def build_point(
         p = p.tag("name", str(meta["name"]))
     if "unit" in meta:
         p = p.tag("unit", str(meta["unit"]))
+    if device:
+        p = p.tag("device", device)
     return p.field("value", float(value)).field("raw", int(raw_int))
 
 
 def transform_to_points(
     ts_ns: int,
-    data: Dict[str, int],
+    data: Mapping[str, int],
     schema: Dict[str, Any],
+    device: Optional[str] = None,
 ) -> List[Point]:
     """Convert raw register data to InfluxDB Points using the regmap schema.
 
-    *ts_ns* is captured before the fetch call so the timestamp reflects when
-    the measurement was initiated, not when it was processed.
+    *ts_ns* is the time the registers were read on the bus (fetch time minus
+    the snapshot age), not when they were processed. *data* holds one
+    device's bare keys; a *device* name tags the points.
     """
     out: List[Point] = []
     skipped = 0
@@ -168,7 +272,7 @@ def transform_to_points(
             raw32 = combine_auto(key, int(data[left]), int(data[right]))
             val   = float(raw32) * scale
             log.debug("Point: %-30s = %.3f %s  (raw32=%d)", name, val, meta.get("unit", ""), raw32)
-            out.append(build_point(ts_ns, key, meta, val, raw32))
+            out.append(build_point(ts_ns, key, meta, val, raw32, device))
             continue
 
         if key not in data:
@@ -181,7 +285,7 @@ def transform_to_points(
         log.debug(
             "Point: %-30s = %.3f %s  (raw=%d)", name, scaled_val, meta.get("unit", ""), raw
         )
-        out.append(build_point(ts_ns, key, meta, scaled_val, raw))
+        out.append(build_point(ts_ns, key, meta, scaled_val, raw, device))
 
     if skipped:
         log.debug("%d schema key(s) skipped (registers absent in this fetch)", skipped)
@@ -189,7 +293,9 @@ def transform_to_points(
     return out
 
 
-def transform_to_raw_points(ts_ns: int, data: Dict[str, int]) -> List[Point]:
+def transform_to_raw_points(
+    ts_ns: int, data: Mapping[str, int], device: str = LEGACY_RAW_DEVICE,
+) -> List[Point]:
     """Build raw-tier points for every Growatt input register in the fetch.
 
     Stored as uint16 with no scale, no name, no pair decoding — wire-level truth
@@ -204,7 +310,7 @@ def transform_to_raw_points(ts_ns: int, data: Dict[str, int]) -> List[Point]:
             Point("modbus_raw")
                 .time(ts_ns)
                 .tag("reg", k.lower())
-                .tag("device", "growatt")
+                .tag("device", device)
                 .field("value", int(v))
         )
     return out
@@ -286,14 +392,18 @@ def main() -> None:
                   tick_time.strftime("%H:%M:%S"),
                   "  (raw-tier write due)" if raw_due else "")
 
-        # Capture timestamp *before* the fetch so InfluxDB points reflect
-        # when the measurement was initiated, not when it was processed.
-        ts_ns         = int(datetime.now(timezone.utc).timestamp() * 1e9)
-        register_data = fetch_registers()
+        # modbus_api answers from its poller snapshot and reports how old it
+        # is, so stamp points with when the registers were actually read —
+        # not when this tick fetched or processed them.
+        fetched = fetch_registers()
 
-        if register_data is not None:
+        if fetched is not None:
+            register_data, age_s = fetched
+            ts_ns = int((datetime.now(timezone.utc).timestamp() - age_s) * 1e9)
+            devices = split_by_device(register_data)
             try:
-                points = transform_to_points(ts_ns, register_data, schema)
+                points = [p for device, data in devices.items()
+                          for p in transform_to_points(ts_ns, data, schema, device or None)]
                 if points:
                     write_points(points)
                 else:
@@ -307,7 +417,8 @@ def main() -> None:
 
             if raw_due:
                 try:
-                    raw_points = transform_to_raw_points(ts_ns, register_data)
+                    raw_points = [p for device, data in devices.items()
+                                  for p in transform_to_raw_points(ts_ns, data, device or LEGACY_RAW_DEVICE)]
                     if raw_points:
                         write_points(raw_points, bucket=INFLUX_BUCKET_RAW)
                 except Exception as e:
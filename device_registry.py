@@ -0,0 +1,166 @@
+"""Device registry: devices.yaml → the inverters modbus_api serves.
+
+Each entry names a wire profile from device_profiles.yaml (which fixes the
+register type, the block plan and — through the profile's key_format — the
+regmap.yaml range table) and says how to find the device's USB-serial
+adapter.  modbus_api builds one serial session, bus thread and bus
+scheduler per entry, so adding an inverter on another adapter is a config
+change, and its reads overlap with every other device's.
+
+Register keys in /registers are namespaced per device: ``"<name>:<key>"``
+("growatt2:17", "powmr2:0x0100").  Devices marked ``unprefixed`` keep the
+bare keys ("0x0100", "17") the original two-inverter setup used; two
+unprefixed devices with the same key format would collide, so that is
+rejected at load time.
+
+Run directly to print the registry:
+
+    python device_registry.py
+
+Log levels
+----------
+  (none — modbus_api logs discovery and plans)
+"""
+from __future__ import annotations
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional
+
+import yaml
+
+from register_plan import DeviceProfile, load_profiles
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+DEVICES_PATH = os.path.join(_HERE, "devices.yaml")
+
+_NAME_RE = re.compile(r"^[a-z0-9_]+$")
+
+
+@dataclass(frozen=True)
+class AdapterMatch:
+    """USB identity of a serial adapter, as reported by pyserial's comports()."""
+    vid:           int
+    pid:           int
+    serial_number: Optional[str] = None
+    location:      Optional[str] = None
+
+    def matches(self, port_info: Any) -> bool:
+        if port_info.vid != self.vid or port_info.pid != self.pid:
+            return False
+        if self.serial_number is not None and port_info.serial_number != self.serial_number:
+            return False
+        if self.location is not None and port_info.location != self.location:
+            return False
+        return True
+
+    def __str__(self) -> str:
+        text = f"VID=0x{self.vid:04X}  PID=0x{self.pid:04X}"
+        if self.serial_number is not None:
+            text += f"  serial={self.serial_number}"
+        if self.location is not None:
+            text += f"  location={self.location}"
+        return text
+
+
+@dataclass(frozen=True)
+class DeviceConfig:
+    name:       str
+    label:      str
+    profile:    DeviceProfile
+    adapter:    Optional[AdapterMatch]
+    port:       Optional[str]     # fixed serial path; skips USB discovery
+    port_env:   str               # env var overriding the port at runtime
+    key_prefix: str               # "" for unprefixed devices, else "<name>:"
+    recover:    bool              # rebuild + retry once on a failed read
+    unit_id:    int               # Modbus TCP gateway unit id
+
+    def key(self, addr: int) -> str:
+        """/registers key for *addr*: "0x0100" / "17", prefixed unless legacy."""
+        if self.profile.key_format == "hex":
+            return f"{self.key_prefix}0x{addr:04x}"
+        return f"{self.key_prefix}{addr}"
+
+
+def _adapter(raw: Optional[Mapping[str, Any]], name: str) -> Optional[AdapterMatch]:
+    if raw is None:
+        return None
+    try:
+        return AdapterMatch(
+            vid=int(raw["vid"]),
+            pid=int(raw["pid"]),
+            serial_number=str(raw["serial_number"]) if raw.get("serial_number") is not None else None,
+            location=str(raw["location"]) if raw.get("location") is not None else None,
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"devices.yaml: {name}: adapter needs integer vid and pid ({e})") from None
+
+
+def load_devices(
+    path: str = DEVICES_PATH, profiles: Optional[Dict[str, DeviceProfile]] = None,
+) -> Dict[str, DeviceConfig]:
+    """Parse and validate devices.yaml, in file order."""
+    if profiles is None:
+        profiles = load_profiles()
+    with open(path, encoding="utf-8") as f:
+        raw = (yaml.safe_load(f) or {}).get("devices") or {}
+
+    devices: Dict[str, DeviceConfig] = {}
+    unprefixed: Dict[str, str] = {}   # key_format → device name
+    units: Dict[int, str] = {}        # unit id → device name
+    for index, (name, d) in enumerate(raw.items()):
+        name = str(name)
+        d = d or {}
+        if not _NAME_RE.match(name):
+            raise ValueError(f"devices.yaml: device name {name!r} must match [a-z0-9_]+")
+        profile = profiles.get(str(d.get("profile", name)))
+        if profile is None:
+            raise ValueError(f"devices.yaml: {name}: unknown profile {d.get('profile', name)!r}")
+        adapter = _adapter(d.get("adapter"), name)
+        port = d.get("port")
+        if adapter is None and not port:
+            raise ValueError(f"devices.yaml: {name}: needs an adapter match or a port")
+
+        prefix = ""
+        if d.get("unprefixed"):
+            other = unprefixed.setdefault(profile.key_format, name)
+            if other != name:
+                raise ValueError(
+                    f"devices.yaml: {name} and {other} are both unprefixed with "
+                    f"{profile.key_format} keys — their /registers keys would collide"
+                )
+        else:
+            prefix = f"{name}:"
+
+        unit_id = int(d.get("unit_id", index + 1))
+        if not 1 <= unit_id <= 247:
+            raise ValueError(f"devices.yaml: {name}: unit_id must be 1..247 (got {unit_id})")
+        other = units.setdefault(unit_id, name)
+        if other != name:
+            raise ValueError(f"devices.yaml: {name} and {other} share unit_id {unit_id}")
+
+        devices[name] = DeviceConfig(
+            name=name,
+            label=str(d.get("label", name)),
+            profile=profile,
+            adapter=adapter,
+            port=str(port) if port else None,
+            port_env=str(d.get("port_env", f"MODBUS_{name.upper()}_PORT")),
+            key_prefix=prefix,
+            recover=bool(d.get("recover", False)),
+            unit_id=unit_id,
+        )
+    if not devices:
+        raise ValueError(f"{path}: no devices configured")
+    return devices
+
+
+if __name__ == "__main__":
+    for _dev in load_devices().values():
+        _where = _dev.port or str(_dev.adapter)
+        print(f"{_dev.name}: {_dev.label}, profile {_dev.profile.name} "
+              f"({_dev.profile.function}, {_dev.profile.key_format} keys "
+              f"{'unprefixed' if not _dev.key_prefix else repr(_dev.key_prefix)})")
+        print(f"  port: {_where}  (override: ${_dev.port_env})  unit {_dev.unit_id}"
+              f"{'  recover' if _dev.recover else ''}")
@@ -15,34 +15,52 @@ Log levels
 from __future__ import annotations
 
 import asyncio
+import functools
 import json
+import math
 import os
 import sys
+import time
 import hmac
-from contextlib import nullcontext
+from collections import ChainMap
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 from enum import IntEnum
 from pathlib import Path
-from typing import Dict, Iterable, List, Tuple
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, TypeVar
 
 import pymodbus.client as modbusClient
-import serial.tools.list_ports
 import uvicorn
-from fastapi import Depends, FastAPI, Form, HTTPException, Request, status
-from fastapi.responses import HTMLResponse
+from fastapi import Depends, FastAPI, Form, HTTPException, Query, Request, Response, status
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.templating import Jinja2Templates
 
+from bus_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, BusMetrics, MeteredClient
+from device_registry import DeviceConfig, load_devices
 from log_config import get_logger
+from modbus_gateway import FC_READ_HOLDING, FC_READ_INPUT, GatewayUnit, ModbusTcpGateway
+from modbus_bus import BusClass, BusScheduler, BusWorker, SerialSession, SingleFlight
+from port_resolver import PortResolver
+from range_check import RangeTable, RangeViolation
+from regpack import KIND_DEC, KIND_HEX, MEDIA_TYPE as REGPACK_MEDIA_TYPE, RegisterImage, negotiate
+from register_plan import format_blocks, load_plans, load_regmap
+from register_store import ConfigCache, RegisterSnapshot, SnapshotStore
+from targets_store import TargetsStore
 
 log = get_logger("modbus_api")
 
+T = TypeVar("T")
+
 # ── Auth configuration ────────────────────────────────────────────────────────
 
 VALID_USERNAME = os.getenv("BASIC_AUTH_USER")
 VALID_PASSWORD = os.getenv("BASIC_AUTH_PASS")
 CONFIG_PATH    = os.getenv("CONFIG_PATH", "/app/targets.json")
 
+# Shared with battery_controller and daily_target: atomic, locked writes.
+_targets = TargetsStore(CONFIG_PATH)
+
 if not VALID_USERNAME or not VALID_PASSWORD:
     log.warning(
         "BASIC_AUTH_USER or BASIC_AUTH_PASS is not set — "
@@ -78,52 +96,116 @@ class ChargingPriority(IntEnum):
 
 # ── Register maps ─────────────────────────────────────────────────────────────
 
-POWMR_HOLDING_BLOCKS: Tuple[Tuple[int, int], ...] = (
-    # Read only the ranges that contain registers in POWMR_REQUIRED.
-    # Bulk reads (count=32) fail with IllegalAddress when the block
-    # spans non-existent registers on some PowMr models.
-    (0x0100, 3),    # 0x0100–0x0102  battery SoC, voltage, current
-    (0x0107, 3),    # 0x0107–0x0109  PV1 voltage, current, power
-    (0x010F, 3),    # 0x010F–0x0111  PV2 voltage, current, power
-    (0x0213, 10),   # 0x0213–0x021C  grid/inverter V & freq, load L1
-    (0x0220, 3),    # 0x0220–0x0222  DC-DC, inverter, transformer temps
-    (0x022A, 3),    # 0x022A–0x022C  grid V L2, inverter V L2
-    (0x0232, 3),    # 0x0232–0x0234  load active L2, load apparent L2
-    (0x023D, 2),    # 0x023D–0x023E  grid power L1, L2
-    (0xF02D, 4),    # 0xF02D–0xF030  daily counters
-    (0xF034, 10),   # 0xF034–0xF03D  cumulative + daily grid/batt
-)
-
-GROWATT_INPUT_BLOCKS: Tuple[Tuple[int, int], ...] = (
-    (0, 96),        # 0..95
-)
+# Block reads are planned from regmap.yaml + device_profiles.yaml by
+# register_plan: registers are merged into one read when the gap costs less
+# wire time than another round trip, but never across an address the
+# profile marks illegal (bulk reads fail with IllegalAddress when a block
+# spans non-existent registers on some PowMr models). Add a register to
+# regmap.yaml and the blocks follow; `fast: true` puts it in the fast tier.
+#
+# Which inverters exist, and which profile each uses, comes from
+# devices.yaml (device_registry.py). Each device's /registers whitelist is
+# its plan's `exposed` set: regmap entries plus the profile's raw_range, so
+# unknown Growatt registers land in db_writer's raw tier.
+_PLANS   = load_plans()
+_CONFIGS = load_devices(profiles={name: plan.profile for name, plan in _PLANS.items()})
+if "powmr" not in _CONFIGS:
+    raise RuntimeError("devices.yaml: the control inverter 'powmr' is not configured")
+
+for _cfg in _CONFIGS.values():
+    _plan = _PLANS[_cfg.profile.name]
+    log.info("%s read plan: %d block(s), ~%.0f ms/cycle — %s", _cfg.name, len(_plan.blocks),
+             _plan.cycle_s * 1000, format_blocks(_plan.blocks, _plan.profile.key_format))
+
+# The fast tier of the control inverter — what battery_controller polls.
+POWMR_FAST_ADDRS:  Tuple[int, ...]             = _PLANS[_CONFIGS["powmr"].profile.name].fast_addrs
+POWMR_FAST_BLOCKS: Tuple[Tuple[int, int], ...] = _PLANS[_CONFIGS["powmr"].profile.name].fast_blocks
+
+# ── Background poller configuration ──────────────────────────────────────────
+#
+# The poller owns every bus: it refreshes the five control registers every
+# POLL_FAST_S and every block of every device every POLL_FULL_S, publishing each
+# read to the snapshot store. /registers and /limited_registers answer from
+# the snapshot as long as it is younger than the caller's `max_age`, and only
+# fall back to a serial read when it isn't — so bus load no longer grows with
+# the number of readers. POLLER_ENABLED=0 restores read-on-request behaviour
+# (the snapshot is then only as fresh as the last request that read the bus).
+
+POLLER_ENABLED: bool = os.getenv("POLLER_ENABLED", "1").lower() not in ("0", "false", "no")
+POLL_FAST_S:    float = float(os.getenv("POLL_FAST_S", "2"))
+POLL_FULL_S:    float = float(os.getenv("POLL_FULL_S", "10"))
+
+# Default `max_age` for each endpoint — two poll periods, so one missed poll
+# is absorbed without falling through to the bus.
+LIMITED_MAX_AGE_S: float = 2 * POLL_FAST_S
+FULL_MAX_AGE_S:    float = 2 * POLL_FULL_S
+
+# Configuration registers (priorities, charge current) are re-read from the
+# device every CONFIG_VERIFY_S; the get endpoints and the skip-if-unchanged
+# check trust the cache for up to two verification periods.
+CONFIG_VERIFY_S:  float = float(os.getenv("CONFIG_VERIFY_S", "300"))
+CONFIG_MAX_AGE_S: float = 2 * CONFIG_VERIFY_S
+
+# /stream: SSE comment sent when nothing changed for this long, so proxies
+# keep the connection open and dead clients are noticed.
+STREAM_KEEPALIVE_S:     float = float(os.getenv("STREAM_KEEPALIVE_S", "15"))
+STREAM_MAX_SUBSCRIBERS: int   = int(os.getenv("STREAM_MAX_SUBSCRIBERS", "32"))
+
+# /registers?since=N: snapshots kept for delta responses. Publishes run at
+# roughly one per fast poll plus one per device per full poll, so the default
+# covers a few minutes — longer than any client's poll interval.
+SNAPSHOT_HISTORY: int = int(os.getenv("SNAPSHOT_HISTORY", "128"))
+
+# Modbus TCP gateway (modbus_gateway.py) — off unless MODBUS_TCP_PORT is set.
+# Modbus TCP has no authentication, so the gateway is read-only unless
+# MODBUS_TCP_WRITES=1; otherwise FC06/FC16 would bypass the Basic auth that
+# guards /set_* and /write_batch.
+GATEWAY_PORT:        int  = int(os.getenv("MODBUS_TCP_PORT") or 0)
+GATEWAY_HOST:        str  = os.getenv("MODBUS_TCP_HOST", "127.0.0.1")
+GATEWAY_MAX_CLIENTS: int  = int(os.getenv("MODBUS_TCP_MAX_CLIENTS", "16"))
+GATEWAY_WRITES:      bool = os.getenv("MODBUS_TCP_WRITES", "0").lower() in ("1", "true", "yes")
 
-POWMR_REQUIRED: Tuple[int, ...] = (
-    0x0100, 0x0101, 0x0102,
-    0x0107, 0x0108, 0x0109,
-    0x010F, 0x0110, 0x0111,
-    0x0213, 0x022A, 0x0216, 0x022C, 0x0215, 0x0218,
-    0x021B, 0x0232, 0x021C, 0x0234, 0x023D, 0x023E,
-    0x0220, 0x0221, 0x0222,
-    0xF02D, 0xF02E, 0xF02F, 0xF030, 0xF03C, 0xF03D,
-    0xF034, 0xF035, 0xF036, 0xF037, 0xF038, 0xF039, 0xF03A, 0xF03B,
-)
+# ── FastAPI setup ─────────────────────────────────────────────────────────────
 
-POWMR_FAST_ADDRS: Tuple[int, ...] = (0x0100, 0x0101, 0x0102, 0x021C, 0x0234)
 
-# Full Growatt input register range exposed by /registers. The same range is
-# already read on the wire (see GROWATT_INPUT_BLOCKS); we just stopped filtering
-# it down. Registers without a regmap.yaml entry land in the raw tier
-# (modbus_raw measurement) so unknowns stay recoverable for later analysis.
-GROWATT_RAW_RANGE: Tuple[int, ...] = tuple(range(0, 96))
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    pollers: List[asyncio.Task] = []
+    if POLLER_ENABLED:
+        log.info("Register poller: fast every %.1f s, full every %.1f s", POLL_FAST_S, POLL_FULL_S)
+        # One full poller per device — each on its own bus, so they run in
+        # parallel — plus the control inverter's fast tier.
+        pollers = [
+            asyncio.create_task(_poll_loop(_POWMR.fast_region, POLL_FAST_S,
+                                           functools.partial(_refresh_fast, _POWMR))),
+            *(asyncio.create_task(_poll_loop(dev.full_region, POLL_FULL_S,
+                                             functools.partial(_refresh_full, dev)))
+              for dev in _DEVICES.values()),
+            asyncio.create_task(_config_verify_loop(CONFIG_VERIFY_S)),
+        ]
+    else:
+        log.info("Register poller disabled (POLLER_ENABLED=0) — reads go to the bus on demand")
+    if GATEWAY_PORT:
+        await _start_gateway()
+    yield
+    if _gateway is not None:
+        await _gateway.stop()
+    for task in pollers:
+        task.cancel()
+    await asyncio.gather(*pollers, return_exceptions=True)
+    # Let in-flight serial transactions finish so the ports close cleanly.
+    for dev in _DEVICES.values():
+        dev.bus.shutdown()
+    for dev in _DEVICES.values():
+        dev.session.close()
 
-# ── FastAPI setup ─────────────────────────────────────────────────────────────
 
 app = FastAPI(
     title="Modbus Register API",
     description="Reads/writes inverter Modbus registers on behalf of other services.",
+    lifespan=_lifespan,
 )
-templates = Jinja2Templates(directory="/app")
+templates = Jinja2Templates(directory=str(Path(__file__).resolve().parent))   # /app in the container
 security  = HTTPBasic()
 
 # ── Modbus helpers ────────────────────────────────────────────────────────────
@@ -181,18 +263,17 @@ def _read_input_blocks(
     return out
 
 
-def _as_hex_dict(
-    raw: Dict[int, int], whitelist: Iterable[int]
-) -> Dict[str, int]:
-    w = set(whitelist)
-    return {f"0x{a:04x}": raw[a] for a in sorted(raw) if a in w}
+_BLOCK_READERS: Dict[str, Callable[..., Dict[int, int]]] = {
+    "holding": _read_holding_blocks,
+    "input":   _read_input_blocks,
+}
 
 
-def _as_dec_dict(
-    raw: Dict[int, int], whitelist: Iterable[int]
+def _as_hex_dict(
+    raw: Mapping[int, int], whitelist: Iterable[int]
 ) -> Dict[str, int]:
     w = set(whitelist)
-    return {str(a): raw[a] for a in sorted(raw) if a in w}
+    return {f"0x{a:04x}": raw[a] for a in sorted(raw) if a in w}
 
 
 # ── Range validation ──────────────────────────────────────────────────────────
@@ -203,153 +284,158 @@ def _as_dec_dict(
 # would act on / record those values. With it, an out-of-range read fails
 # the whole request (HTTP 500) and the next request gets a fresh drain.
 #
-# Tuples are (scale, signed, min_real, max_real). Real values are computed
-# as raw * scale (with signed conversion when applicable). Combined 32-bit
-# Growatt keys (e.g. "3-4") combine as (raw[left] << 16) | raw[right].
-
-_REAL_RANGES: Dict[str, Tuple[float, bool, float, float]] = {
-    # PowMr (hex)
-    "0x0100": (1.0,  False,      0,    100),  # battery_soc (%)
-    "0x0101": (0.1,  False,     45,     65),  # battery_voltage_powmr (V)
-    "0x0102": (0.1,  True,    -300,    300),  # battery_current_powmr (A)
-    "0x0107": (0.1,  False,      0,    600),  # pv1_voltage (V)
-    "0x0108": (0.1,  False,      0,     25),  # pv1_current (A)
-    "0x0109": (1.0,  False,      0,   6000),  # pv1_power (W)
-    "0x010f": (0.1,  False,      0,    600),  # pv2_voltage (V)
-    "0x0110": (0.1,  False,      0,     25),  # pv2_current (A)
-    "0x0111": (1.0,  False,      0,   6000),  # pv2_power (W)
-    "0x0213": (0.1,  False,     50,    120),  # grid_voltage_l1 (V)
-    "0x0215": (0.01, False,     55,     65),  # grid_frequency (Hz)
-    "0x0216": (0.1,  False,     50,    120),  # inverter_voltage_l1 (V)
-    "0x0218": (0.01, False,     55,     65),  # inverter_frequency (Hz)
-    "0x021b": (1.0,  False,      0,  20000),  # load_active_l1 (W)
-    "0x021c": (1.0,  False,      0,  20000),  # load_apparent_l1 (W)
-    "0x0220": (0.1,  False,    -20,    120),  # temp_dcdc_powmr (C)
-    "0x0221": (0.1,  False,    -20,    120),  # temp_inverter_powmr (C)
-    "0x0222": (0.1,  False,    -20,    120),  # temp_transformer_powmr (C)
-    "0x022a": (0.1,  False,     50,    120),  # grid_voltage_l2 (V)
-    "0x022c": (0.1,  False,     50,    120),  # inverter_voltage_l2 (V)
-    "0x0232": (1.0,  False,      0,  20000),  # load_active_l2 (W)
-    "0x0234": (1.0,  False,      0,  20000),  # load_apparent_l2 (W)
-    "0x023d": (1.0,  True,  -20000,  20000),  # grid_l1 (W)
-    "0x023e": (1.0,  True,  -20000,  20000),  # grid_l2 (W)
-    # Growatt single-register (decimal)
-    "1":     (0.1,  False,       0,    600),  # pv3_voltage (V)
-    "2":     (0.1,  False,       0,    600),  # pv4_voltage (V)
-    "7":     (0.1,  False,       0,     25),  # pv3_current (A)
-    "8":     (0.1,  False,       0,     25),  # pv4_current (A)
-    "17":    (0.01, False,      45,     65),  # battery_voltage_growatt (V)
-    "25":    (0.1,  True,      -20,    120),  # temp_inverter_growatt (C)
-    "26":    (0.1,  True,      -20,    120),  # temp_dcdc_growatt (C)
-    "32":    (0.1,  True,      -20,    120),  # temp_buck1_growatt (C)
-    "33":    (0.1,  True,      -20,    120),  # temp_buck2_growatt (C)
-    "83":    (0.1,  False,       0,    300),  # battery_current_growatt_charge (A)
-    "84":    (0.1,  False,       0,    300),  # battery_current_growatt_draw (A)
-    # Growatt combined 32-bit (left << 16 | right)
-    "3-4":   (0.1,  False,       0,   6000),  # pv3_power (W)
-    "5-6":   (0.1,  False,       0,   6000),  # pv4_power (W)
-}
+# Bands are the min/max of each regmap.yaml entry, compiled once per device
+# into raw-domain integer tables (see range_check.py) from the entries
+# matching the device profile's key format. Combined 32-bit Growatt keys
+# (e.g. "3-4") combine as (raw[left] << 16) | raw[right].
 
-
-def _real_value(raw: int, scale: float, signed: bool) -> float:
-    if signed and raw >= 0x8000:
-        raw -= 0x10000
-    return raw * scale
-
-
-def _real_value_pair(hi: int, lo: int, scale: float, signed: bool) -> float:
-    combined = ((hi & 0xFFFF) << 16) | (lo & 0xFFFF)
-    if signed and combined >= 0x80000000:
-        combined -= 0x100000000
-    return combined * scale
-
-
-def _check_powmr_ranges(raw: Dict[int, int]) -> None:
-    """Raise RuntimeError if any PowMr value in `raw` falls outside its known band."""
-    for key, (scale, signed, lo, hi) in _REAL_RANGES.items():
-        if not key.startswith("0x"):
-            continue
-        addr = int(key, 16)
-        if addr not in raw:
-            continue
-        real = _real_value(raw[addr], scale, signed)
-        if not (lo <= real <= hi):
-            log.error(
-                "PowMr value out of range: %s = %.3f (raw=%d); expected %s..%s",
-                key, real, raw[addr], lo, hi,
-            )
-            raise RuntimeError(
-                f"PowMr value out of range: {key}={real:.3f} (raw={raw[addr]}); expected {lo}..{hi}"
-            )
+_REGMAP = load_regmap()
 
 
-def _check_growatt_ranges(raw: Dict[int, int]) -> None:
-    """Raise RuntimeError if any Growatt value (single or combined) is out of band."""
-    for key, (scale, signed, lo, hi) in _REAL_RANGES.items():
-        if key.startswith("0x"):
-            continue
-        if "-" in key:
-            left, right = key.split("-", 1)
-            li, ri = int(left), int(right)
-            if li not in raw or ri not in raw:
-                continue
-            real = _real_value_pair(raw[li], raw[ri], scale, signed)
-            raw_disp = f"{raw[li]},{raw[ri]}"
-        else:
-            i = int(key)
-            if i not in raw:
-                continue
-            real = _real_value(raw[i], scale, signed)
-            raw_disp = str(raw[i])
-        if not (lo <= real <= hi):
-            log.error(
-                "Growatt value out of range: %s = %.3f (raw=%s); expected %s..%s",
-                key, real, raw_disp, lo, hi,
-            )
-            raise RuntimeError(
-                f"Growatt value out of range: {key}={real:.3f} (raw={raw_disp}); expected {lo}..{hi}"
-            )
+def _check_ranges(dev: "Device", raw: Dict[int, int]) -> None:
+    """Raise RangeViolation listing every value in `raw` outside its band."""
+    bad = dev.ranges.violations(raw)
+    if not bad:
+        return
+    for v in bad:
+        _metrics.range_rejections.inc(device=dev.name, register=v.key)
+        log.error("%s value out of range: %s", dev.label, v)
+    raise RangeViolation(dev.label, bad)
 
 
 # ── Modbus client initialisation ──────────────────────────────────────────────
-
-
-def get_modbus_client(
-    vid: int, pid: int, label: str
-) -> modbusClient.ModbusSerialClient | None:
-    port = next(
-        (p.device for p in serial.tools.list_ports.comports() if p.vid == vid and p.pid == pid),
-        None,
-    )
+#
+# Adapter lookups go through one PortResolver: the comports() scan is reused
+# until /dev changes, so a client rebuild (inside the bus slot, mid-recovery)
+# costs the port open rather than a sysfs walk.
+
+_ports = PortResolver()
+
+
+def _describe_port(port: str) -> str:
+    """*port*, plus the node it points at when it is a symlink (/dev/serial/by-id)."""
+    real = os.path.realpath(port)
+    return port if real == port else f"{port} → {real}"
+
+
+def get_modbus_client(cfg: DeviceConfig) -> modbusClient.ModbusSerialClient | None:
+    baud = cfg.profile.baud
+    # An explicit port path (e.g. a modbus_sim.py virtual port, or a stable
+    # /dev/serial/by-id link) bypasses USB discovery; the env var wins over
+    # devices.yaml.
+    port = os.getenv(cfg.port_env)
+    if port:
+        log.info("%s port from %s: %s", cfg.label, cfg.port_env, _describe_port(port))
+        return modbusClient.ModbusSerialClient(port=port, baudrate=baud, timeout=1)
+    if cfg.port:
+        log.info("%s port from devices.yaml: %s", cfg.label, _describe_port(cfg.port))
+        return modbusClient.ModbusSerialClient(port=cfg.port, baudrate=baud, timeout=1)
+    port = _ports.find(cfg.adapter)
     if not port:
         log.warning(
-            "%s device not found (VID=0x%04X  PID=0x%04X) — "
-            "related endpoints will return HTTP 500",
-            label, vid, pid,
+            "%s device not found (%s) — related endpoints will return HTTP 500",
+            cfg.label, cfg.adapter,
         )
         return None
-    log.info("%s device found: %s  (VID=0x%04X  PID=0x%04X)", label, port, vid, pid)
-    return modbusClient.ModbusSerialClient(port=port, baudrate=9600, timeout=1)
+    log.info("%s device found: %s  (%s)", cfg.label, _describe_port(port), cfg.adapter)
+    return modbusClient.ModbusSerialClient(port=port, baudrate=baud, timeout=1)
 
 
-# Module-level clients — found once at startup.
-# connect() / close() are called per-request to keep the shared bus clean.
+# ── Devices ───────────────────────────────────────────────────────────────────
+#
+# One `Device` per devices.yaml entry, built once at startup; the adapter is
+# looked up then and again on every client rebuild (from the cached scan).
+#
+# Each SerialSession owns one port's ModbusSerialClient. In the default
+# `per_request` mode connect() / close() wrap every transaction to keep the
+# shared bus clean; MODBUS_SESSION_MODE=persistent keeps the ports open and
+# lets the session's health score decide when to reopen the port or rebuild
+# the client (see modbus_bus.py). /stats reports per-transaction latency per
+# mode so the two can be compared.
 #
-# Concurrent access to the PowMr serial bus is serialised by `_powmr_lock`
-# below: every endpoint that touches `modbus` acquires it for the full
+# pymodbus' serial client is blocking, so no endpoint calls it directly:
+# every transaction runs on the device's BusWorker (one dedicated thread per
+# serial port). The event loop keeps serving HTTP while bytes are on the
+# wire, and transactions on different adapters overlap instead of queueing
+# behind each other — a /registers cycle takes as long as the slowest
+# device, not the sum of all of them.
+#
+# Access to each bus is additionally serialised by the device's
+# BusScheduler: every endpoint holds the device's bus slot for the full
 # connect → transact → close sequence. This prevents two coroutines from
 # racing inside the shared ModbusSerialClient when polls overlap (e.g.
-# db_writer's 30 s /registers vs battery_controller's 5 s /limited_registers).
+# db_writer's 30 s /registers vs battery_controller's 5 s
+# /limited_registers).
 #
-# Growatt (`modbus2`) is intentionally NOT locked — its access pattern has
-# never produced the race in practice, so we keep it untouched.
+# The slot is handed out by priority class (modbus_bus.BusClass): control
+# writes, then the control loop's fast reads, then bulk telemetry, then
+# debug reads. A bulk read checks between blocks whether anything more
+# urgent is queued and, if so, finishes its transaction early, gives up the
+# slot and requeues for the remaining blocks — so the control loop waits for
+# at most one block, not a whole /registers cycle.
+# modbus_queue_wait_seconds{class=...} on /metrics shows the per-class waits.
 #
-# Note: the lock is per-process. If the deployment ever moves to multiple
-# uvicorn workers, this protection no longer holds — keep --workers 1.
-modbus  = get_modbus_client(vid=6790,  pid=29987, label="PowMr")    # PowMr inverter
-modbus2 = get_modbus_client(vid=1250,  pid=5137,  label="Growatt")  # Growatt inverter
+# Note: the scheduler is per-process. If the deployment ever moves to
+# multiple uvicorn workers, this protection no longer holds — keep --workers 1.
+
+SESSION_MODE:    str   = os.getenv("MODBUS_SESSION_MODE", "per_request")
+SESSION_IDLE_S:  float = float(os.getenv("MODBUS_SESSION_IDLE_S", "60"))
+
+_KINDS: Dict[str, int] = {"hex": KIND_HEX, "dec": KIND_DEC}
+
+
+class Device:
+    """Runtime state of one configured inverter: plan, ranges, port and bus."""
+
+    def __init__(self, cfg: DeviceConfig) -> None:
+        self.cfg      = cfg
+        self.name     = cfg.name
+        self.label    = cfg.label
+        self.plan     = _PLANS[cfg.profile.name]
+        self.ranges   = RangeTable.from_regmap(cfg.label, _REGMAP, cfg.profile.key_format)
+        self.session  = SerialSession(cfg.label, lambda: get_modbus_client(cfg),
+                                      mode=SESSION_MODE, idle_reopen_s=SESSION_IDLE_S)
+        self.bus      = BusWorker(cfg.label)
+        self.sched    = BusScheduler(cfg.label)
+        # Requests outside these blocks are labelled block="other" on /metrics.
+        self.metered  = frozenset(self.plan.blocks) | frozenset(self.plan.fast_blocks)
+        # Telemetry counter — if this climbs steadily in steady state, the
+        # rebuild is masking a deeper bug rather than papering over
+        # transient desync.
+        self.rebuilds = 0
+        self.kind     = _KINDS[cfg.profile.key_format]
+        self.fast_region = f"{cfg.name}.fast"
+        self.full_region = f"{cfg.name}.full"
+        # The full block set covers the fast addresses, so a full read
+        # refreshes both regions.
+        self.full_regions: Tuple[str, ...] = (
+            (self.fast_region, self.full_region) if self.plan.fast_blocks else (self.full_region,)
+        )
+
+    def keyed(self, raw: Mapping[int, int], whitelist: Optional[Iterable[int]] = None) -> Dict[str, int]:
+        """*raw* as /registers keys, restricted to *whitelist* (default: plan.exposed)."""
+        w = set(self.plan.exposed if whitelist is None else whitelist)
+        key = self.cfg.key
+        return {key(a): raw[a] for a in sorted(raw) if a in w}
+
 
-_powmr_lock = asyncio.Lock()
+log.info("Serial session mode: %s", SESSION_MODE)
+_DEVICES: Dict[str, Device] = {name: Device(cfg) for name, cfg in _CONFIGS.items()}
+_POWMR = _DEVICES["powmr"]
+_ALL_REGIONS: Tuple[str, ...] = tuple(dev.full_region for dev in _DEVICES.values())
+
+# Bus telemetry served on /metrics. Every transaction hands `fn` a
+# MeteredClient, which records per-request latency, outcome and wire bytes.
+_metrics = BusMetrics()
+
+
+@asynccontextmanager
+async def _slot(dev: Device, op: str, cls: BusClass):
+    """Hold *dev*'s bus slot at priority *cls*, recording how long *op* waited."""
+    async with dev.sched.slot(cls) as waited:
+        _metrics.lock_wait_seconds.observe(waited, device=dev.name, op=op)
+        _metrics.queue_wait_seconds.observe(waited, device=dev.name, **{"class": cls.label})
+        yield
 
 # Latching readiness flag for `/health`. Once a single PowMr register read
 # succeeds, the bus is considered healthy and `/health` stops touching it.
@@ -357,94 +443,363 @@ _powmr_lock = asyncio.Lock()
 _ready: bool = False
 
 
-def connect_modbus() -> modbusClient.ModbusSerialClient:
-    if modbus is None:
-        raise HTTPException(status_code=500, detail="PowMr Modbus device not found at startup")
-    if not modbus.connect():
-        log.error("Failed to open serial connection to PowMr")
-        raise HTTPException(status_code=500, detail="Failed to connect to PowMr Modbus device")
-    return modbus
+def _connect(dev: Device) -> modbusClient.ModbusSerialClient:
+    if dev.session.client is None:
+        raise HTTPException(status_code=500, detail=f"{dev.label} Modbus device not found at startup")
+    if not dev.session.open():
+        log.error("Failed to open serial connection to %s", dev.label)
+        raise HTTPException(status_code=500, detail=f"Failed to connect to {dev.label} Modbus device")
+    return dev.session.client
 
 
-def connect_modbus2() -> modbusClient.ModbusSerialClient:
-    if modbus2 is None:
-        raise HTTPException(status_code=500, detail="Growatt Modbus device not found at startup")
-    if not modbus2.connect():
-        log.error("Failed to open serial connection to Growatt")
-        raise HTTPException(status_code=500, detail="Failed to connect to Growatt Modbus device")
-    return modbus2
+def _transaction(dev: Device, fn: Callable[[modbusClient.ModbusSerialClient], T]) -> T:
+    """Run `fn(client)` as one transaction on *dev* (connect → transact → close
+    in per_request mode; on the open port in persistent mode).
+
+    Blocking — call via `dev.bus.run(...)` while holding the device's bus slot.
+    """
+    started = time.perf_counter()
+    client = _connect(dev)
+    ok = False
+    try:
+        result = fn(MeteredClient(client, dev.name, _metrics, dev.metered))
+        ok = True
+        return result
+    finally:
+        elapsed = time.perf_counter() - started
+        _metrics.transaction_seconds.observe(elapsed, device=dev.name)
+        if dev.session.finish(elapsed, ok):
+            _rebuild_client(dev)
 
 
-# ── On-failure PowMr client rebuild ───────────────────────────────────────────
+# ── On-failure client rebuild ─────────────────────────────────────────────────
 #
-# We've observed a desync that survives close()/connect()/resetFrame() and
-# only recovers on `docker restart`. The difference between a docker restart
-# and an in-process reopen: the former drops the ModbusSerialClient *object*
-# entirely (along with its framer state, transaction manager, and the
-# underlying pyserial.Serial). This rebuild mimics that at the Python-object
-# level — no docker restart needed.
+# We've observed a PowMr desync that survives close()/connect()/resetFrame()
+# and only recovers on `docker restart`. The difference between a docker
+# restart and an in-process reopen: the former drops the ModbusSerialClient
+# *object* entirely (along with its framer state, transaction manager, and
+# the underlying pyserial.Serial). This rebuild mimics that at the
+# Python-object level — no docker restart needed.
 #
-# Telemetry counter — if this climbs steadily in steady state, the rebuild
-# is masking a deeper bug rather than papering over transient desync.
-_powmr_rebuild_count: int = 0
+# Devices with `recover: true` in devices.yaml (PowMr) rebuild and retry
+# once when a read fails. In per_request mode every failed read rebuilds (the
+# original behaviour). In persistent mode the session's health score
+# decides: a failure first just reopens the port, and the rebuild only
+# happens once the score says reopening isn't enough.
 
 
-def _rebuild_powmr_client() -> None:
-    """Discard the current PowMr ModbusSerialClient and build a fresh one.
+def _rebuild_client(dev: Device) -> None:
+    """Discard *dev*'s ModbusSerialClient and build a fresh one.
 
-    Caller must hold `_powmr_lock`.
+    Caller must hold the device's bus slot; runs on the device's bus thread.
     """
-    global modbus, _powmr_rebuild_count
-    _powmr_rebuild_count += 1
-    log.warning("PowMr: rebuilding ModbusSerialClient (#%d)", _powmr_rebuild_count)
-    if modbus is not None:
-        try:
-            modbus.close()
-        except Exception as e:
-            log.debug("PowMr: close() during rebuild raised %s (ignored)", e)
-    modbus = get_modbus_client(vid=6790, pid=29987, label="PowMr")
-    if modbus is None:
-        log.error("PowMr: device not visible during rebuild — next read will fail")
-
-
-def _read_powmr_holding_with_recovery(
-    blocks: Iterable[Tuple[int, int]],
-    label: str,
+    dev.rebuilds += 1
+    _metrics.rebuilds.inc(device=dev.name)
+    log.warning("%s: rebuilding ModbusSerialClient (#%d)", dev.label, dev.rebuilds)
+    started = time.perf_counter()
+    client  = dev.session.rebuild()
+    _metrics.rebuild_seconds.observe(time.perf_counter() - started, device=dev.name)
+    if client is None:
+        log.error("%s: device not visible during rebuild — next read will fail", dev.label)
+
+
+def _read_blocks_with_recovery(
+    dev: Device,
+    blocks: Tuple[Tuple[int, int], ...],
     validate=None,
+    should_yield: Optional[Callable[[], bool]] = None,
 ) -> Dict[int, int]:
-    """Read PowMr holding blocks; on failure, rebuild the client and retry once.
+    """Read *blocks* from *dev*; on failure, recover and retry once if configured.
 
     `validate(raw)` runs inside the protected region so out-of-range values —
     the smoking-gun symptom of framer desync smuggling garbage through a
-    structurally-valid response — also trigger the rebuild path. Caller must
-    hold `_powmr_lock`.
+    structurally-valid response — also trigger the recovery path. If
+    `should_yield()` turns true between blocks, the read stops early and
+    returns the blocks read so far (a prefix of *blocks*). Caller must hold
+    the device's bus slot; blocking — run it on `dev.bus`.
     """
+    reader = _BLOCK_READERS[dev.plan.profile.function]
+
+    def _read(client) -> Dict[int, int]:
+        raw: Dict[int, int] = {}
+        for i, block in enumerate(blocks):
+            raw.update(reader(client, (block,), dev.label))
+            if should_yield is not None and i + 1 < len(blocks) and should_yield():
+                break
+        if validate is not None:
+            validate(raw)
+        return raw
+
     def _attempt() -> Dict[int, int]:
-        client = connect_modbus()
-        try:
-            raw = _read_holding_blocks(client, blocks, label)
-            if validate is not None:
-                validate(raw)
-            return raw
-        finally:
-            try:
-                client.close()
-            except Exception:
-                pass
+        return _transaction(dev, _read)
 
+    if not dev.cfg.recover:
+        return _attempt()
     try:
         return _attempt()
     except HTTPException:
-        # connect_modbus() raised: device not found or .connect() returned False.
+        # _connect() raised: device not found or .connect() returned False.
         # Rebuild won't fix "device gone" and won't help with transient bus
         # contention either — propagate as-is.
         raise
     except Exception as e:
-        log.warning("PowMr read failed (%s) — rebuilding client and retrying once", e)
-        _rebuild_powmr_client()
+        if dev.session.persistent:
+            # The session already scored the failure and reopened the port or
+            # rebuilt the client as its health dictates.
+            log.warning("%s read failed (%s) — retrying once (health %d)",
+                        dev.label, e, dev.session.health)
+        else:
+            log.warning("%s read failed (%s) — rebuilding client and retrying once", dev.label, e)
+            _rebuild_client(dev)
         return _attempt()
 
 
+# ── Snapshot refresh + background poller ─────────────────────────────────────
+
+_store = SnapshotStore(history=SNAPSHOT_HISTORY)
+
+# Telemetry: `_read_flights.saved` counts bus transactions avoided because a
+# caller joined an identical in-flight read.
+_read_flights = SingleFlight("reads")
+
+
+async def _read_device(
+    dev: Device, blocks: Tuple[Tuple[int, int], ...], validate=None,
+) -> Dict[int, int]:
+    """Read *blocks* from *dev* in its bus slot on its bus thread.
+
+    The fast tier runs as one CONTROL_READ transaction. Anything else is a
+    BULK read that yields the slot between blocks whenever more urgent work
+    is queued, then requeues for the rest. Range validation runs per chunk;
+    if the read was split, the merged image is checked once more so a 32-bit
+    pair straddling a chunk boundary is still validated.
+    """
+    if blocks == dev.plan.fast_blocks:
+        async with _slot(dev, "read_fast", BusClass.CONTROL_READ):
+            return await dev.bus.run(_read_blocks_with_recovery, dev, blocks, validate=validate)
+
+    op = "read_full" if blocks == dev.plan.blocks else "read"
+    should_yield = functools.partial(dev.sched.should_yield, BusClass.BULK)
+    raw: Dict[int, int] = {}
+    remaining = tuple(blocks)
+    split = False
+    while remaining:
+        async with _slot(dev, op, BusClass.BULK):
+            part = await dev.bus.run(
+                _read_blocks_with_recovery, dev, remaining,
+                validate=validate, should_yield=should_yield,
+            )
+        raw.update(part)
+        done = sum(1 for start, _ in remaining if start in part)
+        remaining = remaining[done:]
+        if remaining:
+            split = True
+            dev.sched.yields += 1
+            _metrics.bulk_yields.inc(device=dev.name)
+            log.debug("%s %s: yielded the bus after %d block(s), %d to go",
+                      dev.label, op, done, len(remaining))
+    if split and validate is not None:
+        validate(raw)
+    return raw
+
+
+async def _refresh(
+    dev: Device, blocks: Tuple[Tuple[int, int], ...], regions: Tuple[str, ...],
+) -> RegisterSnapshot:
+    """Read *blocks* from *dev*, publish them, and return the new snapshot.
+
+    Coalesced by block set: concurrent callers asking for the same blocks
+    (poller, /limited_registers, /registers with a tight max_age) share one
+    bus transaction and one publish.
+    """
+    async def _read_and_publish() -> RegisterSnapshot:
+        read_at = time.monotonic()
+        raw = await _read_device(dev, blocks, validate=functools.partial(_check_ranges, dev))
+        return _store.publish(dev.name, raw, regions, read_at=read_at)
+
+    return await _read_flights.do((dev.name, blocks), _read_and_publish)
+
+
+async def _refresh_fast(dev: Device) -> RegisterSnapshot:
+    return await _refresh(dev, dev.plan.fast_blocks, (dev.fast_region,))
+
+
+async def _refresh_full(dev: Device) -> RegisterSnapshot:
+    return await _refresh(dev, dev.plan.blocks, dev.full_regions)
+
+
+async def _poll_loop(region: str, interval: float, refresh) -> None:
+    """Keep *region* of the snapshot no older than *interval* seconds.
+
+    Skips the bus entirely when something else (an on-demand read, or the
+    full poll covering the fast registers) refreshed the region recently.
+    Failures are logged once per streak; the snapshot simply ages, and
+    endpoints fall through to their own read (and error) once it is older
+    than the caller's max_age.
+    """
+    failures = 0
+    while True:
+        started = time.monotonic()
+        if _store.age(region) >= interval * 0.9:
+            try:
+                await refresh()
+                if failures:
+                    log.info("Poller %s: recovered after %d failure(s)", region, failures)
+                    failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                detail = getattr(e, "detail", None) or e
+                if failures == 1:
+                    log.warning("Poller %s: refresh failed: %s", region, detail)
+                else:
+                    log.debug("Poller %s: refresh failed (%d in a row): %s", region, failures, detail)
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+# ── Configuration register cache ──────────────────────────────────────────────
+#
+# Write-through cache of the PowMr configuration registers. A set_* call whose
+# value equals the last device-confirmed value is a no-op (no serial
+# transaction, no EEPROM write on the inverter) unless `force` is passed;
+# get_* calls answer from the cache. The poller re-reads every register each
+# CONFIG_VERIFY_S so a change made on the inverter's panel is picked up.
+# A failed write drops the entry, so the next write always goes to the bus.
+
+REG_OUTPUT_PRIORITY:   int = 0xE204
+REG_CHARGE_CURRENT:    int = 0xE205
+REG_CHARGING_PRIORITY: int = 0xE20F
+
+# Read one register at a time: the gaps between them are outside every
+# probed range, so a block read across them may hit IllegalAddress.
+CONFIG_BLOCKS: Tuple[Tuple[int, int], ...] = (
+    (REG_OUTPUT_PRIORITY, 1), (REG_CHARGE_CURRENT, 1), (REG_CHARGING_PRIORITY, 1),
+)
+
+_config = ConfigCache()
+
+# Config reads coalesce among themselves only: they return an int, the
+# snapshot reads in _read_flights a RegisterSnapshot.
+_config_flights = SingleFlight("config reads")
+
+
+async def _read_config(op: str, addr: int) -> Tuple[int, bool]:
+    """Return (value, from_cache) for configuration register *addr*."""
+    cached = _config.get(addr, CONFIG_MAX_AGE_S)
+    if cached is not None:
+        return cached, True
+
+    async def _read() -> int:
+        async with _slot(_POWMR, op, BusClass.CONTROL_READ):
+            raw = await _POWMR.bus.run(
+                _transaction, _POWMR, lambda c: _read_holding_blocks(c, ((addr, 1),), _POWMR.label),
+            )
+        _config.confirm(addr, raw[addr])
+        return raw[addr]
+
+    return await _config_flights.do((_POWMR.name, ((addr, 1),)), _read), False
+
+
+async def _write_config(op: str, addr: int, regval: int, force: bool):
+    """Write *regval* to *addr* unless the device already holds it.
+
+    Returns the pymodbus response, or None when the write was skipped. The
+    cache check happens under the lock so concurrent writers see each
+    other's confirmed values.
+    """
+    reg = f"0x{addr:04x}"
+    async with _slot(_POWMR, op, BusClass.CONTROL_WRITE):
+        if not force and _config.get(addr, CONFIG_MAX_AGE_S) == regval:
+            _metrics.config_writes.inc(register=reg, result="skipped")
+            return None
+        try:
+            response = await _POWMR.bus.run(
+                _transaction, _POWMR, lambda c: c.write_register(addr, regval),
+            )
+        except Exception:
+            _config.invalidate(addr)
+            _metrics.config_writes.inc(register=reg, result="failed")
+            raise
+    if response.isError():
+        _config.invalidate(addr)
+        _metrics.config_writes.inc(register=reg, result="failed")
+    else:
+        _config.confirm(addr, regval)
+        _metrics.config_writes.inc(register=reg, result="written")
+    return response
+
+
+async def _config_verify_loop(interval: float) -> None:
+    """Re-read every configuration register so the cache tracks the device."""
+    while True:
+        try:
+            async with _slot(_POWMR, "config_verify", BusClass.BULK):
+                raw = await _POWMR.bus.run(
+                    _transaction, _POWMR, lambda c: _read_holding_blocks(c, CONFIG_BLOCKS, _POWMR.label),
+                )
+            for addr, value in raw.items():
+                prev = _config.confirm(addr, value)
+                if prev is not None and prev != value:
+                    log.warning("Config 0x%04X changed on the device: %d → %d", addr, prev, value)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("Config verify failed: %s", getattr(e, "detail", None) or e)
+        await asyncio.sleep(interval)
+
+
+def _snapshot_headers(response: Response, snap: RegisterSnapshot, regions: Iterable[str]) -> None:
+    """Expose snapshot sequence number and data age to HTTP clients."""
+    now = time.monotonic()
+    response.headers["X-Snapshot-Seq"]   = str(snap.seq)
+    response.headers["X-Snapshot-Epoch"] = _store.epoch
+    response.headers["X-Snapshot-Age"] = f"{max(snap.age(r, now) for r in regions):.3f}"
+    response.headers["Vary"] = "Accept"
+
+
+# ── Binary register payloads ──────────────────────────────────────────────────
+#
+# /registers and /limited_registers negotiate on Accept (see regpack.py):
+# application/x-modbus-regs or application/x-msgpack get an array-backed
+# payload instead of the string-keyed JSON dict. The encoded body depends only
+# on the snapshot, so the last one per (scope, media type) is kept and reused
+# until the next publish — N clients polling the same snapshot encode once.
+
+_BINARY_RESPONSES = {
+    200: {"content": {REGPACK_MEDIA_TYPE: {}, "application/x-msgpack": {}}},
+}
+_packed: Dict[Tuple[str, str], Tuple[int, bytes]] = {}
+
+
+def _binary_registers(
+    media: str, scope: Optional[str], snap: RegisterSnapshot,
+    parts: Iterable[Tuple[str, int, Mapping[int, int], Iterable[int]]], regions: Iterable[str],
+) -> Response:
+    """Encode the whitelisted registers of *parts* as *media*, cached per seq.
+
+    *parts* are (key prefix, regpack kind, raw values, whitelist), in payload
+    order. ``scope=None`` is a delta: not cached, and may be empty.
+    """
+    hit = _packed.get((scope, media)) if scope is not None else None
+    if hit is not None and hit[0] == snap.seq:
+        body = hit[1]
+    else:
+        devices = []
+        for prefix, kind, raw, whitelist in parts:
+            devices.append((prefix, kind, {a: raw[a] for a in whitelist if a in raw}))
+        image = RegisterImage.from_devices(devices)
+        if not image and scope is not None:
+            log.error("/registers: snapshot #%d has no values for scope %s", snap.seq, scope)
+            raise HTTPException(status_code=502, detail="No registers returned")
+        body = image.pack() if media == REGPACK_MEDIA_TYPE else image.to_msgpack()
+        if scope is not None:
+            _packed[(scope, media)] = (snap.seq, body)
+    response = Response(content=body, media_type=media)
+    _snapshot_headers(response, snap, regions)
+    return response
+
+
 # ── Authentication ────────────────────────────────────────────────────────────
 
 
@@ -482,10 +837,12 @@ async def health():
     if _ready:
         return {"status": "ready"}
 
-    async with _powmr_lock:
-        client = connect_modbus()
+    async with _slot(_POWMR, "health", BusClass.CONTROL_READ):
         try:
-            rr = client.read_holding_registers(address=0x0100, count=1)
+            rr = await _POWMR.bus.run(
+                _transaction, _POWMR,
+                lambda c: c.read_holding_registers(address=0x0100, count=1),
+            )
             if hasattr(rr, "isError") and rr.isError():
                 raise HTTPException(status_code=503, detail=f"Not ready: {rr}")
             if not getattr(rr, "registers", None):
@@ -498,49 +855,93 @@ async def health():
         except Exception as e:
             log.warning("/health: probe failed (will retry): %s", e)
             raise HTTPException(status_code=503, detail=f"Not ready: {e}")
-        finally:
-            try:
-                client.close()
-            except Exception:
-                pass
 
 
-@app.get("/registers", response_model=Dict[str, int])
-async def get_all_registers() -> Dict[str, int]:
-    """Read all required registers from both inverters and return a combined dict."""
-    log.debug("Reading all registers: PowMr (%d blocks) + Growatt (%d blocks)",
-              len(POWMR_HOLDING_BLOCKS), len(GROWATT_INPUT_BLOCKS))
+def _registers_delta(
+    media: Optional[str], response: Response, snap: RegisterSnapshot, base: RegisterSnapshot,
+) -> Response | Dict[str, int]:
+    """/registers?since=N body: exposed registers that changed since *base*."""
+    changes = {name: snap.changes_since(base, name) for name in _DEVICES}
+    if media is not None:
+        response = _binary_registers(
+            media, None, snap,
+            [(dev.cfg.key_prefix, dev.kind, changes[dev.name], dev.plan.exposed)
+             for dev in _DEVICES.values()],
+            _ALL_REGIONS,
+        )
+        delta = None
+    else:
+        delta = {k: v for name, dev in _DEVICES.items()
+                 for k, v in dev.keyed(changes[name]).items()}
+        _snapshot_headers(response, snap, _ALL_REGIONS)
+    response.headers["X-Snapshot-Base"] = str(base.seq)
+    log.debug("/registers: delta #%d → #%d, %d register(s) changed", base.seq, snap.seq,
+              sum(len(c) for c in changes.values()))
+    return response if delta is None else delta
+
+
+@app.get("/registers", response_model=Dict[str, int], responses=_BINARY_RESPONSES)
+async def get_all_registers(
+    request: Request,
+    response: Response,
+    max_age: float = Query(FULL_MAX_AGE_S, ge=0),
+    since: Optional[int] = Query(None, ge=0),
+    epoch: Optional[str] = Query(None),
+):
+    """Return the registers of every configured inverter as one combined dict.
+
+    Keys are namespaced per device ("growatt2:17"); devices marked
+    `unprefixed` in devices.yaml keep bare keys ("0x0100", "17").
+    Served from the poller's snapshot; any device whose part is older than
+    `max_age` seconds is re-read from the bus first (`max_age=0` forces a
+    fresh read). Clients that prefer application/x-modbus-regs or
+    application/x-msgpack to JSON (by Accept q-value) get the same
+    registers as a regpack payload instead.
+
+    `since=N` (with the `epoch` from the X-Snapshot-Epoch header of the
+    response that carried N) asks for a delta: only the registers whose
+    value changed since snapshot N, with `X-Snapshot-Base: N`. When N has
+    left the snapshot ring — or belongs to another epoch, i.e. modbus_api
+    restarted — the full image is returned without that header.
+    """
     try:
-        # PowMr is shared with /limited_registers and the write endpoints —
-        # serialise the connect → read → close sequence under _powmr_lock.
-        # _read_powmr_holding_with_recovery rebuilds the client on failure.
-        async with _powmr_lock:
-            powmr_raw = _read_powmr_holding_with_recovery(
-                POWMR_HOLDING_BLOCKS, "PowMr", validate=_check_powmr_ranges,
+        # Each refresh holds its device's bus slot (BULK, yielding between
+        # blocks) on that device's bus thread, so stale devices are re-read
+        # concurrently — the wait is the slowest device, not the sum.
+        stale = [_refresh_full(dev) for dev in _DEVICES.values()
+                 if _store.age(dev.full_region) > max_age]
+        if stale:
+            log.debug("/registers: snapshot older than %.1f s — reading %d device(s)",
+                      max_age, len(stale))
+            await asyncio.gather(*stale)
+
+        snap  = _store.current
+        media = negotiate(request.headers.get("accept", ""))
+        base  = None
+        if since is not None and (epoch is None or epoch == _store.epoch):
+            base = _store.get(since)
+        if base is not None:
+            return _registers_delta(media, response, snap, base)
+
+        if media is not None:
+            return _binary_registers(
+                media, "all", snap,
+                [(dev.cfg.key_prefix, dev.kind, snap.device(dev.name), dev.plan.exposed)
+                 for dev in _DEVICES.values()],
+                _ALL_REGIONS,
             )
 
-        # Growatt: unchanged, no lock.
-        growatt_client = connect_modbus2()
-        try:
-            growatt_raw = _read_input_blocks(growatt_client, GROWATT_INPUT_BLOCKS, "Growatt")
-            _check_growatt_ranges(growatt_raw)
-        finally:
-            try:
-                growatt_client.close()
-            except Exception:
-                pass
-
-        powmr_part   = _as_hex_dict(powmr_raw,   POWMR_REQUIRED)
-        growatt_part = _as_dec_dict(growatt_raw, GROWATT_RAW_RANGE)
-        combined     = {**powmr_part, **growatt_part}
+        parts    = {name: dev.keyed(snap.device(name)) for name, dev in _DEVICES.items()}
+        combined = {k: v for part in parts.values() for k, v in part.items()}
 
         if not combined:
             log.error("Combined register read returned 0 values")
             raise HTTPException(status_code=502, detail="No registers returned")
 
+        _snapshot_headers(response, snap, _ALL_REGIONS)
         log.info(
-            "/registers: %d total  (PowMr: %d  Growatt: %d)",
-            len(combined), len(powmr_part), len(growatt_part),
+            "/registers: %d total  (%s)  snapshot #%d", len(combined),
+            "  ".join(f"{_DEVICES[n].label}: {len(p)}" for n, p in parts.items()), snap.seq,
         )
         return combined
 
@@ -551,10 +952,15 @@ async def get_all_registers() -> Dict[str, int]:
         raise HTTPException(status_code=500, detail=f"Combined read error: {e}")
 
 
-@app.get("/limited_registers", response_model=Dict[str, int])
-async def get_limited_registers() -> Dict[str, int]:
-    """Read the five fast-poll registers used by battery_controller every 5 s.
+@app.get("/limited_registers", response_model=Dict[str, int], responses=_BINARY_RESPONSES)
+async def get_limited_registers(
+    request: Request,
+    response: Response,
+    max_age: float = Query(LIMITED_MAX_AGE_S, ge=0),
+):
+    """Return the five fast-poll registers (battery_controller polls them when /stream is quiet).
 
+    Served from the snapshot unless it is older than `max_age` seconds.
     Returns a hex-keyed dict:
       0x0100 = battery SoC (%)
       0x0101 = battery voltage (×0.1 V)
@@ -562,31 +968,291 @@ async def get_limited_registers() -> Dict[str, int]:
       0x021C = load apparent power L1 (W)
       0x0234 = load apparent power L2 (W)
     """
-    async with _powmr_lock:
+    try:
+        if _store.age(_POWMR.fast_region) > max_age:
+            await _refresh_fast(_POWMR)
+        snap = _store.current
+        subset = _as_hex_dict(snap.device("powmr"), POWMR_FAST_ADDRS)
+
+        if len(subset) != len(POWMR_FAST_ADDRS):
+            need    = {f"0x{a:04x}" for a in POWMR_FAST_ADDRS}
+            missing = sorted(need - set(subset.keys()))
+            log.error("/limited_registers: missing addresses %s", missing)
+            raise HTTPException(status_code=502, detail=f"Missing fast addrs: {missing}")
+
+        media = negotiate(request.headers.get("accept", ""))
+        if media is not None:
+            return _binary_registers(media, "limited", snap,
+                                     (("", KIND_HEX, snap.device("powmr"), POWMR_FAST_ADDRS),),
+                                     (_POWMR.fast_region,))
+
+        _snapshot_headers(response, snap, (_POWMR.fast_region,))
+        log.debug(
+            "/limited_registers: SoC=%s%%  raw_V=%s  raw_I=%s  L1=%s W  L2=%s W  (snapshot #%d)",
+            subset.get("0x0100"), subset.get("0x0101"),
+            subset.get("0x0102"), subset.get("0x021c"), subset.get("0x0234"), snap.seq,
+        )
+        return subset
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.error("/limited_registers: unexpected error: %s", e)
+        raise HTTPException(status_code=500, detail=f"PowMr limited read error: {e}")
+
+
+# ── Snapshot stream ───────────────────────────────────────────────────────────
+#
+# /stream pushes every published snapshot to Server-Sent-Events subscribers
+# as soon as the bus read completes — no polling, no extra bus load however
+# many dashboards are watching. Each subscriber has a one-slot mailbox in the
+# store, so a slow client skips snapshots instead of buffering them.
+#
+#   scope=limited  the five fast registers (same keys as /limited_registers)
+#   scope=all      everything /registers returns
+#   mode=full      every event carries the whole scope
+#   mode=changes   the first event is full, later ones only changed keys;
+#                  snapshots that change nothing in scope are not sent
+#
+# A snapshot that re-read nothing in scope (e.g. a Growatt publish, for
+# scope=limited) is never sent, so every event is a fresh bus reading —
+# battery_controller runs its control step once per event.
+#
+# Event format:  id: <seq>  event: snapshot|changes
+#                data: {"seq": n, "age": s, "registers": {...}}
+
+_STREAM_SCOPES: Dict[str, Tuple[str, ...]] = {
+    "limited": (_POWMR.fast_region,),
+    "all":     _ALL_REGIONS,
+}
+
+
+def _scope_registers(snap: RegisterSnapshot, scope: str) -> Dict[str, int]:
+    if scope == "limited":
+        return _as_hex_dict(snap.device("powmr"), POWMR_FAST_ADDRS)
+    return {k: v for name, dev in _DEVICES.items() for k, v in dev.keyed(snap.device(name)).items()}
+
+
+async def _stream_events(request: Request, scope: str, mode: str) -> AsyncIterator[str]:
+    sub = _store.subscribe()
+    regions = _STREAM_SCOPES[scope]
+    sent: Optional[Dict[str, int]] = None
+    read_at = -math.inf   # newest read time of the scope's regions already sent
+    try:
+        yield f"retry: {int(STREAM_KEEPALIVE_S * 1000)}\n\n"
+        while True:
+            snap = await sub.next(timeout=STREAM_KEEPALIVE_S)
+            if await request.is_disconnected():
+                break
+            if snap is None:
+                yield ": keepalive\n\n"
+                continue
+            fresh = max(snap.fresh_at.get(r, -math.inf) for r in regions)
+            if fresh <= read_at:
+                continue   # nothing in scope was re-read
+            regs = _scope_registers(snap, scope)
+            if not regs:
+                continue   # scope not read yet
+            read_at = fresh
+            event = "snapshot"
+            if mode == "changes" and sent is not None:
+                event = "changes"
+                regs = {k: v for k, v in regs.items() if sent.get(k) != v}
+                if not regs:
+                    continue
+                sent.update(regs)
+            else:
+                sent = dict(regs)
+            age = max(snap.age(r) for r in regions)
+            payload = json.dumps({"seq": snap.seq, "age": round(age, 3), "registers": regs},
+                                 separators=(",", ":"))
+            yield f"id: {snap.seq}\nevent: {event}\ndata: {payload}\n\n"
+    finally:
+        _store.unsubscribe(sub)
+        log.info("/stream: subscriber left (scope=%s, %d skipped, %d remaining)",
+                 scope, sub.skipped, _store.subscribers)
+
+
+@app.get("/stream")
+async def stream(
+    request: Request,
+    scope: str = Query("limited", pattern="^(limited|all)$"),
+    mode:  str = Query("full", pattern="^(full|changes)$"),
+) -> StreamingResponse:
+    """Server-Sent-Events stream of register snapshots (no bus access).
+
+    Try it:  curl -N 'http://localhost:5004/stream?scope=all&mode=changes'
+    """
+    if _store.subscribers >= STREAM_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Too many /stream subscribers")
+    log.info("/stream: subscriber joined (scope=%s mode=%s, %d total)",
+             scope, mode, _store.subscribers + 1)
+    return StreamingResponse(
+        _stream_events(request, scope, mode),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/stats")
+async def stats():
+    """Bus telemetry counters (no bus access)."""
+    snap = _store.current
+    return {
+        "snapshot_seq":          snap.seq if snap else 0,
+        "powmr_rebuilds":        _POWMR.rebuilds,
+        "rebuilds":              {name: dev.rebuilds for name, dev in _DEVICES.items()},
+        "sessions":              {name: dev.session.stats_dict() for name, dev in _DEVICES.items()},
+        "bus_scheduler":         {name: dev.sched.stats_dict() for name, dev in _DEVICES.items()},
+        "stream_subscribers":    _store.subscribers,
+        "tcp_gateway":           _gateway.stats_dict() if _gateway is not None else None,
+        "port_resolver":         _ports.stats_dict(),
+        "config_cache":          _config.as_dict(),
+        "coalesced_reads_saved": _read_flights.saved,
+        "coalesced_by_blocks":   dict(_read_flights.saved_by_key),
+        "config_reads_saved":    _config_flights.saved,
+    }
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Bus telemetry in Prometheus text format (no bus access).
+
+    Scrape with Prometheus, Telegraf's inputs.prometheus, or an InfluxDB 2
+    scraper pointed at http://modbus_api:5004/metrics.
+    """
+    return Response(content=_metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+def _collect_gauges() -> None:
+    for dev in _DEVICES.values():
+        for cls in BusClass:
+            _metrics.queue_depth.set(dev.sched.waiting(cls), device=dev.name, **{"class": cls.label})
+        _metrics.session_health.set(dev.session.health, device=dev.name)
+    if _gateway is not None:
+        _metrics.gateway_clients.set(_gateway.clients)
+    snap = _store.current
+    if snap is not None:
+        now = time.monotonic()
+        for region in snap.fresh_at:
+            _metrics.snapshot_age_seconds.set(round(snap.age(region, now), 3), region=region)
+
+
+_metrics.registry.on_collect(_collect_gauges)
+
+
+# ── Raw reads (debugging / register discovery) ────────────────────────────────
+#
+# Lowest bus priority: debug reads never delay the control loop. A batch
+# reads each device's ranges in one transaction (one connect/close in
+# per_request mode) under one DEBUG slot hold, giving the slot up between
+# ranges only when more urgent work is queued; devices run concurrently.
+
+RAW_READ_MAX_COUNT:   int = 64
+RAW_BATCH_MAX_RANGES: int = 256
+
+
+class _BatchInterrupted(Exception):
+    """A transport error ended a raw-read batch transaction early."""
+
+    def __init__(self, results: List[dict]) -> None:
+        super().__init__(results[-1]["error"])
+        self.results = results
+
+
+def _raw_request(dev: Device, address: int, count: int) -> Callable[[Any], Any]:
+    """FC3 or FC4 read of *address*/*count*, as the device's profile dictates."""
+    if dev.plan.profile.function == "input":
+        return lambda c: c.read_input_registers(address=address, count=count)
+    return lambda c: c.read_holding_registers(address=address, count=count)
+
+
+def _raw_values(address: int, regs: Iterable[int]) -> Dict[str, Dict[str, int | str]]:
+    out: Dict[str, Dict[str, int | str]] = {}
+    for i, v in enumerate(regs):
+        v16 = int(v) & 0xFFFF
+        out[f"0x{address + i:04x}"] = {"raw": v16, "hex": f"0x{v16:04x}"}
+    return out
+
+
+def _parse_range(addr: Any, count: Any) -> Tuple[int, int]:
+    """Validate one raw-read range; HTTPException(400) if malformed."""
+    try:
+        address = int(addr, 0) if isinstance(addr, str) else int(addr)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail=f"Invalid addr: {addr!r}")
+    if not isinstance(count, int) or not 1 <= count <= RAW_READ_MAX_COUNT:
+        raise HTTPException(status_code=400, detail=f"count must be 1..{RAW_READ_MAX_COUNT}")
+    if not 0 <= address <= 0xFFFF - count + 1:
+        raise HTTPException(status_code=400, detail=f"addr out of range: {addr!r}")
+    return address, count
+
+
+def _raw_device(device: str) -> Device:
+    dev = _DEVICES.get(device)
+    if dev is None:
+        raise HTTPException(status_code=400, detail=f"device must be one of {sorted(_DEVICES)}")
+    return dev
+
+
+def _read_ranges(dev: Device, ranges: List[Tuple[int, int]], should_yield) -> List[dict]:
+    """Bus thread: read *ranges* in one transaction; one result dict per range read.
+
+    Stops early (fewer results than ranges) when *should_yield* says more
+    urgent work is queued, or with _BatchInterrupted on a transport error so
+    the session scores the failed transaction.
+    """
+    def _read(client) -> List[dict]:
+        results: List[dict] = []
+        for i, (address, count) in enumerate(ranges):
+            started = time.perf_counter()
+            result = {"device": dev.name, "addr": f"0x{address:04x}", "count": count}
+            try:
+                rr = _raw_request(dev, address, count)(client)
+            except Exception as e:
+                result.update(elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+                              registers=None, error=str(e), exception_code=None)
+                results.append(result)
+                raise _BatchInterrupted(results) from None
+            result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            if hasattr(rr, "isError") and rr.isError():
+                result.update(registers=None, error=str(rr),
+                              exception_code=getattr(rr, "exception_code", None))
+            else:
+                result.update(registers=_raw_values(address, getattr(rr, "registers", None) or []),
+                              error=None, exception_code=None)
+            results.append(result)
+            if i + 1 < len(ranges) and should_yield():
+                break
+        return results
+
+    return _transaction(dev, _read)
+
+
+async def _raw_batch_device(dev: Device, ranges: List[Tuple[int, int]]) -> List[dict]:
+    """All of *dev*'s ranges, in order; errors are reported per range."""
+    should_yield = functools.partial(dev.sched.should_yield, BusClass.DEBUG)
+    results: List[dict] = []
+    while len(results) < len(ranges):
+        remaining = ranges[len(results):]
         try:
-            partial_blocks: Tuple[Tuple[int, int], ...] = ((0x0100, 3), (0x021C, 1), (0x0234, 1))
-            raw = _read_powmr_holding_with_recovery(
-                partial_blocks, "PowMr", validate=_check_powmr_ranges,
-            )
-            subset = _as_hex_dict(raw, POWMR_FAST_ADDRS)
-
-            if len(subset) != len(POWMR_FAST_ADDRS):
-                need    = {f"0x{a:04x}" for a in POWMR_FAST_ADDRS}
-                missing = sorted(need - set(subset.keys()))
-                log.error("/limited_registers: missing addresses %s", missing)
-                raise HTTPException(status_code=502, detail=f"Missing fast addrs: {missing}")
-
-            log.debug(
-                "/limited_registers: SoC=%s%%  raw_V=%s  raw_I=%s  L1=%s W  L2=%s W",
-                subset.get("0x0100"), subset.get("0x0101"),
-                subset.get("0x0102"), subset.get("0x021c"), subset.get("0x0234"),
-            )
-            return subset
-        except HTTPException:
-            raise
-        except Exception as e:
-            log.error("/limited_registers: unexpected error: %s", e)
-            raise HTTPException(status_code=500, detail=f"PowMr limited read error: {e}")
+            async with _slot(dev, "raw_read_batch", BusClass.DEBUG):
+                part = await dev.bus.run(_read_ranges, dev, remaining, should_yield)
+        except _BatchInterrupted as e:
+            part = e.results
+            log.warning("/raw_read_batch: %s transaction ended at %s: %s",
+                        dev.label, part[-1]["addr"], e)
+        except HTTPException as e:
+            # Could not connect — every remaining range fails the same way.
+            part = [{"device": dev.name, "addr": f"0x{a:04x}", "count": n,
+                     "elapsed_ms": 0.0, "registers": None, "error": e.detail,
+                     "exception_code": None}
+                    for a, n in remaining]
+        results.extend(part)
+        if len(results) < len(ranges) and not part[-1]["error"]:
+            dev.sched.yields += 1
+            log.debug("/raw_read_batch: %s yielded the bus after %d of %d range(s)",
+                      dev.label, len(results), len(ranges))
+    return results
 
 
 @app.get("/raw_read")
@@ -597,218 +1263,467 @@ async def raw_read(addr: str, count: int = 1, device: str = "powmr"):
 
       addr   : decimal ("259") or hex ("0x0103")
       count  : 1..64 consecutive registers
-      device : "powmr" (holding regs) or "growatt" (input regs)
+      device : a devices.yaml name, e.g. "powmr" (holding regs) or
+               "growatt" (input regs) — the profile picks the function
     """
+    address, count = _parse_range(addr, count)
+    dev   = _raw_device(device)
+    label = dev.label
     try:
-        address = int(addr, 0)
-    except (ValueError, TypeError):
-        raise HTTPException(status_code=400, detail=f"Invalid addr: {addr!r}")
-    if not (1 <= count <= 64):
-        raise HTTPException(status_code=400, detail="count must be 1..64")
-
-    if device not in ("powmr", "growatt"):
-        raise HTTPException(status_code=400, detail="device must be powmr or growatt")
-
-    # Acquire the PowMr lock only when actually touching PowMr; for Growatt
-    # this is a no-op so that path stays unchanged.
-    guard = _powmr_lock if device == "powmr" else nullcontext()
-    async with guard:
-        if device == "powmr":
-            client = connect_modbus()
-            reader = client.read_holding_registers
-            label  = "PowMr"
-        else:  # growatt — validated above
-            client = connect_modbus2()
-            reader = client.read_input_registers
-            label  = "Growatt"
+        async with _slot(dev, "raw_read", BusClass.DEBUG):
+            rr = await dev.bus.run(_transaction, dev, _raw_request(dev, address, count))
 
-        try:
-            rr = reader(address=address, count=count)
-            if hasattr(rr, "isError") and rr.isError():
-                log.error("/raw_read: %s read failed at 0x%04X/%d: %s", label, address, count, rr)
-                raise HTTPException(status_code=502, detail=f"{label} read failed: {rr}")
-            regs = getattr(rr, "registers", None) or []
-            out: Dict[str, Dict[str, int | str]] = {}
-            for i, v in enumerate(regs):
-                a   = address + i
-                v16 = int(v) & 0xFFFF
-                out[f"0x{a:04x}"] = {
-                    "raw": v16,
-                    "hex": f"0x{v16:04x}",
-                }
-            log.info("/raw_read: %s addr=0x%04X count=%d -> %d regs", label, address, count, len(regs))
-            return out
-        except HTTPException:
-            raise
-        except Exception as e:
-            log.error("/raw_read: unexpected error: %s", e)
-            raise HTTPException(status_code=500, detail=f"Raw read error: {e}")
-        finally:
-            try:
-                client.close()
-            except Exception:
-                pass
+        if hasattr(rr, "isError") and rr.isError():
+            log.error("/raw_read: %s read failed at 0x%04X/%d: %s", label, address, count, rr)
+            raise HTTPException(status_code=502, detail=f"{label} read failed: {rr}")
+        regs = getattr(rr, "registers", None) or []
+        log.info("/raw_read: %s addr=0x%04X count=%d -> %d regs", label, address, count, len(regs))
+        return _raw_values(address, regs)
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.error("/raw_read: unexpected error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Raw read error: {e}")
+
+
+@app.post("/raw_read_batch")
+async def raw_read_batch(request: Request):
+    """Read many raw register ranges in one call — for register discovery scans.
+
+    Body: {"ranges": [{"device": "growatt", "addr": "0x0060", "count": 32}, ...]}
+    (`device` defaults to "powmr", `addr` is decimal or "0x" hex, `count`
+    1..64, at most 256 ranges). Each device's ranges are read in order in one
+    transaction; devices are read concurrently. A failed range does not stop
+    the batch — it comes back with `registers: null` and an `error`, plus the
+    Modbus `exception_code` when the device answered with an exception
+    (2 = IllegalAddress) rather than not at all.
+
+    Returns {"ranges": [...], "elapsed_ms": ...}, one entry per requested
+    range in request order, each with its own `elapsed_ms`.
+    """
+    try:
+        body = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Body must be JSON")
+    items = body.get("ranges") if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="'ranges' must be a non-empty list")
+    if len(items) > RAW_BATCH_MAX_RANGES:
+        raise HTTPException(status_code=400, detail=f"at most {RAW_BATCH_MAX_RANGES} ranges")
+
+    # Validate everything before taking any bus slot.
+    per_device: Dict[str, List[Tuple[int, int]]] = {}
+    order: List[Tuple[str, int]] = []   # (device, index within its list) per request item
+    for item in items:
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail=f"Invalid range: {item!r}")
+        dev = _raw_device(str(item.get("device", "powmr")))
+        rng = _parse_range(item.get("addr"), item.get("count", 1))
+        per_device.setdefault(dev.name, []).append(rng)
+        order.append((dev.name, len(per_device[dev.name]) - 1))
+
+    started = time.perf_counter()
+    try:
+        done = await asyncio.gather(*(_raw_batch_device(_DEVICES[name], ranges)
+                                      for name, ranges in per_device.items()))
+    except Exception as e:
+        log.error("/raw_read_batch: unexpected error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Raw read error: {e}")
+    by_device = dict(zip(per_device, done))
+    results   = [by_device[name][i] for name, i in order]
+    elapsed   = round((time.perf_counter() - started) * 1000, 1)
+
+    failed = sum(1 for r in results if r["error"])
+    log.info("/raw_read_batch: %d range(s) on %s in %.0f ms%s", len(results),
+             ", ".join(_DEVICES[n].label for n in per_device), elapsed,
+             f" — {failed} failed" if failed else "")
+    return {"ranges": results, "elapsed_ms": elapsed}
 
 
 # ── Write endpoints ───────────────────────────────────────────────────────────
+#
+# The request body is parsed and validated before the PowMr bus slot is taken, so
+# a slow or malformed client never holds the bus. Writes go through the
+# configuration cache: an unchanged value is skipped unless the body carries
+# "force": true (or ?force=true); the response's "written" says which.
 
 
 @app.post("/set_charge_current")
 async def set_charge_current(
     request: Request,
+    force: bool = False,
     credentials: HTTPBasicCredentials = Depends(verify_credentials),
 ):
-    """Set the grid charge current (A).  Body: {"value": <float>}."""
-    async with _powmr_lock:
-        modbus_client = connect_modbus()
-        try:
-            body  = await request.json()
-            value = body.get("value")
-            if value is None or not isinstance(value, (int, float)):
-                raise HTTPException(
-                    status_code=400, detail="Invalid or missing 'value' in request body"
-                )
-
-            regval = int(value * 10)
-            log.debug("/set_charge_current: writing 0xE205 = %d (%.1f A)", regval, value)
-            response = modbus_client.write_register(0xE205, regval)
-            if response.isError():
-                log.error("/set_charge_current: register write failed: %s", response)
-                raise HTTPException(status_code=500, detail="Error writing charge-current register")
+    """Set the grid charge current (A).  Body: {"value": <float>, "force": <bool>}."""
+    try:
+        body  = await request.json()
+        value = body.get("value")
+        force = force or bool(body.get("force", False))
+        if value is None or not isinstance(value, (int, float)):
+            raise HTTPException(
+                status_code=400, detail="Invalid or missing 'value' in request body"
+            )
 
-            log.info("/set_charge_current: %.1f A written (reg 0xE205=%d)", value, regval)
-            return {"success": True, "value": value}
-        except HTTPException:
-            raise
-        except Exception as e:
-            log.error("/set_charge_current: unexpected error: %s", e)
-            raise HTTPException(status_code=500, detail=f"Error: {e}")
-        finally:
-            modbus_client.close()
+        regval = int(value * 10)
+        log.debug("/set_charge_current: writing 0xE205 = %d (%.1f A)", regval, value)
+        response = await _write_config("set_charge_current", REG_CHARGE_CURRENT, regval, force)
+        if response is None:
+            log.info("/set_charge_current: %.1f A already set — write skipped", value)
+            return {"success": True, "value": value, "written": False}
+        if response.isError():
+            log.error("/set_charge_current: register write failed: %s", response)
+            raise HTTPException(status_code=500, detail="Error writing charge-current register")
+
+        log.info("/set_charge_current: %.1f A written (reg 0xE205=%d)", value, regval)
+        return {"success": True, "value": value, "written": True}
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.error("/set_charge_current: unexpected error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error: {e}")
 
 
 @app.post("/set_output_priority")
 async def set_output_priority(
     request: Request,
+    force: bool = False,
     credentials: HTTPBasicCredentials = Depends(verify_credentials),
 ):
-    """Set the output priority.  Body: {"value": 0|1|2}."""
-    async with _powmr_lock:
-        modbus_client = connect_modbus()
-        try:
-            body  = await request.json()
-            value = body.get("value")
-            valid = [e.value for e in OutputPriority]
-            if value is None or value not in valid:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Invalid output priority — must be one of {[e.name for e in OutputPriority]}",
-                )
-
-            log.debug("/set_output_priority: writing 0xE204 = %d (%s)", value, OutputPriority(value).name)
-            response = modbus_client.write_register(0xE204, int(value))
-            if response.isError():
-                log.error("/set_output_priority: register write failed: %s", response)
-                raise HTTPException(status_code=500, detail="Failed to set Output Priority")
+    """Set the output priority.  Body: {"value": 0|1|2, "force": <bool>}."""
+    try:
+        body  = await request.json()
+        value = body.get("value")
+        force = force or bool(body.get("force", False))
+        valid = [e.value for e in OutputPriority]
+        if value is None or value not in valid:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid output priority — must be one of {[e.name for e in OutputPriority]}",
+            )
 
-            name = OutputPriority(int(value)).name
-            log.info("/set_output_priority: set to %s (reg 0xE204=%d)", name, value)
-            return {"success": True, "value": name}
-        except HTTPException:
-            raise
-        except Exception as e:
-            log.error("/set_output_priority: unexpected error: %s", e)
-            raise HTTPException(status_code=500, detail=f"Error: {e}")
-        finally:
-            modbus_client.close()
+        log.debug("/set_output_priority: writing 0xE204 = %d (%s)", value, OutputPriority(value).name)
+        response = await _write_config("set_output_priority", REG_OUTPUT_PRIORITY, int(value), force)
+        if response is None:
+            log.info("/set_output_priority: already %s — write skipped", OutputPriority(int(value)).name)
+            return {"success": True, "value": OutputPriority(int(value)).name, "written": False}
+        if response.isError():
+            log.error("/set_output_priority: register write failed: %s", response)
+            raise HTTPException(status_code=500, detail="Failed to set Output Priority")
+
+        name = OutputPriority(int(value)).name
+        log.info("/set_output_priority: set to %s (reg 0xE204=%d)", name, value)
+        return {"success": True, "value": name, "written": True}
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.error("/set_output_priority: unexpected error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error: {e}")
 
 
 @app.get("/get_output_priority")
 async def get_output_priority():
-    """Read the current output priority."""
-    async with _powmr_lock:
-        modbus_client = connect_modbus()
-        try:
-            response = modbus_client.read_holding_registers(address=0xE204, count=1)
-            if response.isError():
-                log.error("/get_output_priority: register read failed: %s", response)
-                raise HTTPException(status_code=500, detail="Failed to read Output Priority")
-            value = response.registers[0]
-            if value not in [e.value for e in OutputPriority]:
-                log.warning("/get_output_priority: unexpected value %d in register 0xE204", value)
-                raise HTTPException(status_code=500, detail=f"Unexpected Output Priority value: {value}")
-            log.debug("/get_output_priority: %s (%d)", OutputPriority(value).name, value)
-            return {"value": OutputPriority(value).name, "raw_value": value}
-        except HTTPException:
-            raise
-        except Exception as e:
-            log.error("/get_output_priority: unexpected error: %s", e)
-            raise HTTPException(status_code=500, detail=f"Error: {e}")
-        finally:
-            modbus_client.close()
+    """Read the current output priority (from the configuration cache when fresh)."""
+    try:
+        value, cached = await _read_config("get_output_priority", REG_OUTPUT_PRIORITY)
+        if value not in [e.value for e in OutputPriority]:
+            log.warning("/get_output_priority: unexpected value %d in register 0xE204", value)
+            raise HTTPException(status_code=500, detail=f"Unexpected Output Priority value: {value}")
+        log.debug("/get_output_priority: %s (%d)%s", OutputPriority(value).name, value, " [cached]" if cached else "")
+        return {"value": OutputPriority(value).name, "raw_value": value, "cached": cached}
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.error("/get_output_priority: unexpected error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error: {e}")
 
 
 @app.post("/set_charging_priority")
 async def set_charging_priority(
     request: Request,
+    force: bool = False,
     credentials: HTTPBasicCredentials = Depends(verify_credentials),
 ):
-    """Set the charging priority.  Body: {"value": 0|1|2|3}."""
-    async with _powmr_lock:
-        modbus_client = connect_modbus()
-        try:
-            body  = await request.json()
-            value = body.get("value")
-            valid = [e.value for e in ChargingPriority]
-            if value is None or value not in valid:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Invalid charging priority — must be one of {[e.name for e in ChargingPriority]}",
-                )
-
-            log.debug("/set_charging_priority: writing 0xE20F = %d (%s)", value, ChargingPriority(value).name)
-            response = modbus_client.write_register(0xE20F, int(value))
-            if response.isError():
-                log.error("/set_charging_priority: register write failed: %s", response)
-                raise HTTPException(status_code=500, detail="Failed to set Charging Priority")
+    """Set the charging priority.  Body: {"value": 0|1|2|3, "force": <bool>}."""
+    try:
+        body  = await request.json()
+        value = body.get("value")
+        force = force or bool(body.get("force", False))
+        valid = [e.value for e in ChargingPriority]
+        if value is None or value not in valid:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid charging priority — must be one of {[e.name for e in ChargingPriority]}",
+            )
 
-            name = ChargingPriority(int(value)).name
-            log.info("/set_charging_priority: set to %s (reg 0xE20F=%d)", name, value)
-            return {"success": True, "value": name}
-        except HTTPException:
-            raise
-        except Exception as e:
-            log.error("/set_charging_priority: unexpected error: %s", e)
-            raise HTTPException(status_code=500, detail=f"Error: {e}")
-        finally:
-            modbus_client.close()
+        log.debug("/set_charging_priority: writing 0xE20F = %d (%s)", value, ChargingPriority(value).name)
+        response = await _write_config("set_charging_priority", REG_CHARGING_PRIORITY, int(value), force)
+        if response is None:
+            log.info("/set_charging_priority: already %s — write skipped", ChargingPriority(int(value)).name)
+            return {"success": True, "value": ChargingPriority(int(value)).name, "written": False}
+        if response.isError():
+            log.error("/set_charging_priority: register write failed: %s", response)
+            raise HTTPException(status_code=500, detail="Failed to set Charging Priority")
+
+        name = ChargingPriority(int(value)).name
+        log.info("/set_charging_priority: set to %s (reg 0xE20F=%d)", name, value)
+        return {"success": True, "value": name, "written": True}
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.error("/set_charging_priority: unexpected error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error: {e}")
 
 
 @app.get("/get_charging_priority")
 async def get_charging_priority():
-    """Read the current charging priority."""
-    async with _powmr_lock:
-        modbus_client = connect_modbus()
-        try:
-            response = modbus_client.read_holding_registers(address=0xE20F, count=1)
-            if response.isError():
-                log.error("/get_charging_priority: register read failed: %s", response)
-                raise HTTPException(status_code=500, detail="Failed to read Charging Priority")
-            value = response.registers[0]
-            if value not in [e.value for e in ChargingPriority]:
-                log.warning("/get_charging_priority: unexpected value %d in register 0xE20F", value)
-                raise HTTPException(
-                    status_code=500, detail=f"Unexpected Charging Priority value: {value}"
-                )
-            log.debug("/get_charging_priority: %s (%d)", ChargingPriority(value).name, value)
-            return {"value": ChargingPriority(value).name, "raw_value": value}
-        except HTTPException:
-            raise
-        except Exception as e:
-            log.error("/get_charging_priority: unexpected error: %s", e)
-            raise HTTPException(status_code=500, detail=f"Error: {e}")
-        finally:
-            modbus_client.close()
+    """Read the current charging priority (from the configuration cache when fresh)."""
+    try:
+        value, cached = await _read_config("get_charging_priority", REG_CHARGING_PRIORITY)
+        if value not in [e.value for e in ChargingPriority]:
+            log.warning("/get_charging_priority: unexpected value %d in register 0xE20F", value)
+            raise HTTPException(
+                status_code=500, detail=f"Unexpected Charging Priority value: {value}"
+            )
+        log.debug("/get_charging_priority: %s (%d)%s", ChargingPriority(value).name, value, " [cached]" if cached else "")
+        return {"value": ChargingPriority(value).name, "raw_value": value, "cached": cached}
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.error("/get_charging_priority: unexpected error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error: {e}")
+
+
+# ── Batched writes ────────────────────────────────────────────────────────────
+#
+# /write_batch applies an ordered list of configuration writes in one lock
+# hold and one serial transaction (one connect/close in per_request mode).
+# Runs of adjacent registers in list order (e.g. 0xE204 then 0xE205) go out
+# as a single function 0x10 (Write Multiple Registers) request; if the
+# inverter answers 0x10 with IllegalFunction, that run — and every later
+# batch — falls back to one 0x06 write per register.
+#
+# Values are raw register values (charge current in 0.1 A units), checked
+# against the whitelist below before anything is written. Unchanged values
+# are skipped via the configuration cache unless "force" is set.
+
+_BATCH_WRITABLE: Dict[int, Tuple[str, Callable[[int], bool]]] = {
+    REG_OUTPUT_PRIORITY:   ("output_priority",   lambda v: v in {e.value for e in OutputPriority}),
+    # 0..150.0 A — well above BULK_MAX_CURRENT (120 A) in battery_controller.
+    REG_CHARGE_CURRENT:    ("charge_current",    lambda v: 0 <= v <= 1500),
+    REG_CHARGING_PRIORITY: ("charging_priority", lambda v: v in {e.value for e in ChargingPriority}),
+}
+
+# Cleared (on the PowMr bus thread) the first time the inverter rejects FC 0x10.
+_fc16_supported: bool = True
+
+
+class _BatchIOError(RuntimeError):
+    """A batch write hit an I/O failure; carries the per-item results so far."""
+
+    def __init__(self, results: Dict[int, Dict[str, str]]) -> None:
+        super().__init__("batch write I/O failure")
+        self.results = results
+
+
+def _write_runs(client, runs: List[List[Tuple[int, int, int]]]) -> Dict[int, Dict[str, str]]:
+    """Write each run of (index, addr, value) items; per-item result by index.
+
+    Blocking — runs inside a PowMr `_transaction`. Raises _BatchIOError after
+    the last run if any write raised, so the session scores the failure.
+    """
+    global _fc16_supported
+    results: Dict[int, Dict[str, str]] = {}
+    io_failed = False
+
+    def _record(items, rr=None, fc="0x06", error=None) -> None:
+        for idx, _, _ in items:
+            if error is None and rr is not None and rr.isError():
+                error = str(rr)
+            results[idx] = {"status": "failed" if error else "written", "function": fc}
+            if error:
+                results[idx]["error"] = error
+
+    for run in runs:
+        if len(run) > 1 and _fc16_supported:
+            try:
+                rr = client.write_registers(run[0][1], [v for _, _, v in run])
+            except Exception as e:
+                io_failed = True
+                _record(run, fc="0x10", error=str(e))
+                continue
+            if not (rr.isError() and getattr(rr, "exception_code", None) == 1):
+                _record(run, rr, fc="0x10")
+                continue
+            _fc16_supported = False
+            log.warning("PowMr rejected FC 0x10 (IllegalFunction) — batch writes fall back to FC 0x06")
+        for item in run:
+            try:
+                rr = client.write_register(item[1], item[2])
+            except Exception as e:
+                io_failed = True
+                _record([item], error=str(e))
+                continue
+            _record([item], rr)
+
+    if io_failed:
+        raise _BatchIOError(results)
+    return results
+
+
+async def _apply_writes(op: str, items: List[Tuple[int, int]], force: bool) -> List[Dict[str, object]]:
+    """Write validated (addr, value) items in order under one bus-slot hold.
+
+    Shared by /write_batch and the Modbus TCP gateway. Returns one result
+    per item: {"register", "value", "status": written|skipped|failed,
+    "function"?, "error"?}.
+    """
+    results: Dict[int, Dict[str, str]] = {}
+    async with _slot(_POWMR, op, BusClass.CONTROL_WRITE):
+        pending: List[Tuple[int, int, int]] = []
+        for idx, (addr, value) in enumerate(items):
+            if not force and _config.get(addr, CONFIG_MAX_AGE_S) == value:
+                results[idx] = {"status": "skipped"}
+            else:
+                pending.append((idx, addr, value))
+
+        runs: List[List[Tuple[int, int, int]]] = []
+        for item in pending:
+            if runs and item[1] == runs[-1][-1][1] + 1:
+                runs[-1].append(item)
+            else:
+                runs.append([item])
+
+        if runs:
+            try:
+                results.update(await _POWMR.bus.run(
+                    _transaction, _POWMR, lambda c: _write_runs(c, runs),
+                ))
+            except _BatchIOError as e:
+                results.update(e.results)
+
+    out: List[Dict[str, object]] = []
+    for idx, (addr, value) in enumerate(items):
+        res = results.get(idx, {"status": "failed", "error": "not attempted"})
+        reg = f"0x{addr:04x}"
+        if res["status"] == "written":
+            _config.confirm(addr, value)
+        elif res["status"] == "failed":
+            _config.invalidate(addr)
+        _metrics.config_writes.inc(register=reg, result=res["status"])
+        out.append({"register": reg, "value": value, **res})
+    return out
+
+
+@app.post("/write_batch")
+async def write_batch(
+    request: Request,
+    force: bool = False,
+    credentials: HTTPBasicCredentials = Depends(verify_credentials),
+):
+    """Apply several configuration writes under one lock hold.
+
+    Body: {"writes": [{"register": "0xE204", "value": 2},
+                      {"register": "0xE205", "value": 300}], "force": false}
+
+    Every item is validated first (HTTP 400, nothing written, on any bad
+    item). Response: {"success": <all ok>, "results": [{"register", "value",
+    "status": written|skipped|failed, "function", "error"?}, ...]}.
+    """
+    try:
+        body   = await request.json()
+        writes = body.get("writes")
+        force  = force or bool(body.get("force", False))
+        if not isinstance(writes, list) or not writes:
+            raise HTTPException(status_code=400, detail="'writes' must be a non-empty list")
+
+        items: List[Tuple[int, int]] = []
+        for i, w in enumerate(writes):
+            try:
+                addr  = int(str(w["register"]), 0)
+                value = w["value"]
+            except (KeyError, TypeError, ValueError):
+                raise HTTPException(status_code=400, detail=f"writes[{i}]: need 'register' and 'value'")
+            if addr not in _BATCH_WRITABLE:
+                raise HTTPException(status_code=400, detail=f"writes[{i}]: register 0x{addr:04X} is not writable")
+            name, valid = _BATCH_WRITABLE[addr]
+            if not isinstance(value, int) or isinstance(value, bool) or not valid(value):
+                raise HTTPException(status_code=400, detail=f"writes[{i}]: invalid {name} value {value!r}")
+            items.append((addr, value))
+
+        out = await _apply_writes("write_batch", items, force)
+        ok  = all(r["status"] != "failed" for r in out)
+        log.info("/write_batch: %s", ", ".join(f"{r['register']}={r['value']} {r['status']}" for r in out))
+        return {"success": ok, "results": out}
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.error("/write_batch: unexpected error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error: {e}")
+
+
+# ── Modbus TCP gateway ────────────────────────────────────────────────────────
+#
+# With MODBUS_TCP_PORT set, modbus_gateway serves the register image over
+# Modbus TCP so tools like Home Assistant can poll the inverters without
+# touching the serial ports. Each device is the unit id devices.yaml gives
+# it; reads come from the snapshot (plus the configuration cache for the
+# PowMr config registers) and never reach the bus — a device whose full
+# region is older than FULL_MAX_AGE_S answers exception 0x0B instead of
+# stale values. Writes are refused (exception 0x01) unless MODBUS_TCP_WRITES
+# is set; then they are limited to the /write_batch whitelist and go through
+# _apply_writes: the same bus slot, configuration cache and FC 0x10
+# fallback, so an unchanged value is skipped there too.
+
+_gateway: Optional[ModbusTcpGateway] = None
+
+
+def _gateway_image(dev: Device) -> Callable[[], Optional[Mapping[int, int]]]:
+    def image() -> Optional[Mapping[int, int]]:
+        if _store.age(dev.full_region) > FULL_MAX_AGE_S:
+            return None
+        raw = _store.current.device(dev.name)
+        if dev is not _POWMR:
+            return raw
+        config = {addr: value for addr in _BATCH_WRITABLE
+                  if (value := _config.get(addr, CONFIG_MAX_AGE_S)) is not None}
+        return ChainMap(config, raw) if config else raw
+    return image
+
+
+async def _gateway_write(items: List[Tuple[int, int]]) -> None:
+    out = await _apply_writes("tcp_write", items, force=False)
+    log.info("Modbus TCP write: %s", ", ".join(f"{r['register']}={r['value']} {r['status']}" for r in out))
+    failed = [r for r in out if r["status"] == "failed"]
+    if failed:
+        raise RuntimeError("; ".join(f"{r['register']}: {r.get('error', 'failed')}" for r in failed))
+
+
+async def _start_gateway() -> None:
+    global _gateway
+    units = {}
+    for dev in _DEVICES.values():
+        unit = GatewayUnit(
+            name=dev.name,
+            function=FC_READ_INPUT if dev.plan.profile.function == "input" else FC_READ_HOLDING,
+            image=_gateway_image(dev),
+        )
+        if dev is _POWMR and GATEWAY_WRITES:
+            unit.writable = {addr: valid for addr, (_, valid) in _BATCH_WRITABLE.items()}
+            unit.write    = _gateway_write
+        units[dev.cfg.unit_id] = unit
+    gateway = ModbusTcpGateway(units, GATEWAY_HOST, GATEWAY_PORT,
+                               max_clients=GATEWAY_MAX_CLIENTS, metrics=_metrics)
+    try:
+        await gateway.start()
+    except OSError as e:
+        # The HTTP API (and the control loop behind it) matters more than
+        # the gateway — keep serving without it.
+        log.error("Modbus TCP gateway could not listen on %s:%d: %s", GATEWAY_HOST, GATEWAY_PORT, e)
+        return
+    _gateway = gateway
+    if GATEWAY_WRITES:
+        log.warning("Modbus TCP gateway accepts unauthenticated writes to %s (MODBUS_TCP_WRITES)",
+                    ", ".join(f"0x{addr:04X}" for addr in _BATCH_WRITABLE))
 
 
 # ── Targets form ──────────────────────────────────────────────────────────────
@@ -866,8 +1781,7 @@ async def set_targets_form(
     credentials: HTTPBasicCredentials = Depends(verify_credentials),
 ):
     try:
-        with open(CONFIG_PATH) as f:
-            targets = json.load(f)
+        targets = _targets.load()
         # Coerce to int so the form (and confirmation message) never show "80.0".
         target_soc           = int(targets.get("target_soc", 90))
         daily_charge_current = int(targets.get("daily_charge_current", 0))
@@ -927,11 +1841,10 @@ async def set_targets(
     if override_state != "auto" and override_state not in VALID_OVERRIDE_STATES:
         errors.append(f"override_state must be auto/UTI_CHARGING/UTI_STOPPED/SBU (got {override_state!r})")
 
-    # Read existing targets so last_full_charge (owned by battery_controller) is preserved
-    # — we only ever write the user-facing keys plus whatever was already there.
+    # Shown on the re-rendered form; the write itself re-reads under the lock so
+    # last_full_charge (owned by battery_controller) is preserved.
     try:
-        with open(CONFIG_PATH) as f:
-            existing = json.load(f)
+        existing = _targets.load()
     except Exception:
         existing = {}
     last_full_charge = existing.get("last_full_charge") or "never"
@@ -958,32 +1871,33 @@ async def set_targets(
         log.warning("/set_targets: validation error: %s", "; ".join(errors))
         return _render("Validation error: " + "; ".join(errors), status_code=400)
 
-    targets = dict(existing)
-    targets["target_soc"]           = target_soc
-    targets["daily_charge_current"] = daily_charge_current
-    targets["full_charge"]          = full_charge
-
+    # Only the user-facing keys are touched; everything else already in the
+    # file is kept as the latest writer left it.
+    override = None
     if override_state == "auto":
-        targets.pop("manual_override", None)
         override_summary = "auto (no override)"
     else:
-        expires = datetime.now(timezone.utc) + timedelta(minutes=OVERRIDE_TTL_MINUTES)
-        targets["manual_override"] = {
-            "state":      override_state,
-            "expires_at": expires.isoformat(),
-        }
+        expires  = datetime.now(timezone.utc) + timedelta(minutes=OVERRIDE_TTL_MINUTES)
+        override = {"state": override_state, "expires_at": expires.isoformat()}
         override_summary = f"{override_state} for {OVERRIDE_TTL_MINUTES} min"
-
-    if skip_auto:
-        targets["skip_next_auto"] = _next_2259_date_iso()
-        skip_summary = f"skip 22:59 on {targets['skip_next_auto']}"
-    else:
-        targets.pop("skip_next_auto", None)
-        skip_summary = "no"
+    skip_date    = _next_2259_date_iso() if skip_auto else None
+    skip_summary = f"skip 22:59 on {skip_date}" if skip_date else "no"
+
+    def _apply(targets: dict) -> None:
+        targets["target_soc"]           = target_soc
+        targets["daily_charge_current"] = daily_charge_current
+        targets["full_charge"]          = full_charge
+        if override is None:
+            targets.pop("manual_override", None)
+        else:
+            targets["manual_override"] = override
+        if skip_date is None:
+            targets.pop("skip_next_auto", None)
+        else:
+            targets["skip_next_auto"] = skip_date
 
     try:
-        with open(CONFIG_PATH, "w") as f:
-            json.dump(targets, f)
+        targets = _targets.update(_apply)
         log.info(
             "/set_targets: saved target_soc=%d%%  daily_charge_current=%d A  "
             "full_charge=%s  override=%s  skip_auto=%s",
@@ -0,0 +1,410 @@
+"""Serial-bus execution helpers for modbus_api.
+
+pymodbus' ``ModbusSerialClient`` is blocking: a 96-register Growatt read at
+9600 baud holds the calling thread for a few hundred milliseconds.  Calling
+it straight from an ``async def`` endpoint freezes the whole uvicorn event
+loop for that long, so every other request — including the controller's
+5 s ``/limited_registers`` poll — queues behind it.
+
+Every serial transaction is therefore handed to the port's ``BusWorker``:
+one dedicated thread per serial port.  The awaiting coroutine yields the
+event loop while the bytes are on the wire, and transactions on different
+ports (PowMr vs Growatt) run in parallel.
+
+Concurrent identical reads are coalesced by ``SingleFlight`` so a burst of
+callers costs one serial round trip.
+
+``SerialSession`` owns a port's client and decides, per transaction, whether
+the port is closed afterwards (``per_request`` — the original behaviour) or
+kept open (``persistent``), and when a persistent port must be reopened or
+its client rebuilt.
+
+``BusScheduler`` hands out a port's bus slot by priority class instead of
+FIFO, so a control-loop read never queues behind telemetry or debug reads.
+
+Log levels
+----------
+  DEBUG  — worker start/stop, coalesced reads, session opens/closes
+  INFO   — session reopen after idle
+  WARNING — session reopen/rebuild after failures
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import (
+    Any, AsyncIterator, Awaitable, Callable, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar,
+)
+
+from log_config import get_logger
+
+log = get_logger("modbus_api.bus")
+
+T = TypeVar("T")
+
+
+class BusWorker:
+    """Runs blocking Modbus transactions for one serial port on its own thread.
+
+    The single worker thread is the only code that ever touches the port's
+    client, so transactions stay strictly sequential even if an awaiting
+    coroutine is cancelled mid-flight (e.g. the HTTP client disconnects):
+    the in-progress transaction finishes on the thread and the next one
+    queues behind it.
+    """
+
+    def __init__(self, label: str) -> None:
+        self.label = label
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"bus-{label.lower()}",
+        )
+        log.debug("%s: bus worker started", label)
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run ``fn(*args, **kwargs)`` on the bus thread and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(fn, *args, **kwargs),
+        )
+
+    def shutdown(self) -> None:
+        """Finish the in-flight transaction and stop the worker thread."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        log.debug("%s: bus worker stopped", self.label)
+
+
+class SingleFlight:
+    """Coalesces concurrent identical bus reads onto one transaction.
+
+    While a read for a given key (e.g. device + block set) is in flight, later
+    callers await the same result instead of queueing their own serial round
+    trip behind the bus lock.  Joiners get a read that was already under way
+    when they asked, delivered sooner than a queued read of their own would
+    have been — no cache, so no added staleness.  ``saved`` counts the
+    transactions avoided.
+
+    Event-loop only; not thread-safe.
+    """
+
+    def __init__(self, label: str) -> None:
+        self.label = label
+        self.saved = 0
+        self.saved_by_key: Dict[str, int] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.saved += 1
+            name = _key_name(key)
+            self.saved_by_key[name] = self.saved_by_key.get(name, 0) + 1
+            log.debug("%s: joined in-flight read %s (%d saved)", self.label, name, self.saved)
+            # shield: a cancelled joiner must not cancel the shared read.
+            return await asyncio.shield(fut)
+
+        fut = asyncio.ensure_future(fn())
+        self._inflight[key] = fut
+        fut.add_done_callback(functools.partial(self._finished, key))
+        return await asyncio.shield(fut)
+
+    def _finished(self, key: Hashable, fut: asyncio.Future) -> None:
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+        # Mark the exception retrieved — every awaiting caller may have been
+        # cancelled, and asyncio would otherwise log it as never retrieved.
+        if not fut.cancelled():
+            fut.exception()
+
+
+def _key_name(key: Hashable) -> str:
+    """Human-readable form of a coalescing key: ('powmr', ((256, 3),)) → 'powmr:0x0100/3'."""
+    if isinstance(key, tuple) and len(key) == 2 and isinstance(key[1], tuple):
+        device, blocks = key
+        return f"{device}:" + ",".join(f"0x{s:04x}/{n}" for s, n in blocks)
+    return str(key)
+
+
+# ── Serial sessions ───────────────────────────────────────────────────────────
+
+SESSION_MODES = ("per_request", "persistent")
+
+# Health score for persistent sessions. Each successful transaction earns a
+# point back (up to HEALTH_MAX); each failure costs HEALTH_FAIL_COST. Any
+# failure reopens the port (drops partial frames and resets the framer), and
+# once the score sinks to HEALTH_REBUILD_AT the client object itself is
+# rebuilt — i.e. two failures in quick succession, or a steady trickle that
+# successes can't pay back.
+HEALTH_MAX:        int = 10
+HEALTH_FAIL_COST:  int = 4
+HEALTH_REBUILD_AT: int = 2
+
+C = TypeVar("C")
+
+
+class SessionStats:
+    """Per-mode transaction latency (open → transact → close, in seconds)."""
+
+    def __init__(self) -> None:
+        self.count   = 0
+        self.errors  = 0
+        self.total_s = 0.0
+        self.max_s   = 0.0
+
+    def record(self, elapsed: float, ok: bool) -> None:
+        self.count   += 1
+        self.errors  += 0 if ok else 1
+        self.total_s += elapsed
+        self.max_s    = max(self.max_s, elapsed)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "transactions": self.count,
+            "errors":       self.errors,
+            "avg_ms":       round(1000.0 * self.total_s / self.count, 2) if self.count else 0.0,
+            "max_ms":       round(1000.0 * self.max_s, 2),
+        }
+
+
+class SerialSession(Generic[C]):
+    """Owns one serial port's Modbus client and its open/close policy.
+
+    ``per_request``: connect() before and close() after every transaction —
+    every poll pays for the port open, termios setup and framer reset.
+
+    ``persistent``: the port stays open between transactions.  It is only
+    reopened when the health score drops (a transaction failed) or when it
+    sat idle for longer than *idle_reopen_s*, and the client is only rebuilt
+    once the score says reopening isn't enough.
+
+    *factory* builds a fresh client (or None when the device is not visible).
+    Every method except ``stats_dict`` must run on the port's bus thread.
+    """
+
+    def __init__(
+        self,
+        label: str,
+        factory: Callable[[], Optional[C]],
+        mode: str = "per_request",
+        idle_reopen_s: float = 60.0,
+    ) -> None:
+        if mode not in SESSION_MODES:
+            raise ValueError(f"session mode must be one of {SESSION_MODES} (got {mode!r})")
+        self.label         = label
+        self.mode          = mode
+        self.idle_reopen_s = idle_reopen_s
+        self.health        = HEALTH_MAX
+        self.reopens       = 0
+        self.stats: Dict[str, SessionStats] = {m: SessionStats() for m in SESSION_MODES}
+        self._factory      = factory
+        self._last_used    = time.monotonic()
+        self.client: Optional[C] = factory()
+
+    @property
+    def persistent(self) -> bool:
+        return self.mode == "persistent"
+
+    def open(self) -> bool:
+        """Make sure the port is open; False if the device is gone or won't open."""
+        if self.client is None:
+            return False
+        if self.persistent and self.client.connected:
+            idle = time.monotonic() - self._last_used
+            if idle < self.idle_reopen_s:
+                return True
+            log.info("%s: port idle for %.0f s — reopening", self.label, idle)
+            self.reopens += 1
+            self.close()
+        return self.client.connect()
+
+    def finish(self, elapsed: float, ok: bool) -> bool:
+        """Account for one transaction; return True if the client needs a rebuild.
+
+        In per_request mode this closes the port and never asks for a
+        rebuild — the caller's own recovery path decides, as before.
+        """
+        self.stats[self.mode].record(elapsed, ok)
+        self._last_used = time.monotonic()
+        if not self.persistent:
+            self.close()
+            return False
+        if ok:
+            self.health = min(HEALTH_MAX, self.health + 1)
+            return False
+        self.health -= HEALTH_FAIL_COST
+        if self.health <= HEALTH_REBUILD_AT:
+            log.warning("%s: health %d/%d — client rebuild due", self.label, self.health, HEALTH_MAX)
+            self.health = HEALTH_MAX
+            return True
+        log.warning("%s: transaction failed, health %d/%d — reopening port",
+                    self.label, self.health, HEALTH_MAX)
+        self.reopens += 1
+        self.close()
+        return False
+
+    def rebuild(self) -> Optional[C]:
+        """Discard the client object and build a fresh one via the factory."""
+        self.close()
+        self.client = self._factory()
+        return self.client
+
+    def close(self) -> None:
+        if self.client is None:
+            return
+        try:
+            self.client.close()
+        except Exception as e:
+            log.debug("%s: close() raised %s (ignored)", self.label, e)
+
+    def stats_dict(self) -> Dict[str, Any]:
+        return {
+            "mode":    self.mode,
+            "health":  self.health,
+            "reopens": self.reopens,
+            "latency": {m: st.as_dict() for m, st in self.stats.items()},
+        }
+
+
+# ── Bus scheduling ────────────────────────────────────────────────────────────
+
+
+class BusClass(IntEnum):
+    """Priority classes for a bus slot; lower value is served first."""
+
+    CONTROL_WRITE = 0   # setpoint writes from the controller / targets form
+    CONTROL_READ  = 1   # the fast-tier registers the control loop polls
+    BULK          = 2   # full telemetry reads, config verification
+    DEBUG         = 3   # /raw_read and other ad-hoc probes
+
+    @property
+    def label(self) -> str:
+        return self.name.lower()
+
+
+class WaitStats:
+    """Queue-wait accounting for one priority class (seconds)."""
+
+    def __init__(self) -> None:
+        self.count   = 0
+        self.total_s = 0.0
+        self.max_s   = 0.0
+
+    def record(self, waited: float) -> None:
+        self.count   += 1
+        self.total_s += waited
+        self.max_s    = max(self.max_s, waited)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "grants":      self.count,
+            "avg_wait_ms": round(1000.0 * self.total_s / self.count, 2) if self.count else 0.0,
+            "max_wait_ms": round(1000.0 * self.max_s, 2),
+        }
+
+
+class BusScheduler:
+    """Non-preemptive priority lock for one serial bus.
+
+    One holder at a time, like the ``asyncio.Lock`` it replaces; when the
+    slot frees up it goes to the waiter with the most urgent ``BusClass``,
+    FIFO within a class.  A transaction in progress is never interrupted, so
+    the worst-case wait of a class is the longest single transaction of a
+    lower class plus the work queued ahead of it in higher classes.  Long
+    bulk reads keep that bound small by checking ``should_yield`` between
+    blocks and giving the slot up when more urgent work is waiting.
+
+    So that a steady bulk load cannot starve debug reads, a DEBUG waiter
+    queued for longer than *age_s* competes as BULK (and, being older, wins
+    the FIFO tie).  Control classes never age and are never outranked.
+
+    The slot itself is event-loop only.  ``should_yield`` only reads a
+    per-class waiter count and may be called from the bus thread.
+    """
+
+    def __init__(self, label: str, age_s: float = 2.0) -> None:
+        self.label    = label
+        self.age_s    = age_s
+        self.yields   = 0
+        self.stats: Dict[BusClass, WaitStats] = {c: WaitStats() for c in BusClass}
+        self._busy    = False
+        self._seq     = itertools.count()
+        # (class, seq, queued_at, future) — a handful of entries at most,
+        # so release() scans instead of keeping a heap under aging.
+        self._queue: List[Tuple[BusClass, int, float, asyncio.Future]] = []
+        self._waiting = [0] * len(BusClass)
+
+    def waiting(self, cls: BusClass) -> int:
+        return self._waiting[cls]
+
+    def should_yield(self, cls: BusClass) -> bool:
+        """True when a more urgent class is queued behind the current holder."""
+        return any(self._waiting[c] for c in range(cls))
+
+    async def acquire(self, cls: BusClass) -> float:
+        """Wait for the bus slot; return the seconds spent queued."""
+        started = time.perf_counter()
+        if not self._busy and not self._queue:
+            self._busy = True
+            return self._granted(cls, started)
+
+        fut = asyncio.get_running_loop().create_future()
+        entry = (cls, next(self._seq), time.monotonic(), fut)
+        self._queue.append(entry)
+        self._waiting[cls] += 1
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Granted in the same tick we were cancelled — pass it on.
+                self.release()
+            elif entry in self._queue:   # release() may already have dropped it
+                self._queue.remove(entry)
+                self._waiting[cls] -= 1
+            raise
+        return self._granted(cls, started)
+
+    def _granted(self, cls: BusClass, started: float) -> float:
+        waited = time.perf_counter() - started
+        self.stats[cls].record(waited)
+        return waited
+
+    def _rank(self, entry: Tuple[BusClass, int, float, asyncio.Future], now: float) -> Tuple[int, int]:
+        cls, seq, queued_at, _ = entry
+        if cls == BusClass.DEBUG and now - queued_at >= self.age_s:
+            return BusClass.BULK, seq
+        return cls, seq
+
+    def release(self) -> None:
+        """Hand the slot to the most urgent waiter, or mark the bus idle."""
+        now = time.monotonic()
+        while self._queue:
+            entry = min(self._queue, key=lambda e: self._rank(e, now))
+            self._queue.remove(entry)
+            cls, _, _, fut = entry
+            self._waiting[cls] -= 1
+            if not fut.done():
+                fut.set_result(None)   # ownership passes directly; _busy stays True
+                return
+        self._busy = False
+
+    @asynccontextmanager
+    async def slot(self, cls: BusClass) -> AsyncIterator[float]:
+        """``async with sched.slot(cls) as waited:`` — hold the bus for one unit of work."""
+        waited = await self.acquire(cls)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def stats_dict(self) -> Dict[str, Any]:
+        return {
+            "busy":    self._busy,
+            "yields":  self.yields,
+            "classes": {
+                c.label: {"waiting": self._waiting[c], **self.stats[c].as_dict()} for c in BusClass
+            },
+        }
@@ -0,0 +1,258 @@
+"""Modbus TCP gateway in front of modbus_api's register image.
+
+Tools that only speak Modbus TCP (Home Assistant, a second logger) would
+otherwise need the USB-serial ports modbus_api owns.  The gateway answers
+them from the in-process snapshot instead, so any number of TCP clients add
+no serial traffic at all:
+
+  FC 0x03 / 0x04   read holding / input registers — served from the image
+                   of the device behind the unit id; only the registers the
+                   poller reads (and cached configuration registers) exist
+  FC 0x06 / 0x10   write single / multiple registers — only whitelisted
+                   registers, forwarded through modbus_api's locked write
+                   path (bus slot, configuration cache, FC 0x10 fallback)
+
+Each configured device is one unit id (devices.yaml ``unit_id``).  Modbus
+exception codes:
+
+  0x01  function not supported by this unit
+  0x02  an address outside the image / not writable
+  0x03  bad count, byte count, or a value the whitelist rejects
+  0x04  the forwarded write failed on the serial bus
+  0x0A  no such unit id
+  0x0B  the device's image is stale (the poller hasn't read it recently)
+
+MBAP framing: transaction id (H), protocol id (H, 0), length (H), unit id
+(B), then the PDU — all big-endian.  Requests on one connection are
+answered in order.
+
+Log levels
+----------
+  DEBUG  — every request and its outcome
+  INFO   — listening, client connect/disconnect
+  WARNING — malformed frames, client limit reached, failed forwarded writes
+"""
+from __future__ import annotations
+
+import asyncio
+import struct
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+from log_config import get_logger
+
+log = get_logger("modbus_api.gateway")
+
+FC_READ_HOLDING   = 0x03
+FC_READ_INPUT     = 0x04
+FC_WRITE_SINGLE   = 0x06
+FC_WRITE_MULTIPLE = 0x10
+
+EXC_ILLEGAL_FUNCTION   = 0x01
+EXC_ILLEGAL_ADDRESS    = 0x02
+EXC_ILLEGAL_VALUE      = 0x03
+EXC_DEVICE_FAILURE     = 0x04
+EXC_PATH_UNAVAILABLE   = 0x0A
+EXC_TARGET_NO_RESPONSE = 0x0B
+
+_EXC_NAMES: Dict[int, str] = {
+    EXC_ILLEGAL_FUNCTION:   "illegal_function",
+    EXC_ILLEGAL_ADDRESS:    "illegal_address",
+    EXC_ILLEGAL_VALUE:      "illegal_value",
+    EXC_DEVICE_FAILURE:     "device_failure",
+    EXC_PATH_UNAVAILABLE:   "no_such_unit",
+    EXC_TARGET_NO_RESPONSE: "stale",
+}
+
+MAX_READ  = 125   # protocol limits for FC 0x03/0x04 and FC 0x10
+MAX_WRITE = 123
+
+_MBAP = struct.Struct(">HHHB")
+
+
+class GatewayError(Exception):
+    """Answer the current request with Modbus exception *code*."""
+
+    def __init__(self, code: int, detail: str = "") -> None:
+        super().__init__(detail or _EXC_NAMES.get(code, f"exception 0x{code:02x}"))
+        self.code = code
+
+
+@dataclass
+class GatewayUnit:
+    """One unit id: where its registers come from and what may be written."""
+    name:     str
+    function: int                                       # FC_READ_HOLDING | FC_READ_INPUT
+    image:    Callable[[], Optional[Mapping[int, int]]]  # None while stale
+    # Writable address → value check; writes go to `write` as [(addr, value), ...].
+    writable: Mapping[int, Callable[[int], bool]] = field(default_factory=dict)
+    write:    Optional[Callable[[List[Tuple[int, int]]], Awaitable[None]]] = None
+
+
+class ModbusTcpGateway:
+    """asyncio Modbus TCP server over a set of GatewayUnits.
+
+    *metrics* (a bus_metrics.BusMetrics) is optional; with it every request
+    is counted in modbus_gateway_requests_total.
+    """
+
+    def __init__(
+        self,
+        units: Mapping[int, GatewayUnit],
+        host: str = "0.0.0.0",
+        port: int = 502,
+        max_clients: int = 16,
+        idle_timeout_s: float = 300.0,
+        metrics: Any = None,
+    ) -> None:
+        self.units          = dict(units)
+        self.host           = host
+        self.port           = port
+        self.max_clients    = max_clients
+        self.idle_timeout_s = idle_timeout_s
+        self.metrics        = metrics
+        self.requests       = 0
+        self.exceptions     = 0
+        self.rejected       = 0   # connections refused at max_clients
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._clients: Set[asyncio.Task] = set()
+
+    @property
+    def clients(self) -> int:
+        return len(self._clients)
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._connection, self.host, self.port)
+        bound = self._server.sockets[0].getsockname()
+        self.port = bound[1]
+        log.info("Modbus TCP gateway listening on %s:%d (units %s)", self.host, self.port,
+                 ", ".join(f"{uid}={u.name}" for uid, u in sorted(self.units.items())))
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for task in list(self._clients):
+            task.cancel()
+        await asyncio.gather(*self._clients, return_exceptions=True)
+
+    def stats_dict(self) -> Dict[str, Any]:
+        return {
+            "port":       self.port,
+            "clients":    self.clients,
+            "requests":   self.requests,
+            "exceptions": self.exceptions,
+            "rejected":   self.rejected,
+        }
+
+    # ── Connections ───────────────────────────────────────────────────────
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info("peername")
+        if len(self._clients) >= self.max_clients:
+            self.rejected += 1
+            log.warning("Gateway: refusing %s — %d clients connected", peer, len(self._clients))
+            writer.close()
+            return
+        task = asyncio.current_task()
+        self._clients.add(task)
+        log.info("Gateway: client %s connected (%d total)", peer, len(self._clients))
+        try:
+            while True:
+                head = await asyncio.wait_for(reader.readexactly(_MBAP.size), self.idle_timeout_s)
+                tid, proto, length, unit = _MBAP.unpack(head)
+                if proto != 0 or not 2 <= length <= 254:
+                    log.warning("Gateway: malformed MBAP header from %s — closing", peer)
+                    break
+                pdu = await asyncio.wait_for(reader.readexactly(length - 1), self.idle_timeout_s)
+                resp = await self.respond(unit, pdu)
+                writer.write(_MBAP.pack(tid, 0, len(resp) + 1, unit) + resp)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self._clients.discard(task)
+            writer.close()
+            log.info("Gateway: client %s disconnected (%d remaining)", peer, len(self._clients))
+
+    # ── Requests ──────────────────────────────────────────────────────────
+
+    async def respond(self, unit_id: int, pdu: bytes) -> bytes:
+        """Response PDU for request *pdu* addressed to *unit_id*."""
+        fc = pdu[0]
+        unit = self.units.get(unit_id)
+        self.requests += 1
+        try:
+            if unit is None:
+                raise GatewayError(EXC_PATH_UNAVAILABLE)
+            if fc in (FC_READ_HOLDING, FC_READ_INPUT):
+                resp = self._read(unit, fc, pdu)
+            elif fc in (FC_WRITE_SINGLE, FC_WRITE_MULTIPLE):
+                resp = await self._write(unit, fc, pdu)
+            else:
+                raise GatewayError(EXC_ILLEGAL_FUNCTION)
+        except GatewayError as e:
+            self.exceptions += 1
+            self._count(unit, fc, _EXC_NAMES.get(e.code, "exception"))
+            log.debug("Gateway: unit %d fc 0x%02x → exception 0x%02x (%s)", unit_id, fc, e.code, e)
+            return bytes([fc | 0x80, e.code])
+        self._count(unit, fc, "ok")
+        log.debug("Gateway: unit %d fc 0x%02x ok", unit_id, fc)
+        return resp
+
+    def _count(self, unit: Optional[GatewayUnit], fc: int, result: str) -> None:
+        if self.metrics is not None:
+            self.metrics.gateway_requests.inc(
+                device=unit.name if unit else "unknown", function=f"0x{fc:02x}", result=result,
+            )
+
+    def _read(self, unit: GatewayUnit, fc: int, pdu: bytes) -> bytes:
+        if fc != unit.function:
+            raise GatewayError(EXC_ILLEGAL_FUNCTION)
+        if len(pdu) != 5:
+            raise GatewayError(EXC_ILLEGAL_VALUE, "bad read request length")
+        start, count = struct.unpack(">HH", pdu[1:5])
+        if not 1 <= count <= MAX_READ:
+            raise GatewayError(EXC_ILLEGAL_VALUE)
+        image = unit.image()
+        if image is None:
+            raise GatewayError(EXC_TARGET_NO_RESPONSE)
+        try:
+            values = [image[a] for a in range(start, start + count)]
+        except KeyError:
+            raise GatewayError(EXC_ILLEGAL_ADDRESS) from None
+        return bytes([fc, 2 * count]) + struct.pack(f">{count}H", *values)
+
+    async def _write(self, unit: GatewayUnit, fc: int, pdu: bytes) -> bytes:
+        if unit.write is None or not unit.writable:
+            raise GatewayError(EXC_ILLEGAL_FUNCTION)
+        if fc == FC_WRITE_SINGLE:
+            if len(pdu) != 5:
+                raise GatewayError(EXC_ILLEGAL_VALUE, "bad write request length")
+            addr, value = struct.unpack(">HH", pdu[1:5])
+            items = [(addr, value)]
+        else:
+            if len(pdu) < 6:
+                raise GatewayError(EXC_ILLEGAL_VALUE, "bad write request length")
+            start, count, nbytes = struct.unpack(">HHB", pdu[1:6])
+            if not 1 <= count <= MAX_WRITE or nbytes != 2 * count or len(pdu) != 6 + nbytes:
+                raise GatewayError(EXC_ILLEGAL_VALUE)
+            values = struct.unpack(f">{count}H", pdu[6:])
+            items = [(start + i, v) for i, v in enumerate(values)]
+
+        for addr, value in items:
+            check = unit.writable.get(addr)
+            if check is None:
+                raise GatewayError(EXC_ILLEGAL_ADDRESS, f"0x{addr:04x} is not writable")
+            if not check(value):
+                raise GatewayError(EXC_ILLEGAL_VALUE, f"0x{addr:04x}: invalid value {value}")
+        try:
+            await unit.write(items)
+        except GatewayError:
+            raise
+        except Exception as e:
+            log.warning("Gateway: forwarded write to %s failed: %s", unit.name,
+                        getattr(e, "detail", None) or e)
+            raise GatewayError(EXC_DEVICE_FAILURE) from None
+        return pdu[:5]
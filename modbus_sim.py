@@ -0,0 +1,611 @@
+"""Hardware-free Modbus RTU simulator for the PowMr and Growatt inverters.
+
+Presents each inverter as a virtual serial port (a pty pair) and answers
+Modbus RTU on it, so modbus_api — and everything behind it — runs on a dev
+box with nothing plugged in:
+
+    python modbus_sim.py --link-dir /tmp/modbus-sim
+    MODBUS_POWMR_PORT=/tmp/modbus-sim/powmr \\
+    MODBUS_GROWATT_PORT=/tmp/modbus-sim/growatt python modbus_api.py
+
+Devices
+-------
+  powmr    holding registers (FC 0x03), writes via FC 0x06 / 0x10
+  growatt  input registers (FC 0x04), read-only
+
+The readable address space, the illegal gaps and the largest block each
+device accepts come from device_profiles.yaml, so a block read across a gap
+fails with IllegalAddress exactly as the planner assumes.  The PowMr
+configuration registers (0xE204 output priority, 0xE205 charge current,
+0xE20F charging priority) are writable and feed back into the model.
+
+Physics
+-------
+``PlantModel`` is one shared battery bank between the two inverters: a
+time-of-day PV curve with passing clouds on four strings (PV1/PV2 on the
+PowMr, PV3/PV4 on the Growatt), a random-walk split-phase load, and a
+battery whose SoC integrates the net current.  Battery voltage follows SoC
+and current through a simple OCV + internal-resistance model.  The output
+priority decides whether the battery or the grid covers a PV deficit, and
+the charge-current register caps charging.  ``--speed`` runs the model
+clock faster than wall time (SoC moves, the sun moves), but not the bus.
+All values stay inside the regmap.yaml bands unless a fault is injected.
+
+Timing and faults
+-----------------
+Every response waits the frame's wire time — 10 bits per byte, request and
+response, at ``--baud`` — plus ``--turnaround-ms``.  Per request, with the
+given probabilities:
+
+  --fault-illegal   answer IllegalAddress (exception 0x02) to a valid read
+  --fault-timeout   swallow the request (the master times out)
+  --fault-garbage   answer with a corrupted frame: junk bytes ahead of a
+                    valid response, a wrong CRC, or a truncated frame —
+                    the framer-desync symptoms the API recovers from
+  --no-fc16         answer FC 0x10 with IllegalFunction (single-write devices)
+
+Log levels
+----------
+  DEBUG  — every request and response frame
+  INFO   — port links, model summary every --status-s seconds
+  WARNING — injected faults, malformed requests
+"""
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import random
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+import tty
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from log_config import get_logger
+from register_plan import BITS_PER_CHAR, DeviceProfile, load_profiles
+
+log = get_logger("modbus_sim")
+
+UNIT_ID = 1   # pymodbus' default slave id — what modbus_api addresses
+
+FC_READ_HOLDING   = 0x03
+FC_READ_INPUT     = 0x04
+FC_WRITE_SINGLE   = 0x06
+FC_WRITE_MULTIPLE = 0x10
+
+EXC_ILLEGAL_FUNCTION = 0x01
+EXC_ILLEGAL_ADDRESS  = 0x02
+EXC_ILLEGAL_VALUE    = 0x03
+
+REG_OUTPUT_PRIORITY   = 0xE204
+REG_CHARGE_CURRENT    = 0xE205   # ×0.1 A
+REG_CHARGING_PRIORITY = 0xE20F
+
+_CONFIG_DEFAULTS: Dict[int, int] = {
+    REG_OUTPUT_PRIORITY:   2,      # SBU
+    REG_CHARGE_CURRENT:    600,    # 60.0 A
+    REG_CHARGING_PRIORITY: 3,      # OSO — solar only
+}
+_CONFIG_VALID: Dict[int, range] = {
+    REG_OUTPUT_PRIORITY:   range(0, 3),
+    REG_CHARGE_CURRENT:    range(0, 1501),
+    REG_CHARGING_PRIORITY: range(0, 4),
+}
+
+
+# ── RTU framing ───────────────────────────────────────────────────────────────
+
+
+def _crc_table() -> List[int]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc16(data: bytes) -> int:
+    """Modbus CRC-16 (poly 0xA001, init 0xFFFF)."""
+    crc = 0xFFFF
+    for b in data:
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ b) & 0xFF]
+    return crc
+
+
+def frame(pdu: bytes, unit: int = UNIT_ID) -> bytes:
+    """Wrap *pdu* in an RTU frame: unit id + pdu + CRC (low byte first)."""
+    body = bytes([unit]) + pdu
+    return body + struct.pack("<H", crc16(body))
+
+
+def exception_pdu(fc: int, code: int) -> bytes:
+    return bytes([fc | 0x80, code])
+
+
+# ── Plant model ───────────────────────────────────────────────────────────────
+
+
+def _u16(v: float) -> int:
+    return int(round(v)) & 0xFFFF
+
+
+def _u32(v: float) -> tuple:
+    raw = int(round(v)) & 0xFFFFFFFF
+    return raw >> 16, raw & 0xFFFF
+
+
+class PlantModel:
+    """Shared battery bank, PV strings and household load behind both inverters.
+
+    Not thread-safe on its own — ``Simulator`` serialises access.
+    """
+
+    CAPACITY_AH   = 280.0     # 16s LFP bank
+    R_INTERNAL    = 0.012     # ohm
+    STRING_PEAK_W = 2600.0    # per PV string at full sun
+    STRING_VMP    = 380.0
+    MAX_DISCHARGE_A = 250.0
+
+    def __init__(self, speed: float = 1.0, seed: Optional[int] = None, soc: float = 60.0) -> None:
+        self.rng     = random.Random(seed)
+        self.speed   = speed
+        self.soc     = soc
+        self.config  = dict(_CONFIG_DEFAULTS)
+        self.t0_wall = time.monotonic()
+        self.t0_sim  = time.time()
+        self.cloud   = 1.0
+        self.load_w  = [450.0, 380.0]
+        self.pv_w    = [0.0, 0.0, 0.0, 0.0]
+        self.batt_a  = 0.0
+        self.grid_w  = [0.0, 0.0]
+        self.temps   = [32.0, 34.0, 36.0, 31.0]
+        # kWh counters: batt charge/discharge, PowMr PV, load, grid→batt, grid→load, Growatt PV
+        self.daily   = dict.fromkeys(("chg", "dis", "pv", "load", "g2b", "g2l", "pv3"), 0.0)
+        self.total   = {k: 1000.0 for k in self.daily}
+        self._day    = self.now().date()
+        self._last   = time.monotonic()
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.t0_sim + (time.monotonic() - self.t0_wall) * self.speed)
+
+    # -- dynamics --------------------------------------------------------------
+
+    @property
+    def battery_v(self) -> float:
+        ocv = 48.0 + 0.06 * self.soc + (1.2 if self.soc > 95 else 0.0) - (1.5 if self.soc < 8 else 0.0)
+        return min(64.5, max(45.5, ocv + self.batt_a * self.R_INTERNAL))
+
+    def step(self) -> None:
+        """Advance the model to the current simulated time."""
+        wall = time.monotonic()
+        dt = (wall - self._last) * self.speed
+        self._last = wall
+        if dt <= 0:
+            return
+        now = self.now()
+        if now.date() != self._day:
+            self._day = now.date()
+            self.daily = dict.fromkeys(self.daily, 0.0)
+
+        hour = now.hour + now.minute / 60.0 + now.second / 3600.0
+        sun = max(0.0, math.sin(math.pi * (hour - 6.0) / 14.0)) if 6.0 < hour < 20.0 else 0.0
+        self.cloud += (self.rng.gauss(0.0, 0.05) + 0.02 * (0.9 - self.cloud)) * min(dt, 60.0) ** 0.5
+        self.cloud = min(1.0, max(0.2, self.cloud))
+        for i in range(4):
+            skew = 1.0 - 0.04 * i
+            noise = self.rng.gauss(0, 5) if sun > 0 else 0.0
+            self.pv_w[i] = max(0.0, self.STRING_PEAK_W * sun * self.cloud * skew + noise)
+
+        for i in range(2):
+            drift = self.rng.gauss(0.0, 30.0) * min(dt, 10.0) ** 0.5 + 0.01 * (420.0 - self.load_w[i])
+            self.load_w[i] = min(6000.0, max(80.0, self.load_w[i] + drift))
+
+        pv, load = sum(self.pv_w), sum(self.load_w)
+        v = self.battery_v
+        limit_a = self.config[REG_CHARGE_CURRENT] / 10.0
+        priority, charging = self.config[REG_OUTPUT_PRIORITY], self.config[REG_CHARGING_PRIORITY]
+        surplus = pv - load
+
+        if surplus >= 0:
+            charge_a = min(surplus / v, limit_a) if self.soc < 100.0 else 0.0
+            grid_to_batt = 0.0
+            if charging in (1, 2) and charge_a < limit_a and self.soc < 100.0:
+                grid_to_batt = (limit_a - charge_a) * v   # CUB / SNU top up from the grid
+            self.batt_a = charge_a + grid_to_batt / v
+            grid = -(surplus - charge_a * v) + grid_to_batt
+            grid_to_load = 0.0
+        elif priority == 1 or self.soc <= 5.0:
+            # UTI (or empty battery): the grid carries the deficit.
+            grid_to_batt = limit_a * v if charging in (1, 2) and self.soc < 100.0 else 0.0
+            self.batt_a = grid_to_batt / v
+            grid = -surplus + grid_to_batt
+            grid_to_load = -surplus
+        else:
+            # SOL / SBU: the battery carries the deficit.
+            grid_to_batt = 0.0
+            self.batt_a = max(-self.MAX_DISCHARGE_A, surplus / v)
+            grid = -surplus + self.batt_a * v
+            grid_to_load = max(0.0, grid)
+
+        self.grid_w = [grid * self.load_w[0] / load, grid * self.load_w[1] / load]
+        self.soc = min(100.0, max(0.0, self.soc + self.batt_a * dt / 3600.0 / self.CAPACITY_AH * 100.0))
+
+        heat = abs(self.batt_a) * 0.05 + pv / 1000.0
+        for i in range(4):
+            self.temps[i] += (28.0 + heat + 2.0 * i - self.temps[i]) * min(1.0, dt / 600.0)
+
+        kwh = dt / 3600.0 / 1000.0
+        for key, watts in (
+            ("chg", max(0.0, self.batt_a) * v), ("dis", max(0.0, -self.batt_a) * v),
+            ("pv", self.pv_w[0] + self.pv_w[1]), ("load", load), ("g2b", grid_to_batt),
+            ("g2l", grid_to_load), ("pv3", self.pv_w[2]),
+        ):
+            self.daily[key] += watts * kwh
+            self.total[key] += watts * kwh
+
+    # -- register images -------------------------------------------------------
+
+    def powmr_registers(self) -> Dict[int, int]:
+        v = self.battery_v
+        regs = {
+            0x0100: _u16(self.soc),
+            0x0101: _u16(v * 10),
+            0x0102: _u16(self.batt_a * 10),
+        }
+        for base, w in ((0x0107, self.pv_w[0]), (0x010f, self.pv_w[1])):
+            pv_v = self.STRING_VMP if w > 1.0 else 0.0
+            regs[base]     = _u16(pv_v * 10)
+            regs[base + 1] = _u16(min(25.0, w / pv_v if pv_v else 0.0) * 10)
+            regs[base + 2] = _u16(w)
+        grid_v = 1175 + self.rng.randint(-15, 10)   # ~117.5 V legs; band tops out at 120
+        for addr in (0x0213, 0x022a, 0x0216, 0x022c):
+            regs[addr] = grid_v + self.rng.randint(-3, 3)
+        regs[0x0215] = regs[0x0218] = 6000 + self.rng.randint(-3, 3)
+        regs[0x021b], regs[0x0232] = _u16(self.load_w[0] * 0.95), _u16(self.load_w[1] * 0.95)
+        regs[0x021c], regs[0x0234] = _u16(self.load_w[0]), _u16(self.load_w[1])
+        regs[0x023d], regs[0x023e] = _u16(self.grid_w[0]), _u16(self.grid_w[1])
+        regs[0x0220], regs[0x0221], regs[0x0222] = (_u16(t * 10) for t in self.temps[:3])
+        regs[0xF02D] = _u16(self.daily["chg"] / 0.05)
+        regs[0xF02E] = _u16(self.daily["dis"] / 0.05)
+        regs[0xF02F] = _u16(self.daily["pv"] / 0.1)
+        regs[0xF030] = _u16(self.daily["load"] / 0.1)
+        regs[0xF03C] = _u16(self.daily["g2b"] / 0.05)
+        regs[0xF03D] = _u16(self.daily["g2l"] / 0.1)
+        for base, key, scale in ((0xF034, "chg", 0.05), (0xF036, "dis", 0.05),
+                                 (0xF038, "pv", 0.1), (0xF03A, "load", 0.1)):
+            regs[base], regs[base + 1] = _u32(self.total[key] / scale)
+        regs.update(self.config)
+        return regs
+
+    def growatt_registers(self) -> Dict[int, int]:
+        regs: Dict[int, int] = {}
+        for i, (v_addr, i_addr, p_addr) in enumerate(((1, 7, 3), (2, 8, 5))):
+            w = self.pv_w[2 + i]
+            pv_v = self.STRING_VMP if w > 1.0 else 0.0
+            regs[v_addr] = _u16(pv_v * 10)
+            regs[i_addr] = _u16(min(25.0, w / pv_v if pv_v else 0.0) * 10)
+            regs[p_addr], regs[p_addr + 1] = _u32(w * 10)
+        regs[10] = _u16(min(6500.0, sum(self.load_w) * 0.3) * 10)
+        regs[17] = _u16(self.battery_v * 100)
+        regs[83] = _u16(max(0.0, self.batt_a) * 10)
+        regs[84] = _u16(max(0.0, -self.batt_a) * 10)
+        regs[25], regs[26], regs[32], regs[33] = (_u16(t * 10) for t in self.temps)
+        regs[48], regs[49] = _u32(self.daily["pv3"] / 0.1)
+        regs[50], regs[51] = _u32(self.total["pv3"] / 0.1)
+        return regs
+
+    def summary(self) -> str:
+        return (f"{self.now():%H:%M} SoC={self.soc:.1f}% V={self.battery_v:.2f} I={self.batt_a:+.1f}A "
+                f"PV={sum(self.pv_w):.0f}W load={sum(self.load_w):.0f}W grid={sum(self.grid_w):+.0f}W "
+                f"prio={self.config[REG_OUTPUT_PRIORITY]} limit={self.config[REG_CHARGE_CURRENT] / 10:.0f}A")
+
+
+# ── Virtual RTU devices ───────────────────────────────────────────────────────
+
+
+@dataclass
+class FaultConfig:
+    illegal: float = 0.0
+    timeout: float = 0.0
+    garbage: float = 0.0
+    fc16:    bool  = True
+
+
+class VirtualDevice:
+    """One RTU slave on the master side of a pty pair."""
+
+    def __init__(
+        self, name: str, profile: DeviceProfile, sim: "Simulator", link: str,
+        baud: int, turnaround_ms: float, faults: FaultConfig, seed: Optional[int] = None,
+    ) -> None:
+        self.name       = name
+        self.profile    = profile
+        self.sim        = sim
+        self.link       = link
+        self.char_s     = BITS_PER_CHAR / baud
+        self.turnaround = turnaround_ms / 1000.0
+        self.faults     = faults
+        self.function   = FC_READ_HOLDING if profile.function == "holding" else FC_READ_INPUT
+        self.writable: FrozenSet[int] = frozenset(_CONFIG_VALID) if name == "powmr" else frozenset()
+        self.counts: Dict[str, int] = dict.fromkeys(("requests", "illegal", "timeout", "garbage", "crc"), 0)
+        self.rng = random.Random(f"{name}:{seed}")
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        # Holding the slave end open keeps the pty alive across the API's
+        # per-request open/close cycles.
+        if os.path.lexists(link):
+            os.unlink(link)
+        os.symlink(os.ttyname(self.slave), link)
+        log.info("%s: %s → %s (%s registers, max block %d)",
+                 name, link, os.ttyname(self.slave), profile.function, profile.max_block)
+
+    def close(self) -> None:
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        if os.path.islink(self.link):
+            os.unlink(self.link)
+
+    # -- framing ---------------------------------------------------------------
+
+    def _read_exact(self, n: int, timeout: float) -> bytes:
+        buf = b""
+        deadline = time.monotonic() + timeout
+        while len(buf) < n:
+            left = deadline - time.monotonic()
+            if left <= 0 or not select.select([self.master], [], [], left)[0]:
+                break
+            buf += os.read(self.master, n - len(buf))
+        return buf
+
+    def _next_request(self, stop: threading.Event) -> Optional[bytes]:
+        """Block until one request frame arrives; None on stop or a broken frame."""
+        while not stop.is_set():
+            if select.select([self.master], [], [], 0.2)[0]:
+                break
+        else:
+            return None
+        head = self._read_exact(2, 0.05)
+        if len(head) < 2:
+            return None
+        fc = head[1]
+        if fc in (FC_READ_HOLDING, FC_READ_INPUT, FC_WRITE_SINGLE):
+            rest = self._read_exact(6, 0.05)
+        elif fc == FC_WRITE_MULTIPLE:
+            meta = self._read_exact(5, 0.05)
+            rest = meta + self._read_exact(meta[4] + 2, 0.05) if len(meta) == 5 else meta
+        else:
+            rest = self._read_exact(256, 0.01)   # unknown function — drain what's there
+        return head + rest
+
+    def serve(self, stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                req = self._next_request(stop)
+            except OSError as e:
+                log.warning("%s: pty read failed: %s", self.name, e)
+                time.sleep(0.2)
+                continue
+            if req is None:
+                continue
+            if len(req) < 4 or crc16(req[:-2]) != struct.unpack("<H", req[-2:])[0]:
+                self.counts["crc"] += 1
+                log.warning("%s: dropped malformed request %s", self.name, req.hex())
+                self._drain()
+                continue
+            if req[0] != UNIT_ID:
+                continue
+            self.counts["requests"] += 1
+            resp = self._respond(req[1:-2])
+            if resp is None:
+                continue
+            time.sleep(self.char_s * (len(req) + len(resp)) + self.turnaround)
+            log.debug("%s: %s → %s", self.name, req.hex(), resp.hex())
+            os.write(self.master, resp)
+
+    def _drain(self) -> None:
+        while select.select([self.master], [], [], 0.01)[0]:
+            os.read(self.master, 256)
+
+    # -- request handling ------------------------------------------------------
+
+    def _respond(self, pdu: bytes) -> Optional[bytes]:
+        fc = pdu[0]
+        f, rng = self.faults, self.rng
+        if f.timeout and rng.random() < f.timeout:
+            self.counts["timeout"] += 1
+            log.warning("%s: injected timeout (fc 0x%02x)", self.name, fc)
+            return None
+        if fc in (FC_READ_HOLDING, FC_READ_INPUT) and f.illegal and rng.random() < f.illegal:
+            self.counts["illegal"] += 1
+            log.warning("%s: injected IllegalAddress", self.name)
+            return frame(exception_pdu(fc, EXC_ILLEGAL_ADDRESS))
+
+        resp = frame(self._handle(fc, pdu))
+        if f.garbage and rng.random() < f.garbage:
+            self.counts["garbage"] += 1
+            kind = rng.choice(("prefix", "crc", "truncate"))
+            log.warning("%s: injected garbage (%s)", self.name, kind)
+            if kind == "prefix":
+                resp = bytes(rng.randrange(256) for _ in range(rng.randint(1, 6))) + resp
+            elif kind == "crc":
+                resp = resp[:-1] + bytes([resp[-1] ^ 0xFF])
+            else:
+                resp = resp[: rng.randint(2, max(2, len(resp) - 1))]
+        return resp
+
+    def _handle(self, fc: int, pdu: bytes) -> bytes:
+        if fc in (FC_READ_HOLDING, FC_READ_INPUT):
+            if fc != self.function:
+                return exception_pdu(fc, EXC_ILLEGAL_FUNCTION)
+            start, count = struct.unpack(">HH", pdu[1:5])
+            if not 1 <= count <= self.profile.max_block:
+                return exception_pdu(fc, EXC_ILLEGAL_VALUE)
+            regs = self.sim.read(self.name)
+            addrs = range(start, start + count)
+            if any(a in self.profile.illegal and a not in self.writable for a in addrs):
+                return exception_pdu(fc, EXC_ILLEGAL_ADDRESS)
+            values = [regs.get(a, 0) for a in addrs]
+            return bytes([fc, 2 * count]) + struct.pack(f">{count}H", *values)
+
+        if fc == FC_WRITE_SINGLE and self.writable:
+            addr, value = struct.unpack(">HH", pdu[1:5])
+            code = self.sim.write(self.name, {addr: value})
+            return exception_pdu(fc, code) if code else pdu[:5]
+
+        if fc == FC_WRITE_MULTIPLE and self.writable and self.faults.fc16:
+            start, count, nbytes = struct.unpack(">HHB", pdu[1:6])
+            if nbytes != 2 * count or len(pdu) != 6 + nbytes:
+                return exception_pdu(fc, EXC_ILLEGAL_VALUE)
+            values = struct.unpack(f">{count}H", pdu[6:6 + nbytes])
+            code = self.sim.write(self.name, {start + i: v for i, v in enumerate(values)})
+            return exception_pdu(fc, code) if code else pdu[:5]
+
+        return exception_pdu(fc, EXC_ILLEGAL_FUNCTION)
+
+
+# ── Simulator ─────────────────────────────────────────────────────────────────
+
+
+class Simulator:
+    """The plant model plus one VirtualDevice (and serving thread) per inverter."""
+
+    def __init__(self, model: PlantModel) -> None:
+        self.model   = model
+        self.devices: Dict[str, VirtualDevice] = {}
+        self._lock   = threading.Lock()
+        self._stop   = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def add(self, device: VirtualDevice) -> None:
+        self.devices[device.name] = device
+
+    def read(self, name: str) -> Dict[int, int]:
+        with self._lock:
+            self.model.step()
+            return self.model.powmr_registers() if name == "powmr" else self.model.growatt_registers()
+
+    def write(self, name: str, values: Dict[int, int]) -> int:
+        """Apply a write; return 0 or a Modbus exception code. All-or-nothing."""
+        device = self.devices[name]
+        for addr, value in values.items():
+            if addr not in device.writable:
+                return EXC_ILLEGAL_ADDRESS
+            if value not in _CONFIG_VALID[addr]:
+                return EXC_ILLEGAL_VALUE
+        with self._lock:
+            self.model.step()
+            self.model.config.update(values)
+        log.info("%s: wrote %s", name, ", ".join(f"0x{a:04X}={v}" for a, v in values.items()))
+        return 0
+
+    def start(self) -> None:
+        for dev in self.devices.values():
+            t = threading.Thread(target=dev.serve, args=(self._stop,), name=f"sim-{dev.name}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self) -> None:
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=1.0)
+        for dev in self.devices.values():
+            dev.close()
+
+    def status(self) -> str:
+        with self._lock:
+            self.model.step()
+            line = self.model.summary()
+        counts = "  ".join(f"{n}: " + " ".join(f"{k}={v}" for k, v in d.counts.items() if v)
+                           for n, d in self.devices.items())
+        return f"{line}  |  {counts}"
+
+
+def build(
+    link_dir: str, baud: Optional[int] = None, turnaround_ms: Optional[float] = None,
+    faults: Optional[FaultConfig] = None, speed: float = 1.0, seed: Optional[int] = None,
+    soc: float = 60.0, devices: Iterable[str] = ("powmr", "growatt"),
+) -> Simulator:
+    """Create the model and virtual ports under *link_dir* (not yet serving)."""
+    os.makedirs(link_dir, exist_ok=True)
+    profiles = load_profiles()
+    sim = Simulator(PlantModel(speed=speed, seed=seed, soc=soc))
+    for name in devices:
+        profile = profiles[name]
+        sim.add(VirtualDevice(
+            name, profile, sim, os.path.join(link_dir, name),
+            baud=baud or profile.baud,
+            turnaround_ms=profile.turnaround_ms if turnaround_ms is None else turnaround_ms,
+            faults=faults or FaultConfig(), seed=seed,
+        ))
+    return sim
+
+
+# ── Main ──────────────────────────────────────────────────────────────────────
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Simulate the PowMr and Growatt inverters on virtual serial ports.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument("--link-dir", default="/tmp/modbus-sim",
+                        help="Directory for the port symlinks (default /tmp/modbus-sim).")
+    parser.add_argument("--device", action="append", choices=("powmr", "growatt"),
+                        help="Simulate only this device (repeatable; default both).")
+    parser.add_argument("--baud", type=int, default=None,
+                        help="Simulated line speed (default: each profile's baud).")
+    parser.add_argument("--turnaround-ms", type=float, default=None,
+                        help="Device response latency (default: each profile's turnaround_ms).")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Model clock multiplier (default 1 = real time).")
+    parser.add_argument("--soc", type=float, default=60.0, help="Initial battery SoC %% (default 60).")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for a reproducible run.")
+    parser.add_argument("--fault-illegal", type=float, default=0.0, metavar="P")
+    parser.add_argument("--fault-timeout", type=float, default=0.0, metavar="P")
+    parser.add_argument("--fault-garbage", type=float, default=0.0, metavar="P")
+    parser.add_argument("--no-fc16", action="store_true", help="Reject FC 0x10 with IllegalFunction.")
+    parser.add_argument("--status-s", type=float, default=30.0,
+                        help="Log a model summary this often (0 = never).")
+    args = parser.parse_args()
+
+    faults = FaultConfig(illegal=args.fault_illegal, timeout=args.fault_timeout,
+                         garbage=args.fault_garbage, fc16=not args.no_fc16)
+    sim = build(args.link_dir, baud=args.baud, turnaround_ms=args.turnaround_ms, faults=faults,
+                speed=args.speed, seed=args.seed, soc=args.soc,
+                devices=args.device or ("powmr", "growatt"))
+    sim.start()
+
+    for name, dev in sim.devices.items():
+        print(f"MODBUS_{name.upper()}_PORT={dev.link}", flush=True)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        while not stop.wait(args.status_s or None):
+            log.info("%s", sim.status())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
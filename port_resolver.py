@@ -0,0 +1,108 @@
+"""USB-serial port resolution with a cached adapter scan.
+
+``serial.tools.list_ports.comports()`` walks sysfs for every tty on the
+host — tens of milliseconds on a Pi with a few USB devices — and
+modbus_api used to call it at startup and again on every client rebuild,
+inside the device's bus slot, while the bus is already in trouble.
+
+``PortResolver`` keeps the last scan and reuses it until the device tree
+changes: each lookup stats ``/dev`` and ``/dev/serial/by-id`` (udev adds
+and removes nodes there on every hot-plug, which bumps the directories'
+mtime) and only rescans when either stamp moved or the cached node is gone.
+A rebuild therefore costs two stat() calls plus the port open.
+
+Adapters found by VID/PID are reported by their ``/dev/serial/by-id``
+alias when udev created one, so a per_request reconnect follows the adapter
+if it re-enumerates as a different ttyUSBn.  Explicit paths — including
+``/dev/serial/by-id/...`` symlinks — are used as given.
+
+Log levels
+----------
+  DEBUG  — every rescan, with its duration
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import serial.tools.list_ports
+
+from log_config import get_logger
+
+log = get_logger("modbus_api.ports")
+
+DEV_DIR   = "/dev"
+BY_ID_DIR = "/dev/serial/by-id"
+
+_Stamp = Tuple[int, int]
+
+
+def _mtime_ns(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+class PortResolver:
+    """Cached comports() scan, invalidated when /dev changes.
+
+    Lookups come from several bus threads at once (one per device), so the
+    cache is guarded by a lock; a rescan happens at most once per change.
+    """
+
+    def __init__(self, dev_dir: str = DEV_DIR, by_id_dir: str = BY_ID_DIR) -> None:
+        self.dev_dir   = dev_dir
+        self.by_id_dir = by_id_dir
+        self.scans     = 0
+        self.hits      = 0
+        self.scan_s    = 0.0   # duration of the last scan
+        self._lock     = threading.Lock()
+        self._stamp: Optional[_Stamp] = None
+        self._ports: List[Any] = []
+        self._by_id: Dict[str, str] = {}   # real device node → by-id symlink
+
+    def _stamp_now(self) -> _Stamp:
+        return _mtime_ns(self.dev_dir), _mtime_ns(self.by_id_dir)
+
+    def _scan(self, stamp: _Stamp) -> None:
+        started = time.perf_counter()
+        ports = list(serial.tools.list_ports.comports())
+        by_id: Dict[str, str] = {}
+        try:
+            for name in sorted(os.listdir(self.by_id_dir)):
+                link = os.path.join(self.by_id_dir, name)
+                by_id.setdefault(os.path.realpath(link), link)
+        except OSError:
+            pass
+        self._ports, self._by_id, self._stamp = ports, by_id, stamp
+        self.scans += 1
+        self.scan_s = time.perf_counter() - started
+        log.debug("Serial port scan #%d: %d port(s), %d by-id alias(es) in %.1f ms",
+                  self.scans, len(ports), len(by_id), self.scan_s * 1000)
+
+    def find(self, adapter: Any) -> Optional[str]:
+        """Path of the first port *adapter* (a device_registry.AdapterMatch) matches."""
+        with self._lock:
+            stamp = self._stamp_now()
+            if stamp != self._stamp:
+                self._scan(stamp)
+            else:
+                self.hits += 1
+            node = next((p.device for p in self._ports if adapter.matches(p)), None)
+            if node is not None and not os.path.exists(node):
+                # Unplugged without the stamps moving (coarse mtime) — rescan once.
+                self._scan(stamp)
+                node = next((p.device for p in self._ports if adapter.matches(p)), None)
+            if node is None:
+                return None
+            return self._by_id.get(os.path.realpath(node), node)
+
+    def stats_dict(self) -> Dict[str, Any]:
+        return {
+            "scans":        self.scans,
+            "cache_hits":   self.hits,
+            "last_scan_ms": round(self.scan_s * 1000, 1),
+        }
@@ -0,0 +1,138 @@
+"""Compiled range validation for raw register reads.
+
+modbus_api rejects a read when any register decodes outside its known band —
+the tell-tale of stale framer bytes decoding as a structurally valid
+response with garbage values.  The bands live in regmap.yaml next to each
+register's scale and signedness (``min`` / ``max``, in real units).
+
+``RangeTable`` compiles them once at import into address-indexed tables in
+the *raw* domain: each real-unit bound is divided by the scale and rounded
+inwards to an integer, so a check is an integer comparison on the register
+value — no float multiply, no key parsing.  Single registers and 32-bit
+pairs ("3-4": hi << 16 | lo) are separate tables.  ``violations`` makes one
+pass over the table and returns every offender, so a bad read is reported
+in full rather than stopping at the first register.
+
+``range_signed: true`` interprets a register as signed for the range check
+only, for entries db_writer deliberately stores unsigned (e.g. grid power).
+
+Log levels
+----------
+  (none — callers log the violations they act on)
+"""
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Tuple
+
+# Bounds within this many raw counts of an integer are snapped to it, so
+# float noise in lo / scale (45 / 0.1 = 450.00000000000006) can't shift a
+# bound by one count.
+_SNAP = 1e-6
+
+
+def _raw_bound(real: float, scale: float, lower: bool) -> int:
+    q = real / scale
+    r = round(q)
+    if abs(q - r) < _SNAP:
+        return int(r)
+    return math.ceil(q) if lower else math.floor(q)
+
+
+@dataclass(frozen=True)
+class Violation:
+    key:   str
+    real:  float
+    raw:   str
+    lo:    float
+    hi:    float
+
+    def __str__(self) -> str:
+        return f"{self.key}={self.real:.3f} (raw={self.raw}); expected {self.lo}..{self.hi}"
+
+
+class RangeViolation(RuntimeError):
+    """One or more registers in a read fell outside their bands."""
+
+    def __init__(self, device: str, violations: List[Violation]) -> None:
+        self.device     = device
+        self.violations = violations
+        super().__init__(
+            f"{device} value(s) out of range: " + "; ".join(str(v) for v in violations)
+        )
+
+
+class RangeTable:
+    """Raw-domain range table for one device's registers."""
+
+    def __init__(self, device: str) -> None:
+        self.device = device
+        # (addr, lo_raw, hi_raw, signed, key, scale, lo, hi)
+        self.single: Tuple[Tuple[int, int, int, bool, str, float, float, float], ...] = ()
+        # (hi_addr, lo_addr, lo_raw, hi_raw, signed, key, scale, lo, hi)
+        self.pairs:  Tuple[Tuple[int, int, int, int, bool, str, float, float, float], ...] = ()
+
+    @classmethod
+    def from_regmap(
+        cls, device: str, regmap: Mapping[str, Mapping[str, Any]], key_format: str,
+    ) -> "RangeTable":
+        """Compile every regmap entry of *key_format* ("hex" | "dec") that has min/max."""
+        base = 16 if key_format == "hex" else 10
+        single, pairs = [], []
+        for key, meta in regmap.items():
+            if key.startswith("0x") != (key_format == "hex"):
+                continue
+            if not isinstance(meta, Mapping) or "min" not in meta or "max" not in meta:
+                continue
+            scale  = float(meta.get("scale", 1.0))
+            signed = bool(meta.get("signed") or meta.get("range_signed"))
+            lo, hi = meta["min"], meta["max"]
+            lo_raw = _raw_bound(lo, scale, lower=True)
+            hi_raw = _raw_bound(hi, scale, lower=False)
+            if "-" in key:
+                left, right = key.split("-", 1)
+                pairs.append((int(left, base), int(right, base), lo_raw, hi_raw, signed,
+                              key, scale, lo, hi))
+            else:
+                single.append((int(key, base), lo_raw, hi_raw, signed, key, scale, lo, hi))
+        table = cls(device)
+        table.single = tuple(sorted(single))
+        table.pairs  = tuple(sorted(pairs))
+        return table
+
+    def __len__(self) -> int:
+        return len(self.single) + len(self.pairs)
+
+    def violations(self, raw: Mapping[int, int]) -> List[Violation]:
+        """Every register in *raw* outside its band (registers absent from *raw* are skipped)."""
+        out: List[Violation] = []
+        get = raw.get
+        for addr, lo_raw, hi_raw, signed, key, scale, lo, hi in self.single:
+            v = get(addr)
+            if v is None:
+                continue
+            if signed and v >= 0x8000:
+                v -= 0x10000
+            if not lo_raw <= v <= hi_raw:
+                out.append(Violation(key, v * scale, str(raw[addr]), lo, hi))
+        for hi_addr, lo_addr, lo_raw, hi_raw, signed, key, scale, lo, hi in self.pairs:
+            h, l = get(hi_addr), get(lo_addr)
+            if h is None or l is None:
+                continue
+            v = ((h & 0xFFFF) << 16) | (l & 0xFFFF)
+            if signed and v >= 0x80000000:
+                v -= 0x100000000
+            if not lo_raw <= v <= hi_raw:
+                out.append(Violation(key, v * scale, f"{h},{l}", lo, hi))
+        return out
+
+    def check(self, raw: Mapping[int, int]) -> None:
+        """Raise RangeViolation listing every out-of-band register in *raw*."""
+        bad = self.violations(raw)
+        if bad:
+            raise RangeViolation(self.device, bad)
+
+    def as_dict(self) -> Dict[str, Tuple[int, int]]:
+        """Compiled raw bounds by regmap key — for inspection and the benchmark."""
+        return {e[4]: (e[1], e[2]) for e in self.single} | {e[5]: (e[2], e[3]) for e in self.pairs}
@@ -0,0 +1,261 @@
+"""Block-read planner: regmap.yaml + device_profiles.yaml → Modbus block reads.
+
+modbus_api used to carry hand-maintained block lists next to regmap.yaml;
+adding a register meant editing both and re-deriving the safe ranges.  This
+module computes them instead:
+
+  * the wanted addresses per device come from regmap.yaml (hex keys are the
+    PowMr holding map, decimal keys the Growatt input map; "a-b" pair keys
+    contribute both halves) plus the profile's ``raw_range``;
+  * ``fast: true`` entries form the fast-poll subset used by the controller;
+  * ``plan_blocks`` finds the cheapest set of contiguous reads covering them.
+
+Cost model (Modbus RTU, 8N1 → 10 bits per character):
+
+  request  = 8 bytes                     (addr, fc, start, count, crc)
+  response = 5 + 2·n bytes               (addr, fc, byte count, data, crc)
+  framing  = 2 × 3.5 characters of line silence
+  device   = turnaround_ms               (response latency + host overhead)
+
+so each extra request costs ``(8 + 5 + 7)·t_char + turnaround`` — about
+40 ms at 9600 baud — while each register read across a gap costs only
+``2·t_char`` (~2 ms).  The planner merges across a gap whenever that is
+cheaper, never across an illegal address and never beyond ``max_block``,
+and is exact (dynamic programming over the sorted addresses).
+
+Run directly to print the current plan:
+
+    python register_plan.py
+"""
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Iterable, List, Sequence, Tuple
+
+import yaml
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+REGMAP_PATH   = os.path.join(_HERE, "regmap.yaml")
+PROFILES_PATH = os.path.join(_HERE, "device_profiles.yaml")
+
+BITS_PER_CHAR:       int = 10   # 8N1
+REQUEST_BYTES:       int = 8
+RESPONSE_BASE_BYTES: int = 5
+SILENCE_CHARS:     float = 7.0  # 3.5 chars before the request + 3.5 before the response
+MODBUS_MAX_READ:     int = 125  # protocol limit for FC 0x03 / 0x04
+
+Block = Tuple[int, int]   # (start address, register count)
+
+
+# ── Profiles ──────────────────────────────────────────────────────────────────
+
+
+@dataclass(frozen=True)
+class DeviceProfile:
+    name:          str
+    function:      str                 # "holding" | "input"
+    key_format:    str                 # "hex" | "dec"
+    baud:          int
+    turnaround_ms: float
+    max_block:     int
+    illegal:       FrozenSet[int]
+    raw_range:     Tuple[int, ...]
+
+    @property
+    def char_s(self) -> float:
+        return BITS_PER_CHAR / float(self.baud)
+
+    @property
+    def request_overhead_s(self) -> float:
+        """Fixed wire + device cost of one read request, excluding data."""
+        chars = REQUEST_BYTES + RESPONSE_BASE_BYTES + SILENCE_CHARS
+        return chars * self.char_s + self.turnaround_ms / 1000.0
+
+    @property
+    def per_register_s(self) -> float:
+        return 2 * self.char_s
+
+    def block_cost_s(self, count: int) -> float:
+        return self.request_overhead_s + count * self.per_register_s
+
+
+def _parse_addr_ranges(items: Iterable[Any]) -> FrozenSet[int]:
+    """Expand ["0x0103-0x0106", 17, "20-22"] into a set of addresses."""
+    out: set[int] = set()
+    for item in items or ():
+        if isinstance(item, int):
+            out.add(item)
+            continue
+        text = str(item).strip()
+        if "-" in text:
+            lo, hi = (int(x, 0) for x in text.split("-", 1))
+            out.update(range(lo, hi + 1))
+        else:
+            out.add(int(text, 0))
+    return frozenset(out)
+
+
+def load_profiles(path: str = PROFILES_PATH) -> Dict[str, DeviceProfile]:
+    with open(path, encoding="utf-8") as f:
+        raw = yaml.safe_load(f) or {}
+    profiles: Dict[str, DeviceProfile] = {}
+    for name, p in raw.items():
+        raw_range: Tuple[int, ...] = ()
+        if p.get("raw_range"):
+            lo, hi = p["raw_range"]
+            raw_range = tuple(range(int(lo), int(hi) + 1))
+        profiles[name] = DeviceProfile(
+            name=name,
+            function=str(p.get("function", "holding")),
+            key_format=str(p.get("key_format", "hex")),
+            baud=int(p.get("baud", 9600)),
+            turnaround_ms=float(p.get("turnaround_ms", 20)),
+            max_block=min(int(p.get("max_block", MODBUS_MAX_READ)), MODBUS_MAX_READ),
+            illegal=_parse_addr_ranges(p.get("illegal")),
+            raw_range=raw_range,
+        )
+    return profiles
+
+
+# ── regmap.yaml → wanted addresses ────────────────────────────────────────────
+
+
+def key_addresses(key: str) -> Tuple[int, ...]:
+    """Register addresses behind a regmap key: "0x0101" → (257,), "3-4" → (3, 4)."""
+    base = 16 if key.startswith("0x") else 10
+    if "-" in key:
+        left, right = key.split("-", 1)
+        return int(left, base), int(right, base)
+    return (int(key, base),)
+
+
+def key_format_of(key: str) -> str:
+    return "hex" if key.startswith("0x") else "dec"
+
+
+def load_regmap(path: str = REGMAP_PATH) -> Dict[str, Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+# ── Planner ───────────────────────────────────────────────────────────────────
+
+
+def plan_blocks(addrs: Iterable[int], profile: DeviceProfile) -> Tuple[Block, ...]:
+    """Cheapest set of contiguous reads covering *addrs* under *profile*.
+
+    dp[j] = cheapest cover of the first j addresses; a block may cover
+    addrs[i..j-1] iff the span fits max_block and contains no illegal
+    address. O(n²) over the wanted addresses — a few dozen per device.
+    """
+    wanted = sorted(set(addrs))
+    bad = [a for a in wanted if a in profile.illegal]
+    if bad:
+        raise ValueError(
+            f"{profile.name}: wanted address(es) are marked illegal: "
+            + ", ".join(f"0x{a:04x}" for a in bad)
+        )
+    n = len(wanted)
+    if n == 0:
+        return ()
+
+    inf = float("inf")
+    dp: List[float] = [0.0] + [inf] * n
+    cut: List[int] = [0] * (n + 1)
+    for j in range(1, n + 1):
+        end = wanted[j - 1]
+        for i in range(j, 0, -1):
+            start = wanted[i - 1]
+            span = end - start + 1
+            if span > profile.max_block:
+                break
+            if i < j and any(a in profile.illegal for a in range(start, wanted[i])):
+                # The gap just added to the left holds an illegal address;
+                # every wider block contains it too.
+                break
+            cost = dp[i - 1] + profile.block_cost_s(span)
+            if cost < dp[j]:
+                dp[j], cut[j] = cost, i
+
+    blocks: List[Block] = []
+    j = n
+    while j > 0:
+        i = cut[j]
+        blocks.append((wanted[i - 1], wanted[j - 1] - wanted[i - 1] + 1))
+        j = i - 1
+    return tuple(reversed(blocks))
+
+
+def estimate_seconds(blocks: Sequence[Block], profile: DeviceProfile) -> float:
+    """Modelled wire time for one pass over *blocks*."""
+    return sum(profile.block_cost_s(count) for _, count in blocks)
+
+
+# ── Per-device plan ───────────────────────────────────────────────────────────
+
+
+@dataclass(frozen=True)
+class DevicePlan:
+    profile:     DeviceProfile
+    required:    Tuple[int, ...]   # addresses behind regmap entries
+    exposed:     Tuple[int, ...]   # required ∪ raw_range — what /registers returns
+    blocks:      Tuple[Block, ...]
+    fast_addrs:  Tuple[int, ...]   # `fast: true` entries
+    fast_blocks: Tuple[Block, ...]
+
+    @property
+    def cycle_s(self) -> float:
+        return estimate_seconds(self.blocks, self.profile)
+
+
+def build_plans(
+    regmap: Dict[str, Dict[str, Any]],
+    profiles: Dict[str, DeviceProfile],
+) -> Dict[str, DevicePlan]:
+    plans: Dict[str, DevicePlan] = {}
+    for name, profile in profiles.items():
+        required: set[int] = set()
+        fast: set[int] = set()
+        for key, meta in regmap.items():
+            if key_format_of(key) != profile.key_format:
+                continue
+            addrs = key_addresses(key)
+            required.update(addrs)
+            if isinstance(meta, dict) and meta.get("fast"):
+                fast.update(addrs)
+        exposed = required | set(profile.raw_range)
+        plans[name] = DevicePlan(
+            profile=profile,
+            required=tuple(sorted(required)),
+            exposed=tuple(sorted(exposed)),
+            blocks=plan_blocks(exposed, profile),
+            fast_addrs=tuple(sorted(fast)),
+            fast_blocks=plan_blocks(fast, profile),
+        )
+    return plans
+
+
+def load_plans(
+    regmap_path: str = REGMAP_PATH, profiles_path: str = PROFILES_PATH,
+) -> Dict[str, DevicePlan]:
+    return build_plans(load_regmap(regmap_path), load_profiles(profiles_path))
+
+
+def format_blocks(blocks: Sequence[Block], key_format: str = "hex") -> str:
+    if key_format == "hex":
+        return ", ".join(f"0x{s:04X}/{n}" for s, n in blocks)
+    return ", ".join(f"{s}/{n}" for s, n in blocks)
+
+
+if __name__ == "__main__":
+    for _name, _plan in load_plans().items():
+        _p = _plan.profile
+        print(f"{_name}: {len(_plan.required)} regmap registers, {len(_plan.exposed)} exposed, "
+              f"{_p.function} @ {_p.baud} baud")
+        print(f"  blocks ({len(_plan.blocks)}, ~{_plan.cycle_s * 1000:.0f} ms): "
+              f"{format_blocks(_plan.blocks, _p.key_format)}")
+        if _plan.fast_blocks:
+            print(f"  fast   ({len(_plan.fast_blocks)}, "
+                  f"~{estimate_seconds(_plan.fast_blocks, _p) * 1000:.0f} ms): "
+                  f"{format_blocks(_plan.fast_blocks, _p.key_format)}")
@@ -0,0 +1,223 @@
+"""In-memory register snapshot store for modbus_api.
+
+The background poller in modbus_api owns both serial buses and publishes
+every successful (already range-validated) read here.  HTTP endpoints then
+answer from the latest snapshot instead of starting their own serial
+transaction, so bus load stays fixed no matter how many readers there are.
+
+A snapshot is immutable: each publish builds a new ``RegisterSnapshot`` with
+the next sequence number, so readers can hold on to one without locking.
+
+Streaming readers (``/stream``) ``subscribe()`` instead of polling.  A
+``Subscription`` is a one-slot mailbox: publish overwrites the slot and wakes
+the reader, so a slow consumer skips intermediate snapshots rather than
+queueing them — each snapshot is a full image, so nothing is lost but
+history, and a stalled client can never grow the server's memory.
+
+The store keeps a ring of the last ``history`` snapshots so a poller can ask
+for what changed since the snapshot it saw last (``/registers?since=N``).
+``epoch`` is random per process: sequence numbers restart at 1 with
+modbus_api, and a client's N from before a restart must not be mistaken
+for the new process's N.  A device that was not re-read shares its image
+object with the previous snapshot, so ``changes_since`` skips it without
+comparing values.
+
+Freshness is tracked per *region* — a named slice of the register image
+refreshed by one kind of read (e.g. "powmr.fast" for the five control
+registers, "powmr.full" for every PowMr block).  A read that covers several
+regions stamps all of them.
+
+``ConfigCache`` is the write-through cache for configuration holding
+registers (output/charging priority, charge current): the last value the
+device confirmed, either by a successful write or by a read.
+
+Log levels
+----------
+  DEBUG  — every publish (seq, device, regions, register count),
+           subscribe/unsubscribe
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from log_config import get_logger
+
+log = get_logger("modbus_api.store")
+
+
+@dataclass(frozen=True)
+class RegisterSnapshot:
+    """One published state of the register image."""
+    seq:      int
+    ts:       float                              # wall-clock epoch of this publish
+    values:   Mapping[str, Mapping[int, int]]    # device → address → raw uint16
+    fresh_at: Mapping[str, float] = field(default_factory=dict)  # region → monotonic read time
+
+    def age(self, region: str, now: Optional[float] = None) -> float:
+        """Seconds since *region* was last read; ``inf`` if it never was."""
+        at = self.fresh_at.get(region)
+        if at is None:
+            return math.inf
+        return (time.monotonic() if now is None else now) - at
+
+    def device(self, name: str) -> Mapping[int, int]:
+        return self.values.get(name, {})
+
+    def changes_since(self, old: "RegisterSnapshot", name: str) -> Dict[int, int]:
+        """*name*'s registers whose value differs from (or is absent in) *old*."""
+        new, prev = self.device(name), old.device(name)
+        if new is prev:
+            return {}
+        return {a: v for a, v in new.items() if prev.get(a) != v}
+
+
+class Subscription:
+    """Latest-value mailbox for one streaming reader."""
+
+    def __init__(self) -> None:
+        self.latest: Optional[RegisterSnapshot] = None
+        self.skipped = 0    # snapshots overwritten before the reader took them
+        self._event  = asyncio.Event()
+
+    def offer(self, snap: RegisterSnapshot) -> None:
+        if self._event.is_set():
+            self.skipped += 1
+        self.latest = snap
+        self._event.set()
+
+    async def next(self, timeout: Optional[float] = None) -> Optional[RegisterSnapshot]:
+        """Wait for a snapshot newer than the last one taken; None on timeout."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._event.clear()
+        return self.latest
+
+
+class SnapshotStore:
+    """Holds the latest RegisterSnapshot; publish() swaps in a new one.
+
+    The last *history* snapshots stay reachable through ``get(seq)``.
+    Only ever touched from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, history: int = 128) -> None:
+        self._current: Optional[RegisterSnapshot] = None
+        self._seq = 0
+        self._subscribers: List[Subscription] = []
+        self._history: Deque[RegisterSnapshot] = deque(maxlen=max(1, history))
+        self.epoch = uuid.uuid4().hex[:8]
+
+    @property
+    def current(self) -> Optional[RegisterSnapshot]:
+        return self._current
+
+    def age(self, region: str) -> float:
+        snap = self._current
+        return math.inf if snap is None else snap.age(region)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def get(self, seq: int) -> Optional[RegisterSnapshot]:
+        """Snapshot *seq* if it is still in the ring, else None."""
+        if not self._history:
+            return None
+        index = seq - self._history[0].seq   # the ring holds consecutive seqs
+        if 0 <= index < len(self._history):
+            return self._history[index]
+        return None
+
+    @property
+    def oldest_seq(self) -> int:
+        return self._history[0].seq if self._history else 0
+
+    def subscribe(self) -> Subscription:
+        """Register a streaming reader; it is primed with the current snapshot."""
+        sub = Subscription()
+        if self._current is not None:
+            sub.offer(self._current)
+        self._subscribers.append(sub)
+        log.debug("subscriber added (%d total)", len(self._subscribers))
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        if sub in self._subscribers:
+            self._subscribers.remove(sub)
+            log.debug("subscriber removed (%d total, %d skipped)", len(self._subscribers), sub.skipped)
+
+    def publish(
+        self,
+        device: str,
+        raw: Dict[int, int],
+        regions: Iterable[str],
+        read_at: Optional[float] = None,
+    ) -> RegisterSnapshot:
+        """Merge *raw* into *device*'s image and stamp *regions* as fresh.
+
+        *read_at* is the monotonic time the read started (defaults to now) —
+        using the start, not the end, keeps ``age`` conservative.
+        """
+        prev = self._current
+        read_at = time.monotonic() if read_at is None else read_at
+
+        values: Dict[str, Mapping[int, int]] = dict(prev.values) if prev else {}
+        merged = dict(values.get(device, {}))
+        merged.update(raw)
+        values[device] = merged
+
+        fresh_at: Dict[str, float] = dict(prev.fresh_at) if prev else {}
+        regions = tuple(regions)
+        for region in regions:
+            fresh_at[region] = read_at
+
+        self._seq += 1
+        snap = RegisterSnapshot(seq=self._seq, ts=time.time(), values=values, fresh_at=fresh_at)
+        self._current = snap
+        self._history.append(snap)
+        log.debug("snapshot #%d: %s %s (%d regs)", snap.seq, device, ",".join(regions), len(raw))
+        for sub in self._subscribers:
+            sub.offer(snap)
+        return snap
+
+
+class ConfigCache:
+    """Last device-confirmed value of each configuration register.
+
+    A value is *confirmed* when a write of it succeeded or a read returned
+    it; ``get`` only answers while that confirmation is younger than the
+    caller's ``max_age``. Event-loop only, like SnapshotStore.
+    """
+
+    def __init__(self) -> None:
+        self._values: Dict[int, Tuple[int, float]] = {}   # addr → (value, monotonic confirm time)
+
+    def get(self, addr: int, max_age: float = math.inf) -> Optional[int]:
+        entry = self._values.get(addr)
+        if entry is None or time.monotonic() - entry[1] > max_age:
+            return None
+        return entry[0]
+
+    def confirm(self, addr: int, value: int) -> Optional[int]:
+        """Record *value* as confirmed now; return the previous value (if any)."""
+        prev = self._values.get(addr)
+        self._values[addr] = (value, time.monotonic())
+        return None if prev is None else prev[0]
+
+    def invalidate(self, addr: int) -> None:
+        self._values.pop(addr, None)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        now = time.monotonic()
+        return {
+            f"0x{a:04x}": {"value": v, "age_s": round(now - at, 1)}
+            for a, (v, at) in sorted(self._values.items())
+        }
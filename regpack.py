@@ -0,0 +1,328 @@
+"""Compact binary register payloads shared by modbus_api and its clients.
+
+``/registers`` and ``/limited_registers`` return a JSON object of string
+keys ("0x0100", "17") to ints; every consumer re-parses ~134 keys per poll.
+With content negotiation they can instead return one of:
+
+  application/x-modbus-regs   raw little-endian uint16 values behind a
+                              block-layout header (always available)
+  application/x-msgpack       the same layout + values as msgpack (only when
+                              the optional ``msgpack`` package is installed)
+
+Wire layout of application/x-modbus-regs (all little-endian):
+
+  header   4s  magic b"MREG"
+           B   version (1 or 2)
+           x   pad
+           H   number of runs
+  v2 only  B   number of namespaces
+    × m    B   key format: 0 = hex ("0x0100"), 1 = decimal ("17")
+           B   prefix length
+           s   prefix, UTF-8 (e.g. b"growatt2:")
+  run × n  B   namespace index
+           x   pad
+           H   start address
+           H   register count
+  values   H × sum(counts), in run order
+
+A namespace is a (key prefix, key format) pair — one per device in
+/registers.  Version 1 has no namespace table and the two implicit
+namespaces ("", hex) and ("", decimal), i.e. the unprefixed PowMr and
+Growatt keys; a payload that only uses those is still written as version 1,
+so the format only changes once a prefixed device (devices.yaml) exists.
+
+``RegisterImage`` is the decoded form: it keeps the values in one
+``array('H')`` and answers ``image["0x0100"]`` by bisecting the run table,
+so it drops into code written against the JSON dict (``Mapping[str, int]``)
+without materialising a dict.
+
+Log levels
+----------
+  (none — this module never logs)
+"""
+from __future__ import annotations
+
+import bisect
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    import msgpack  # optional — only needed for application/x-msgpack
+except ImportError:   # pragma: no cover - depends on the environment
+    msgpack = None
+
+MEDIA_TYPE         = "application/x-modbus-regs"
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+# What clients send: prefer the binary layout, accept JSON from older servers.
+ACCEPT_HEADER      = f"{MEDIA_TYPE}, application/json;q=0.5"
+
+MAGIC   = b"MREG"
+VERSION = 2      # newest version written; 1 is still written when it suffices
+
+KIND_HEX = 0   # "0x0100" keys — holding-register devices (PowMr)
+KIND_DEC = 1   # "17" keys — input-register devices (Growatt)
+
+_HEADER = struct.Struct("<4sBxH")
+_NS     = struct.Struct("<BB")
+_RUN    = struct.Struct("<BxHH")
+
+Namespace = Tuple[str, int]        # (key prefix, kind)
+Run       = Tuple[int, int, int]   # (namespace index, start, count)
+
+# The implicit namespace table of version 1 payloads.
+LEGACY_NAMESPACES: Tuple[Namespace, ...] = (("", KIND_HEX), ("", KIND_DEC))
+
+
+def _key(ns: Namespace, addr: int) -> str:
+    prefix, kind = ns
+    return f"{prefix}0x{addr:04x}" if kind == KIND_HEX else f"{prefix}{addr}"
+
+
+def _parse_key(key: str) -> Tuple[Namespace, int]:
+    prefix, _, reg = key.rpartition(":")
+    prefix = f"{prefix}:" if prefix else ""
+    if reg.startswith("0x"):
+        return (prefix, KIND_HEX), int(reg, 16)
+    return (prefix, KIND_DEC), int(reg)
+
+
+def runs_for(ns_index: int, addrs: Iterable[int]) -> List[Run]:
+    """Contiguous (namespace index, start, count) runs covering *addrs*."""
+    out: List[Run] = []
+    for a in sorted(set(addrs)):
+        if out and out[-1][1] + out[-1][2] == a and out[-1][2] < 0xFFFF:
+            k, s, n = out[-1]
+            out[-1] = (k, s, n + 1)
+        else:
+            out.append((ns_index, a, 1))
+    return out
+
+
+class RegisterImage(Mapping[str, int]):
+    """Array-backed, read-only register map keyed like the JSON responses."""
+
+    def __init__(
+        self, runs: Sequence[Run], values: array,
+        namespaces: Sequence[Namespace] = LEGACY_NAMESPACES,
+    ) -> None:
+        if sum(n for _, _, n in runs) != len(values):
+            raise ValueError("register image: run counts do not match value count")
+        self.namespaces = tuple((str(p), int(k)) for p, k in namespaces)
+        if any(ns >= len(self.namespaces) for ns, _, _ in runs):
+            raise ValueError("register image: run refers to an undefined namespace")
+        self.runs   = tuple(runs)
+        self.values = values
+        # Per namespace: sorted run starts, with (start, count, offset) alongside.
+        self._index: Dict[Namespace, Tuple[List[int], List[Tuple[int, int, int]]]] = {}
+        offset = 0
+        for ns, start, count in self.runs:
+            starts, spans = self._index.setdefault(self.namespaces[ns], ([], []))
+            pos = bisect.bisect_left(starts, start)
+            starts.insert(pos, start)
+            spans.insert(pos, (start, count, offset))
+            offset += count
+
+    # ── Construction ──────────────────────────────────────────────────────
+
+    @classmethod
+    def from_devices(
+        cls, parts: Sequence[Tuple[str, int, Mapping[int, int]]],
+    ) -> "RegisterImage":
+        """Build from [(prefix, kind, {addr: value}), ...] — a snapshot's device images."""
+        namespaces: List[Namespace] = list(LEGACY_NAMESPACES)
+        runs: List[Run] = []
+        values = array("H")
+        for prefix, kind, regs in parts:
+            ns = (prefix, kind)
+            if ns not in namespaces:
+                namespaces.append(ns)
+            for run in runs_for(namespaces.index(ns), regs):
+                runs.append(run)
+                _, start, count = run
+                values.extend(regs[a] & 0xFFFF for a in range(start, start + count))
+        return cls(runs, values, namespaces)
+
+    @property
+    def version(self) -> int:
+        """Wire version needed: 1 unless a non-legacy namespace is present."""
+        return 1 if self.namespaces == LEGACY_NAMESPACES else 2
+
+    # ── application/x-modbus-regs ─────────────────────────────────────────
+
+    def pack(self) -> bytes:
+        values = self.values
+        if sys.byteorder == "big":
+            values = array("H", values)
+            values.byteswap()
+        version = self.version
+        parts = [_HEADER.pack(MAGIC, version, len(self.runs))]
+        if version >= 2:
+            parts.append(bytes((len(self.namespaces),)))
+            for prefix, kind in self.namespaces:
+                raw = prefix.encode("utf-8")
+                parts.append(_NS.pack(kind, len(raw)) + raw)
+        parts.extend(_RUN.pack(*r) for r in self.runs)
+        parts.append(values.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def unpack(cls, payload: bytes) -> "RegisterImage":
+        if len(payload) < _HEADER.size:
+            raise ValueError("register image: truncated header")
+        magic, version, nruns = _HEADER.unpack_from(payload, 0)
+        if magic != MAGIC or not 1 <= version <= VERSION:
+            raise ValueError(f"register image: bad magic/version {magic!r}/{version}")
+        pos = _HEADER.size
+        namespaces: List[Namespace] = list(LEGACY_NAMESPACES)
+        if version >= 2:
+            try:
+                count = payload[pos]
+                pos += 1
+                namespaces = []
+                for _ in range(count):
+                    kind, length = _NS.unpack_from(payload, pos)
+                    pos += _NS.size
+                    namespaces.append((payload[pos:pos + length].decode("utf-8"), kind))
+                    pos += length
+            except (IndexError, struct.error, UnicodeDecodeError) as e:
+                raise ValueError(f"register image: bad namespace table ({e})") from None
+        if len(payload) < pos + nruns * _RUN.size:
+            raise ValueError("register image: truncated run table")
+        runs = [_RUN.unpack_from(payload, pos + i * _RUN.size) for i in range(nruns)]
+        pos += nruns * _RUN.size
+        values = array("H")
+        values.frombytes(payload[pos:])
+        if sys.byteorder == "big":
+            values.byteswap()
+        return cls(runs, values, namespaces)
+
+    # ── application/x-msgpack ─────────────────────────────────────────────
+
+    def to_msgpack(self) -> bytes:
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed")
+        values = self.values
+        if sys.byteorder == "big":
+            values = array("H", values)
+            values.byteswap()
+        doc = {"v": self.version, "runs": [list(r) for r in self.runs],
+               "values": values.tobytes()}
+        if self.version >= 2:
+            doc["ns"] = [list(ns) for ns in self.namespaces]
+        return msgpack.packb(doc)
+
+    @classmethod
+    def from_msgpack(cls, payload: bytes) -> "RegisterImage":
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed")
+        doc = msgpack.unpackb(payload)
+        values = array("H")
+        values.frombytes(doc["values"])
+        if sys.byteorder == "big":
+            values.byteswap()
+        namespaces = [tuple(ns) for ns in doc.get("ns", LEGACY_NAMESPACES)]
+        return cls([tuple(r) for r in doc["runs"]], values, namespaces)
+
+    # ── Lookup ────────────────────────────────────────────────────────────
+
+    def value(self, ns: Namespace, addr: int) -> Optional[int]:
+        """Value of *addr* in namespace (prefix, kind), or None if absent."""
+        entry = self._index.get(ns)
+        if entry is None:
+            return None
+        starts, spans = entry
+        i = bisect.bisect_right(starts, addr) - 1
+        if i < 0:
+            return None
+        start, count, offset = spans[i]
+        if addr >= start + count:
+            return None
+        return self.values[offset + addr - start]
+
+    def __getitem__(self, key: str) -> int:
+        try:
+            v = self.value(*_parse_key(key))
+        except ValueError:
+            v = None
+        if v is None:
+            raise KeyError(key)
+        return v
+
+    def __iter__(self) -> Iterator[str]:
+        namespaces = self.namespaces
+        for ns, start, count in self.runs:
+            for a in range(start, start + count):
+                yield _key(namespaces[ns], a)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def items(self):  # type: ignore[override]
+        """(key, value) pairs in run order, without a lookup per key."""
+        it = iter(self.values)
+        namespaces = self.namespaces
+        return [(_key(namespaces[ns], a), next(it))
+                for ns, start, count in self.runs for a in range(start, start + count)]
+
+    def to_dict(self) -> Dict[str, int]:
+        return dict(self.items())
+
+
+def decode(content_type: str, payload: bytes) -> Optional[RegisterImage]:
+    """Decode a binary /registers body; None when *content_type* is not binary."""
+    ctype = content_type.split(";", 1)[0].strip().lower()
+    if ctype == MEDIA_TYPE:
+        return RegisterImage.unpack(payload)
+    if ctype == MSGPACK_MEDIA_TYPE:
+        return RegisterImage.from_msgpack(payload)
+    return None
+
+
+def _accept_q(accept: str) -> Dict[str, float]:
+    """Media range → q-value from an Accept header (the highest if repeated)."""
+    qs: Dict[str, float] = {}
+    for entry in accept.lower().split(","):
+        media, *params = (part.strip() for part in entry.split(";"))
+        if not media:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0   # malformed: treat as not acceptable
+        qs[media] = max(q, qs.get(media, 0.0))
+    return qs
+
+
+def negotiate(accept: str) -> Optional[str]:
+    """Pick the binary media type a client asked for, or None for JSON.
+
+    A binary type must be listed explicitly with q > 0 and at least JSON's
+    q, which comes from the most specific range present (application/json,
+    else application/*, else */*, as RFC 7231 has it); ties go to binary,
+    so ACCEPT_HEADER negotiates it.  msgpack only if installed.
+
+    >>> negotiate(ACCEPT_HEADER)
+    'application/x-modbus-regs'
+    >>> negotiate("application/x-modbus-regs;q=0") is None
+    True
+    >>> negotiate("application/json, application/x-modbus-regs;q=0.1") is None
+    True
+    >>> negotiate("application/json;q=0, */*;q=1, application/x-modbus-regs;q=0.5")
+    'application/x-modbus-regs'
+    """
+    qs = _accept_q(accept)
+    json_q = next((qs[media] for media in ("application/json", "application/*", "*/*")
+                   if media in qs), 0.0)
+    best, best_q = None, 0.0
+    candidates = (MEDIA_TYPE, MSGPACK_MEDIA_TYPE) if msgpack is not None else (MEDIA_TYPE,)
+    for media in candidates:
+        q = qs.get(media, 0.0)
+        if q > best_q and q >= json_q:
+            best, best_q = media, q
+    return best
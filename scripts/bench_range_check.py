@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: legacy vs compiled register range validation.
+
+The legacy checker (reproduced below as it was in modbus_api) walked the
+whole _REAL_RANGES dict on every read, re-parsing string keys and
+multiplying floats, and stopped at the first bad register. The compiled
+RangeTable (range_check.py) checks integer raw-domain bounds built once from
+regmap.yaml and reports every bad register.
+
+Runs three things:
+
+  1. per-call timing for a clean PowMr full read, a clean fast read and a
+     clean Growatt read (the normal case — nothing to report);
+  2. the same with one bad register (the legacy path raises early);
+  3. an equivalence fuzz: random raw values near every band edge must be
+     accepted/rejected identically by both, and the legacy's first
+     offender must be in the compiled list.
+
+Usage:
+  python scripts/bench_range_check.py
+  python scripts/bench_range_check.py --number 20000 --fuzz 50000
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from range_check import RangeTable  # noqa: E402
+from register_plan import load_plans, load_regmap  # noqa: E402
+
+# ── Legacy implementation (modbus_api before compiled tables) ────────────────
+
+_REAL_RANGES: Dict[str, Tuple[float, bool, float, float]] = {
+    "0x0100": (1.0,  False,      0,    100),
+    "0x0101": (0.1,  False,     45,     65),
+    "0x0102": (0.1,  True,    -300,    300),
+    "0x0107": (0.1,  False,      0,    600),
+    "0x0108": (0.1,  False,      0,     25),
+    "0x0109": (1.0,  False,      0,   6000),
+    "0x010f": (0.1,  False,      0,    600),
+    "0x0110": (0.1,  False,      0,     25),
+    "0x0111": (1.0,  False,      0,   6000),
+    "0x0213": (0.1,  False,     50,    120),
+    "0x0215": (0.01, False,     55,     65),
+    "0x0216": (0.1,  False,     50,    120),
+    "0x0218": (0.01, False,     55,     65),
+    "0x021b": (1.0,  False,      0,  20000),
+    "0x021c": (1.0,  False,      0,  20000),
+    "0x0220": (0.1,  False,    -20,    120),
+    "0x0221": (0.1,  False,    -20,    120),
+    "0x0222": (0.1,  False,    -20,    120),
+    "0x022a": (0.1,  False,     50,    120),
+    "0x022c": (0.1,  False,     50,    120),
+    "0x0232": (1.0,  False,      0,  20000),
+    "0x0234": (1.0,  False,      0,  20000),
+    "0x023d": (1.0,  True,  -20000,  20000),
+    "0x023e": (1.0,  True,  -20000,  20000),
+    "1":     (0.1,  False,       0,    600),
+    "2":     (0.1,  False,       0,    600),
+    "7":     (0.1,  False,       0,     25),
+    "8":     (0.1,  False,       0,     25),
+    "17":    (0.01, False,      45,     65),
+    "25":    (0.1,  True,      -20,    120),
+    "26":    (0.1,  True,      -20,    120),
+    "32":    (0.1,  True,      -20,    120),
+    "33":    (0.1,  True,      -20,    120),
+    "83":    (0.1,  False,       0,    300),
+    "84":    (0.1,  False,       0,    300),
+    "3-4":   (0.1,  False,       0,   6000),
+    "5-6":   (0.1,  False,       0,   6000),
+}
+
+
+def _real_value(raw: int, scale: float, signed: bool) -> float:
+    if signed and raw >= 0x8000:
+        raw -= 0x10000
+    return raw * scale
+
+
+def _real_value_pair(hi: int, lo: int, scale: float, signed: bool) -> float:
+    combined = ((hi & 0xFFFF) << 16) | (lo & 0xFFFF)
+    if signed and combined >= 0x80000000:
+        combined -= 0x100000000
+    return combined * scale
+
+
+def legacy_powmr(raw: Dict[int, int]) -> Optional[str]:
+    """Return the first offending key (the legacy code raised here), or None."""
+    for key, (scale, signed, lo, hi) in _REAL_RANGES.items():
+        if not key.startswith("0x"):
+            continue
+        addr = int(key, 16)
+        if addr not in raw:
+            continue
+        real = _real_value(raw[addr], scale, signed)
+        if not (lo <= real <= hi):
+            return key
+    return None
+
+
+def legacy_growatt(raw: Dict[int, int]) -> Optional[str]:
+    for key, (scale, signed, lo, hi) in _REAL_RANGES.items():
+        if key.startswith("0x"):
+            continue
+        if "-" in key:
+            left, right = key.split("-", 1)
+            li, ri = int(left), int(right)
+            if li not in raw or ri not in raw:
+                continue
+            real = _real_value_pair(raw[li], raw[ri], scale, signed)
+        else:
+            i = int(key)
+            if i not in raw:
+                continue
+            real = _real_value(raw[i], scale, signed)
+        if not (lo <= real <= hi):
+            return key
+    return None
+
+
+# ── Fixtures ─────────────────────────────────────────────────────────────────
+
+
+def _key_addrs(key: str) -> Tuple[int, ...]:
+    base = 16 if key.startswith("0x") else 10
+    return tuple(int(k, base) for k in key.split("-"))
+
+
+def clean_image(addrs, hex_keys: bool) -> Dict[int, int]:
+    """A raw read with every banded register at the middle of its band."""
+    raw = {a: 0 for a in addrs}
+    for key, (scale, signed, lo, hi) in _REAL_RANGES.items():
+        if key.startswith("0x") != hex_keys:
+            continue
+        mid = int(round((lo + hi) / 2 / scale))
+        parts = _key_addrs(key)
+        if len(parts) == 2:
+            raw[parts[0]], raw[parts[1]] = (mid >> 16) & 0xFFFF, mid & 0xFFFF
+        else:
+            raw[parts[0]] = mid & 0xFFFF
+    return raw
+
+
+def edge_values(scale: float, lo: float, hi: float, wide: bool) -> list:
+    lo_r, hi_r = int(round(lo / scale)), int(round(hi / scale))
+    vals = [lo_r - 1, lo_r, lo_r + 1, hi_r - 1, hi_r, hi_r + 1, 0, 0x7FFF, 0x8000, 0xFFFF]
+    mask = 0xFFFFFFFF if wide else 0xFFFF
+    return [v & mask for v in vals]
+
+
+# ── Main ─────────────────────────────────────────────────────────────────────
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare legacy and compiled range validation.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument("--number", type=int, default=10000, help="Calls per timing (default 10000).")
+    parser.add_argument("--fuzz", type=int, default=20000, help="Random images per device (default 20000).")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    regmap  = load_regmap()
+    plans   = load_plans()
+    powmr   = RangeTable.from_regmap("PowMr",   regmap, "hex")
+    growatt = RangeTable.from_regmap("Growatt", regmap, "dec")
+
+    full_raw    = clean_image(plans["powmr"].exposed, True)
+    fast_raw    = {a: full_raw[a] for a in plans["powmr"].fast_addrs}
+    growatt_raw = clean_image(plans["growatt"].exposed, False)
+    bad_raw     = {**full_raw, 0x0101: 700}   # 70.0 V
+
+    print("=" * 70)
+    print(f"Range-check benchmark  ({args.number} calls each, µs per call)")
+    print(f"  compiled tables: PowMr {len(powmr)} entries, Growatt {len(growatt)} entries")
+    print("=" * 70)
+    cases = [
+        ("PowMr full read, clean", legacy_powmr,   powmr.violations,   full_raw),
+        ("PowMr fast read, clean", legacy_powmr,   powmr.violations,   fast_raw),
+        ("Growatt read, clean",    legacy_growatt, growatt.violations, growatt_raw),
+        ("PowMr full read, 1 bad", legacy_powmr,   powmr.violations,   bad_raw),
+    ]
+    print(f"  {'case':<26} {'legacy':>9} {'compiled':>9} {'speedup':>8}")
+    for label, old, new, raw in cases:
+        t_old = min(timeit.repeat(lambda: old(raw), number=args.number, repeat=3)) / args.number * 1e6
+        t_new = min(timeit.repeat(lambda: new(raw), number=args.number, repeat=3)) / args.number * 1e6
+        print(f"  {label:<26} {t_old:9.2f} {t_new:9.2f} {t_old / t_new:7.1f}x")
+
+    print("\nEquivalence fuzz")
+    rng = random.Random(args.seed)
+    mismatches = 0
+    for hex_keys, old, table, base in ((True, legacy_powmr, powmr, full_raw),
+                                       (False, legacy_growatt, growatt, growatt_raw)):
+        keys = [k for k in _REAL_RANGES if k.startswith("0x") == hex_keys]
+        for _ in range(args.fuzz):
+            raw = dict(base)
+            for key in rng.sample(keys, rng.randint(1, 3)):
+                scale, _, lo, hi = _REAL_RANGES[key]
+                parts = _key_addrs(key)
+                v = rng.choice(edge_values(scale, lo, hi, len(parts) == 2))
+                if len(parts) == 2:
+                    raw[parts[0]], raw[parts[1]] = v >> 16, v & 0xFFFF
+                else:
+                    raw[parts[0]] = v
+            first = old(raw)
+            found = {v.key for v in table.violations(raw)}
+            if (first is None) != (not found) or (first is not None and first not in found):
+                mismatches += 1
+                if mismatches <= 5:
+                    print(f"  MISMATCH legacy={first} compiled={sorted(found)}")
+    print(f"  {2 * args.fuzz} images, {mismatches} mismatch(es)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark: modbus_api on simulated inverters under realistic clients.
+
+Starts modbus_sim.py (virtual PowMr + Growatt ports, wire time at --baud,
+i.e. 10/baud seconds per byte) and modbus_api pointed at it, then drives
+the API for --duration seconds with the clients it sees in production:
+
+  controller  GET /limited_registers every 5 s; every 6th tick a
+              POST /write_batch (charge current, alternating so the
+              config cache doesn't skip it)
+  db_writer   GET /registers every 30 s, binary regpack format
+  burst       every 60 s, --burst-size concurrent form loads, form posts,
+              /raw_read probes and /get_output_priority calls
+
+--time-scale divides every interval (10 → controller every 0.5 s) for a
+short run with more samples.
+
+Reports, and with --out saves as JSON:
+
+  * p50/p95/p99/max latency and error count per endpoint;
+  * bus utilisation per device (transaction time / wall time) and wire
+    time, from the /metrics deltas over the run;
+  * bus-slot wait per operation and per priority class (mean, p95 from
+    the histogram buckets, max from /stats);
+  * CPU seconds, CPU % and peak / final RSS of modbus_api, modbus_sim and
+    the benchmark's own client process (from /proc).
+
+--baseline OLD.json compares against an earlier run and exits 1 if any
+endpoint's p95/p99, any bus utilisation or modbus_api's CPU got worse by
+more than --threshold (relative) and more than the absolute slack, so a
+bus or scheduling change can be judged on numbers.
+
+Usage:
+  python scripts/bench_stack.py --duration 120 --out bench.json
+  python scripts/bench_stack.py --duration 60 --time-scale 10 --baseline bench.json
+  python scripts/bench_stack.py --session-mode persistent --fault-garbage 0.01
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from regpack import ACCEPT_HEADER  # noqa: E402
+from latency_probe import percentile  # noqa: E402  (scripts/ is sys.path[0])
+
+AUTH = ("bench", "bench")
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+# Absolute slack below which a relative regression is treated as noise.
+SLACK_MS   = 5.0
+SLACK_UTIL = 0.02
+SLACK_CPU  = 0.5   # percentage points
+
+# ── Helpers ──────────────────────────────────────────────────────────────────
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Recorder:
+    """Thread-safe per-endpoint latency samples."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def call(self, label: str, fn: Callable[[], requests.Response]) -> Optional[requests.Response]:
+        t0 = time.perf_counter()
+        try:
+            r = fn()
+            r.raise_for_status()
+        except requests.RequestException as e:
+            with self._lock:
+                self.errors[label] = self.errors.get(label, 0) + 1
+                self.samples.setdefault(label, [])
+            print(f"  ! {label}: {e}", file=sys.stderr)
+            return None
+        ms = (time.perf_counter() - t0) * 1000.0
+        with self._lock:
+            self.samples.setdefault(label, []).append(ms)
+        return r
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        with self._lock:
+            for label, vals in sorted(self.samples.items()):
+                vals = sorted(vals)
+                out[label] = {
+                    "n":      len(vals),
+                    "errors": self.errors.get(label, 0),
+                    "p50_ms": round(percentile(vals, 50), 2),
+                    "p95_ms": round(percentile(vals, 95), 2),
+                    "p99_ms": round(percentile(vals, 99), 2),
+                    "max_ms": round(vals[-1], 2) if vals else float("nan"),
+                }
+        return out
+
+
+# ── /proc sampling ───────────────────────────────────────────────────────────
+
+
+def _cpu_ticks(pid: int) -> int:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return int(fields[11]) + int(fields[12])   # utime + stime
+
+
+def _rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+class ProcessMonitor:
+    """Samples CPU time and RSS of named processes once a second."""
+
+    def __init__(self, pids: Dict[str, int]) -> None:
+        self.pids     = pids
+        self.start    = {n: _cpu_ticks(p) for n, p in pids.items()}
+        self.rss_max  = {n: _rss_kb(p) for n, p in pids.items()}
+        self.t0       = time.monotonic()
+        self._stop    = threading.Event()
+        self._thread  = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(1.0):
+            for n, p in self.pids.items():
+                try:
+                    self.rss_max[n] = max(self.rss_max[n], _rss_kb(p))
+                except OSError:
+                    pass
+
+    def finish(self) -> Dict[str, Dict[str, float]]:
+        self._stop.set()
+        self._thread.join()
+        wall = time.monotonic() - self.t0
+        out = {}
+        for n, p in self.pids.items():
+            cpu_s = (_cpu_ticks(p) - self.start[n]) / CLK_TCK
+            out[n] = {
+                "cpu_s":       round(cpu_s, 2),
+                "cpu_pct":     round(100.0 * cpu_s / wall, 2),
+                "rss_max_mb":  round(self.rss_max[n] / 1024.0, 1),
+                "rss_end_mb":  round(_rss_kb(p) / 1024.0, 1),
+            }
+        return out
+
+
+# ── /metrics parsing ─────────────────────────────────────────────────────────
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][\w:]*)(\{[^}]*\})?\s+(\S+)$')
+_LABEL  = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+Series = Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]
+
+
+def scrape(session: requests.Session, base: str) -> Series:
+    out: Series = {}
+    for line in session.get(f"{base}/metrics", timeout=10).text.splitlines():
+        m = _SAMPLE.match(line)
+        if not m:
+            continue
+        labels = tuple(sorted(_LABEL.findall(m.group(2) or "")))
+        out[(m.group(1), labels)] = float(m.group(3))
+    return out
+
+
+def delta(before: Series, after: Series, name: str) -> Dict[Tuple[Tuple[str, str], ...], float]:
+    return {lbl: v - before.get((n, lbl), 0.0) for (n, lbl), v in after.items() if n == name}
+
+
+def histogram_summary(
+    before: Series, after: Series, name: str, group: str,
+) -> Dict[str, Dict[str, float]]:
+    """Per value of label *group*: count, mean and bucket-resolution p95 (ms)."""
+    counts = delta(before, after, f"{name}_count")
+    sums   = delta(before, after, f"{name}_sum")
+    buckets = delta(before, after, f"{name}_bucket")
+    out: Dict[str, Dict[str, float]] = {}
+    for lbl, n in counts.items():
+        if n <= 0:
+            continue
+        key = dict(lbl)[group]
+        bounds = sorted(
+            (float(dict(b)["le"]), c) for b, c in buckets.items()
+            if {k: v for k, v in b if k != "le"} == dict(lbl)
+        )
+        p95 = next((le for le, c in bounds if c >= 0.95 * n), float("inf"))
+        out[key] = {
+            "n":       int(n),
+            "mean_ms": round(1000.0 * sums.get(lbl, 0.0) / n, 2),
+            "p95_le_ms": round(1000.0 * p95, 1) if p95 != float("inf") else None,
+        }
+    return out
+
+
+# ── Clients ──────────────────────────────────────────────────────────────────
+
+
+def periodic(stop: threading.Event, interval: float, fn: Callable[[int], None]) -> None:
+    """Call fn(tick) every *interval* seconds on a drift-free schedule."""
+    tick, next_at = 0, time.monotonic()
+    while not stop.is_set():
+        fn(tick)
+        tick += 1
+        next_at += interval
+        stop.wait(max(0.0, next_at - time.monotonic()))
+
+
+def run_clients(base: str, rec: Recorder, stop: threading.Event, args) -> List[threading.Thread]:
+    scale = args.time_scale
+
+    def controller(tick: int, s=requests.Session()) -> None:
+        rec.call("GET /limited_registers", lambda: s.get(f"{base}/limited_registers", timeout=10,
+                                                         headers={"Accept": ACCEPT_HEADER}))
+        if tick % 6 == 5:
+            amps = 300 if tick % 12 == 5 else 350   # 30 / 35 A, ×0.1 A register units
+            rec.call("POST /write_batch", lambda: s.post(
+                f"{base}/write_batch", auth=AUTH, timeout=10,
+                json={"writes": [{"register": "0xE205", "value": amps}]},
+            ))
+
+    def db_writer(tick: int, s=requests.Session()) -> None:
+        rec.call("GET /registers", lambda: s.get(f"{base}/registers", timeout=15,
+                                                 headers={"Accept": ACCEPT_HEADER}))
+
+    rng = random.Random(args.seed)
+    burst_calls: List[Tuple[str, Callable[[requests.Session], requests.Response]]] = [
+        ("GET /set_targets_form", lambda s: s.get(f"{base}/set_targets_form", auth=AUTH, timeout=10)),
+        ("POST /set_targets", lambda s: s.post(
+            f"{base}/set_targets", auth=AUTH, timeout=10,
+            data={"target_soc": 80, "daily_charge_current": 0, "override_state": "auto"},
+        )),
+        ("GET /raw_read", lambda s: s.get(f"{base}/raw_read", timeout=10,
+                                          params={"addr": rng.choice(("0x0100", "0x0213", "0xf02d")),
+                                                  "count": 3})),
+        ("GET /get_output_priority", lambda s: s.get(f"{base}/get_output_priority", timeout=10)),
+    ]
+
+    def burst(tick: int) -> None:
+        if tick == 0:
+            return   # first burst one interval in, once the pollers are running
+        workers = []
+        for i in range(args.burst_size):
+            label, fn = burst_calls[i % len(burst_calls)]
+            t = threading.Thread(target=lambda l=label, f=fn: rec.call(l, lambda: f(requests.Session())))
+            t.start()
+            workers.append(t)
+        for t in workers:
+            t.join()
+
+    threads = []
+    for fn, interval in ((controller, 5.0), (db_writer, 30.0), (burst, 60.0)):
+        t = threading.Thread(target=periodic, args=(stop, interval / scale, fn), daemon=True)
+        t.start()
+        threads.append(t)
+    return threads
+
+
+# ── Stack ────────────────────────────────────────────────────────────────────
+
+
+def start_stack(args, workdir: Path) -> Tuple[subprocess.Popen, subprocess.Popen, str]:
+    links = workdir / "ports"
+    sim_cmd = [sys.executable, str(PROJECT_ROOT / "modbus_sim.py"), "--link-dir", str(links),
+               "--baud", str(args.baud), "--status-s", "0", "--seed", str(args.seed),
+               "--fault-garbage", str(args.fault_garbage), "--fault-timeout", str(args.fault_timeout)]
+    env = dict(os.environ, LOG_LEVEL="WARNING")
+    sim = subprocess.Popen(sim_cmd, cwd=PROJECT_ROOT, env=env,
+                           stdout=subprocess.DEVNULL, stderr=open(workdir / "sim.log", "w"))
+    deadline = time.monotonic() + 10
+    while not all((links / d).exists() for d in ("powmr", "growatt")):
+        if time.monotonic() > deadline or sim.poll() is not None:
+            raise RuntimeError(f"modbus_sim did not start — see {workdir / 'sim.log'}")
+        time.sleep(0.1)
+
+    targets = workdir / "targets.json"
+    targets.write_text("{}")
+    port = free_port()
+    env.update(
+        MODBUS_POWMR_PORT=str(links / "powmr"),
+        MODBUS_GROWATT_PORT=str(links / "growatt"),
+        MODBUS_SESSION_MODE=args.session_mode,
+        MODBUS_API_PORT=str(port),
+        BASIC_AUTH_USER=AUTH[0],
+        BASIC_AUTH_PASS=AUTH[1],
+        CONFIG_PATH=str(targets),
+    )
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "modbus_api:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=open(workdir / "api.log", "w"),
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            if requests.get(f"{base}/health", timeout=5).ok:
+                return sim, api, base
+        except requests.RequestException:
+            pass
+        if time.monotonic() > deadline or api.poll() is not None:
+            raise RuntimeError(f"modbus_api did not become ready — see {workdir / 'api.log'}")
+        time.sleep(0.3)
+
+
+def stop_stack(*procs: subprocess.Popen) -> None:
+    for p in procs:
+        if p.poll() is None:
+            p.send_signal(signal.SIGTERM)
+    for p in procs:
+        try:
+            p.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+# ── Comparison ───────────────────────────────────────────────────────────────
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float) -> List[str]:
+    """Regressions of *new* against *old*, as printable lines."""
+    out = []
+
+    def check(what: str, a: Optional[float], b: Optional[float], slack: float, unit: str) -> None:
+        if a is None or b is None or a != a or b != b:   # missing or NaN
+            return
+        if b - a > slack and b > a * (1.0 + threshold):
+            out.append(f"{what}: {a:.2f} → {b:.2f} {unit} (+{100.0 * (b - a) / a if a else float('inf'):.0f}%)")
+
+    for ep, row in new["endpoints"].items():
+        base = old.get("endpoints", {}).get(ep)
+        if base:
+            for k in ("p95_ms", "p99_ms"):
+                check(f"{ep} {k}", base.get(k), row.get(k), SLACK_MS, "ms")
+    for dev, row in new["bus"].items():
+        base = old.get("bus", {}).get(dev)
+        if base:
+            check(f"bus {dev} utilisation", base.get("utilisation"), row.get("utilisation"), SLACK_UTIL, "")
+    api_old = old.get("resources", {}).get("modbus_api")
+    if api_old:
+        check("modbus_api cpu_pct", api_old.get("cpu_pct"), new["resources"]["modbus_api"]["cpu_pct"],
+              SLACK_CPU, "%")
+    return out
+
+
+# ── Main ─────────────────────────────────────────────────────────────────────
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark modbus_api end to end against the simulator.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument("--duration", type=float, default=120.0, help="Measured seconds (default 120).")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="Divide every client interval by this (default 1 = production rates).")
+    parser.add_argument("--burst-size", type=int, default=8, help="Concurrent requests per burst (default 8).")
+    parser.add_argument("--baud", type=int, default=9600, help="Simulated line speed (default 9600).")
+    parser.add_argument("--session-mode", choices=("per_request", "persistent"), default="per_request")
+    parser.add_argument("--fault-garbage", type=float, default=0.0, metavar="P")
+    parser.add_argument("--fault-timeout", type=float, default=0.0, metavar="P")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="Write the results JSON here.")
+    parser.add_argument("--baseline", help="Compare against an earlier results JSON.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative worsening that counts as a regression (default 0.2 = 20%%).")
+    parser.add_argument("--keep-logs", action="store_true", help="Keep the sim/api logs and print where.")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench-stack-"))
+    sim = api = None
+    try:
+        sim, api, base = start_stack(args, workdir)
+        s = requests.Session()
+        print("=" * 70)
+        print(f"Stack benchmark: {args.duration:.0f} s, time scale {args.time_scale:g}, "
+              f"{args.baud} baud ({10000.0 / args.baud:.2f} ms/byte), {args.session_mode} sessions")
+        print("=" * 70)
+
+        rec, stop = Recorder(), threading.Event()
+        before = scrape(s, base)
+        stats_before = s.get(f"{base}/stats", timeout=10).json()
+        monitor = ProcessMonitor({"modbus_api": api.pid, "modbus_sim": sim.pid, "clients": os.getpid()})
+        t0 = time.monotonic()
+        threads = run_clients(base, rec, stop, args)
+        stop.wait(args.duration)
+        stop.set()
+        for t in threads:
+            t.join(timeout=30)
+        wall = time.monotonic() - t0
+        resources = monitor.finish()
+        after = scrape(s, base)
+        stats = s.get(f"{base}/stats", timeout=10).json()
+    finally:
+        stop_stack(*(p for p in (api, sim) if p is not None))
+        if args.keep_logs:
+            print(f"Logs kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    bus: Dict[str, Dict[str, float]] = {}
+    txn_s  = delta(before, after, "modbus_transaction_seconds_sum")
+    txn_n  = delta(before, after, "modbus_transaction_seconds_count")
+    wire_s = delta(before, after, "modbus_request_seconds_sum")
+    for lbl, busy in txn_s.items():
+        dev = dict(lbl)["device"]
+        wire = sum(v for l, v in wire_s.items() if dict(l)["device"] == dev)
+        bus[dev] = {
+            "utilisation":  round(busy / wall, 4),
+            "transactions": int(txn_n.get(lbl, 0)),
+            "busy_s":       round(busy, 2),
+            "request_s":    round(wire, 2),
+        }
+    sched_before = stats_before.get("bus_scheduler", {}).get("powmr", {})
+    sched = stats.get("bus_scheduler", {}).get("powmr", {})
+    queue = histogram_summary(before, after, "modbus_queue_wait_seconds", "class")
+    for cls, row in queue.items():
+        row["max_ms_process"] = sched.get("classes", {}).get(cls, {}).get("max_wait_ms")
+
+    results = {
+        "meta": {
+            "started":      datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "duration_s":   round(wall, 1),
+            "time_scale":   args.time_scale,
+            "burst_size":   args.burst_size,
+            "baud":         args.baud,
+            "session_mode": args.session_mode,
+            "faults":       {"garbage": args.fault_garbage, "timeout": args.fault_timeout},
+            "git_rev":      _git_rev(),
+            "host":         platform.node(),
+            "python":       platform.python_version(),
+        },
+        "endpoints":  rec.summary(),
+        "bus":        bus,
+        "lock_wait":  {"powmr": histogram_summary(before, after, "modbus_lock_wait_seconds", "op")},
+        "queue_wait": {"powmr": queue},
+        "bulk_yields": sched.get("yields", 0) - sched_before.get("yields", 0),
+        "resources":  resources,
+    }
+
+    print(f"\n  {'endpoint':<26} {'n':>5} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for ep, row in results["endpoints"].items():
+        print(f"  {ep:<26} {row['n']:>5} {row['errors']:>4} {row['p50_ms']:8.1f} {row['p95_ms']:8.1f} "
+              f"{row['p99_ms']:8.1f} {row['max_ms']:8.1f}")
+    print("\n  bus")
+    for dev, row in bus.items():
+        print(f"    {dev:<10} utilisation {100 * row['utilisation']:5.1f}%   "
+              f"{row['transactions']} transactions   {row['request_s']:.1f} s in requests")
+    print("\n  bus-slot wait (PowMr)")
+    for cls, row in queue.items():
+        print(f"    {cls:<14} n={row['n']:<5} mean {row['mean_ms']:7.1f} ms   "
+              f"p95 ≤ {row['p95_le_ms']} ms   max {row['max_ms_process']} ms")
+    print(f"    bulk reads yielded {results['bulk_yields']} time(s)")
+    print("\n  resources")
+    for name, row in resources.items():
+        print(f"    {name:<11} cpu {row['cpu_s']:6.2f} s ({row['cpu_pct']:5.1f}%)   "
+              f"rss max {row['rss_max_mb']:6.1f} MB   end {row['rss_end_mb']:6.1f} MB")
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, indent=2) + "\n")
+        print(f"\nResults written to {args.out}")
+
+    if args.baseline:
+        old = json.loads(Path(args.baseline).read_text())
+        regressions = compare(old, results, args.threshold)
+        print(f"\nAgainst {args.baseline} ({old['meta'].get('git_rev')}, threshold {args.threshold:.0%}):")
+        for line in regressions:
+            print(f"  REGRESSION  {line}")
+        if not regressions:
+            print("  no regressions")
+        return 1 if regressions else 0
+    return 0
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Measure /limited_registers latency with and without /registers in flight.
+
+Runs two phases against a live modbus_api:
+
+  1. idle  — /limited_registers polled on its own
+  2. load  — the same poll while background threads hammer /registers
+
+and prints p50/p95/p99 for each phase, plus the latched /health probe
+(which never touches the bus, so its latency is pure event-loop
+responsiveness). With serial I/O off the event loop, /health stays flat
+under load; /limited_registers may still queue behind the PowMr bus but
+never behind HTTP handling or Growatt traffic.
+
+Usage:
+  python scripts/latency_probe.py
+  python scripts/latency_probe.py --url http://raspberrypi:5004 --samples 200 --bulk-threads 2
+"""
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import requests
+
+# ── Helpers ──────────────────────────────────────────────────────────────────
+
+
+def percentile(sorted_vals: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already-sorted list."""
+    if not sorted_vals:
+        return float("nan")
+    k = max(0, math.ceil(pct / 100.0 * len(sorted_vals)) - 1)
+    return sorted_vals[k]
+
+
+def sample(session: requests.Session, url: str, n: int, interval: float) -> List[float]:
+    """Issue *n* GETs to *url*; return per-call latency in ms (failures excluded)."""
+    out: List[float] = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        try:
+            session.get(url, timeout=10).raise_for_status()
+            out.append((time.perf_counter() - t0) * 1000.0)
+        except requests.RequestException as e:
+            print(f"  ! {url}: {e}")
+        if interval:
+            time.sleep(interval)
+    return sorted(out)
+
+
+def summarise(label: str, vals: List[float]) -> Dict[str, float]:
+    row = {p: percentile(vals, p) for p in (50, 95, 99)}
+    print(f"  {label:<34} n={len(vals):<4} p50={row[50]:7.1f} ms  "
+          f"p95={row[95]:7.1f} ms  p99={row[99]:7.1f} ms")
+    return row
+
+
+# ── Main ─────────────────────────────────────────────────────────────────────
+
+
+def main() -> int:
+    port = os.getenv("MODBUS_API_PORT", "5004")
+    parser = argparse.ArgumentParser(
+        description="Compare /limited_registers latency idle vs. under /registers load.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument("--url", default=f"http://localhost:{port}")
+    parser.add_argument("--samples", type=int, default=100,
+                        help="Requests per phase (default 100).")
+    parser.add_argument("--interval", type=float, default=0.05,
+                        help="Pause between probe requests in seconds (default 0.05).")
+    parser.add_argument("--bulk-threads", type=int, default=1,
+                        help="Concurrent /registers loops during the load phase.")
+    args = parser.parse_args()
+
+    base = args.url.rstrip("/")
+    s = requests.Session()
+    try:
+        s.get(f"{base}/health", timeout=10).raise_for_status()
+    except requests.RequestException as e:
+        sys.exit(f"modbus_api not ready at {base}: {e}")
+
+    print("=" * 70)
+    print(f"Latency probe against {base}")
+    print(f"  Samples/phase : {args.samples}   interval {args.interval:.3f} s")
+    print(f"  Bulk threads  : {args.bulk_threads}")
+    print("=" * 70)
+
+    print("\nPhase 1 — idle")
+    idle_fast   = summarise("/limited_registers", sample(s, f"{base}/limited_registers",
+                                                         args.samples, args.interval))
+    idle_health = summarise("/health (latched)", sample(s, f"{base}/health",
+                                                        args.samples, args.interval))
+
+    stop = threading.Event()
+    bulk_count = [0]
+
+    def _bulk_loop() -> None:
+        bs = requests.Session()
+        while not stop.is_set():
+            try:
+                bs.get(f"{base}/registers", timeout=15)
+                bulk_count[0] += 1
+            except requests.RequestException:
+                time.sleep(0.5)
+
+    workers = [threading.Thread(target=_bulk_loop, daemon=True) for _ in range(args.bulk_threads)]
+    for w in workers:
+        w.start()
+    time.sleep(0.5)   # let the first /registers get onto the wire
+
+    print(f"\nPhase 2 — /registers in flight ({args.bulk_threads} loop(s))")
+    load_fast   = summarise("/limited_registers", sample(s, f"{base}/limited_registers",
+                                                         args.samples, args.interval))
+    load_health = summarise("/health (latched)", sample(s, f"{base}/health",
+                                                        args.samples, args.interval))
+    stop.set()
+    for w in workers:
+        w.join(timeout=20)
+    print(f"  ({bulk_count[0]} /registers calls completed during the phase)")
+
+    print("\nDelta (load − idle) at p99:")
+    print(f"  /limited_registers : {load_fast[99] - idle_fast[99]:+8.1f} ms")
+    print(f"  /health            : {load_health[99] - idle_health[99]:+8.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""Probe a device's register address space and write a planner profile.
+
+Some PowMr models answer a block read with IllegalAddress as soon as the
+block spans a single non-existent register, so the safe block ranges used
+to be found by hand. This script finds them through modbus_api's /raw_read:
+
+  1. the range is walked in chunks of --max-count registers;
+  2. a chunk that fails (HTTP 502 — the device returned an exception) is
+     bisected until every failing address is isolated; isolated single
+     failures are re-read once before being recorded;
+  3. each readable address is read on its own to record response latency —
+     all in /raw_read_batch calls, timed at the bus by modbus_api;
+  4. the largest accepted block size is found by bisecting the read count
+     on the longest readable run.
+
+The result is a profile in the device_profiles.yaml schema — `illegal`
+ranges, `max_block`, a `turnaround_ms` estimate — plus a `probe` section
+with the probed range and per-address latency (ignored by the planner).
+Paste it into device_profiles.yaml; register_plan then derives the block
+list for modbus_api. --plan prints the blocks the new profile would give.
+
+An HTTP 500 (port gone, timeout, no response) is not treated as "illegal":
+the request is retried, then the probe aborts rather than record a bad map.
+
+/raw_read caps a read at 64 registers, so a reported max_block of 64 means
+"at least 64".
+
+Usage:
+  python scripts/probe_registers.py --device powmr --start 0x0100 --end 0x0240
+  python scripts/probe_registers.py --device growatt --start 0 --end 127 --out growatt.yaml --plan
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import requests
+import yaml
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from register_plan import (  # noqa: E402
+    REGMAP_PATH,
+    DeviceProfile,
+    build_plans,
+    format_blocks,
+    load_regmap,
+)
+
+# ── Constants ────────────────────────────────────────────────────────────────
+
+API_MAX_COUNT = 64        # /raw_read's count limit
+API_MAX_RANGES = 256      # /raw_read_batch's range limit
+DEVICE_DEFAULTS = {
+    "powmr":   {"function": "holding", "key_format": "hex"},
+    "growatt": {"function": "input",   "key_format": "dec"},
+}
+
+
+class ProbeAborted(RuntimeError):
+    """The API failed in a way that says nothing about the address (HTTP 500 etc.)."""
+
+
+# ── /raw_read client ─────────────────────────────────────────────────────────
+
+
+class RawReader:
+    """Thin /raw_read wrapper: True/False per read, plus timing and counters."""
+
+    def __init__(self, base: str, device: str, retries: int, pause: float) -> None:
+        self.url      = f"{base}/raw_read"
+        self.batch    = f"{base}/raw_read_batch"
+        self.device   = device
+        self.retries  = retries
+        self.pause    = pause
+        self.session  = requests.Session()
+        self.requests = 0
+
+    def read(self, addr: int, count: int) -> Tuple[bool, float]:
+        """Read *count* registers at *addr*; (readable, latency_ms).
+
+        502 → the device rejected the read (exception response): (False, ms).
+        Anything else non-2xx is retried and finally raises ProbeAborted.
+        """
+        last = ""
+        for _ in range(self.retries + 1):
+            if self.pause:
+                time.sleep(self.pause)
+            self.requests += 1
+            t0 = time.perf_counter()
+            try:
+                r = self.session.get(
+                    self.url,
+                    params={"addr": str(addr), "count": count, "device": self.device},
+                    timeout=10,
+                )
+            except requests.RequestException as e:
+                last = str(e)
+                continue
+            ms = (time.perf_counter() - t0) * 1000.0
+            if r.status_code == 200:
+                return len(r.json()) == count, ms
+            if r.status_code == 502:
+                return False, ms
+            last = f"HTTP {r.status_code}: {r.text[:200]}"
+        raise ProbeAborted(f"read {addr:#06x}/{count} failed: {last}")
+
+    def read_many(self, ranges: List[Tuple[int, int]]) -> List[Tuple[bool, float]]:
+        """(readable, bus latency_ms) per (addr, count), via /raw_read_batch.
+
+        A range with an exception response is unreadable; any other error
+        (timeout, port gone) raises ProbeAborted like read() does.
+        """
+        body = {"ranges": [{"device": self.device, "addr": a, "count": n} for a, n in ranges]}
+        last = ""
+        for _ in range(self.retries + 1):
+            if self.pause:
+                time.sleep(self.pause)
+            self.requests += 1
+            try:
+                r = self.session.post(self.batch, json=body, timeout=30 + 2 * len(ranges))
+            except requests.RequestException as e:
+                last = str(e)
+                continue
+            if r.status_code != 200:
+                last = f"HTTP {r.status_code}: {r.text[:200]}"
+                continue
+            out = []
+            for (a, n), res in zip(ranges, r.json()["ranges"]):
+                if res["error"] and res.get("exception_code") is None:
+                    raise ProbeAborted(f"read {a:#06x}/{n} failed: {res['error']}")
+                out.append((res["registers"] is not None and len(res["registers"]) == n,
+                            res["elapsed_ms"]))
+            return out
+        raise ProbeAborted(f"batch of {len(ranges)} reads failed: {last}")
+
+
+# ── Probing ──────────────────────────────────────────────────────────────────
+
+
+def find_illegal(reader: RawReader, lo: int, hi: int, max_count: int) -> List[int]:
+    """All unreadable addresses in [lo, hi], by chunked reads + bisection."""
+    illegal: List[int] = []
+
+    def _bisect(start: int, count: int) -> None:
+        ok, _ = reader.read(start, count)
+        if ok:
+            return
+        if count == 1:
+            illegal.append(start)
+            return
+        half = count // 2
+        _bisect(start, half)
+        _bisect(start + half, count - half)
+
+    addr = lo
+    while addr <= hi:
+        count = min(max_count, hi - addr + 1)
+        _bisect(addr, count)
+        addr += count
+        print(f"  … {addr - lo}/{hi - lo + 1} addresses, {len(illegal)} illegal, "
+              f"{reader.requests} requests", end="\r", flush=True)
+    print()
+
+    # An isolated failure between readable neighbours is more likely line
+    # noise than a one-register gap — give it a second chance.
+    bad = set(illegal)
+    for a in sorted(bad):
+        if a - 1 not in bad and a + 1 not in bad and reader.read(a, 1)[0]:
+            bad.discard(a)
+    return sorted(bad)
+
+
+def readable_runs(lo: int, hi: int, illegal: List[int]) -> List[Tuple[int, int]]:
+    """Maximal readable (start, count) runs in [lo, hi]."""
+    bad = set(illegal)
+    runs: List[Tuple[int, int]] = []
+    start: Optional[int] = None
+    for a in range(lo, hi + 2):
+        if a <= hi and a not in bad:
+            if start is None:
+                start = a
+        elif start is not None:
+            runs.append((start, a - start))
+            start = None
+    return runs
+
+
+def find_max_block(reader: RawReader, runs: List[Tuple[int, int]], cap: int) -> int:
+    """Largest count accepted in one read, bisected on the longest readable run."""
+    if not runs:
+        return 0
+    start, length = max(runs, key=lambda r: r[1])
+    good, bad = 1, min(length, cap) + 1     # invariant: good works, bad doesn't (or is out of range)
+    if reader.read(start, bad - 1)[0]:
+        return bad - 1
+    bad -= 1
+    while bad - good > 1:
+        mid = (good + bad) // 2
+        if reader.read(start, mid)[0]:
+            good = mid
+        else:
+            bad = mid
+    return good
+
+
+def measure_latency(reader: RawReader, addrs: List[int]) -> Dict[int, float]:
+    out: Dict[int, float] = {}
+    for i in range(0, len(addrs), API_MAX_RANGES):
+        chunk = addrs[i:i + API_MAX_RANGES]
+        for a, (ok, ms) in zip(chunk, reader.read_many([(a, 1) for a in chunk])):
+            if ok:
+                out[a] = round(ms, 1)
+        print(f"  … {i + len(chunk)}/{len(addrs)}", end="\r", flush=True)
+    print()
+    return out
+
+
+# ── Output ───────────────────────────────────────────────────────────────────
+
+
+def fmt_addr(a: int, key_format: str) -> str:
+    return f"0x{a:04x}" if key_format == "hex" else str(a)
+
+
+def compress(addrs: List[int], key_format: str) -> List[str]:
+    """[3, 4, 5, 9] → ["3-5", "9"]."""
+    out: List[str] = []
+    i = 0
+    while i < len(addrs):
+        j = i
+        while j + 1 < len(addrs) and addrs[j + 1] == addrs[j] + 1:
+            j += 1
+        lo, hi = fmt_addr(addrs[i], key_format), fmt_addr(addrs[j], key_format)
+        out.append(lo if i == j else f"{lo}-{hi}")
+        i = j + 1
+    return out
+
+
+def estimate_turnaround_ms(latency: Dict[int, float], baud: int) -> float:
+    """Median single-register latency minus its modelled wire time.
+
+    Timed around the read call on modbus_api's bus thread, so it still
+    includes pymodbus overhead and overstates the device's own turnaround
+    a little — which errs on the side of merging blocks.
+    """
+    if not latency:
+        return 20.0
+    probe = DeviceProfile(name="_", function="holding", key_format="hex", baud=baud,
+                          turnaround_ms=0.0, max_block=1, illegal=frozenset(), raw_range=())
+    wire_ms = probe.block_cost_s(1) * 1000.0
+    return round(max(0.0, statistics.median(latency.values()) - wire_ms), 1)
+
+
+# ── Main ─────────────────────────────────────────────────────────────────────
+
+
+def main() -> int:
+    port = os.getenv("MODBUS_API_PORT", "5004")
+    parser = argparse.ArgumentParser(
+        description="Probe readable registers via /raw_read and emit a device profile.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument("--url", default=f"http://localhost:{port}")
+    parser.add_argument("--device", choices=sorted(DEVICE_DEFAULTS), required=True)
+    parser.add_argument("--name", help="Profile name (default: --device).")
+    parser.add_argument("--start", type=lambda s: int(s, 0), required=True,
+                        help="First address to probe (decimal or 0x-hex).")
+    parser.add_argument("--end", type=lambda s: int(s, 0), required=True,
+                        help="Last address to probe, inclusive.")
+    parser.add_argument("--max-count", type=int, default=API_MAX_COUNT,
+                        help=f"Chunk size for the sweep (1..{API_MAX_COUNT}, default {API_MAX_COUNT}).")
+    parser.add_argument("--baud", type=int, default=9600,
+                        help="Line speed, recorded in the profile (default 9600).")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="Retries for non-502 failures before aborting (default 2).")
+    parser.add_argument("--pause", type=float, default=0.0,
+                        help="Sleep between requests in seconds, to leave the bus to the poller.")
+    parser.add_argument("--no-latency", action="store_true",
+                        help="Skip the per-address latency pass.")
+    parser.add_argument("--out", help="Write the profile YAML here (default: stdout).")
+    parser.add_argument("--plan", action="store_true",
+                        help="Print the block plan regmap.yaml would get with this profile.")
+    args = parser.parse_args()
+
+    if args.end < args.start:
+        sys.exit("--end must be >= --start")
+    if not (1 <= args.max_count <= API_MAX_COUNT):
+        sys.exit(f"--max-count must be 1..{API_MAX_COUNT}")
+
+    base   = args.url.rstrip("/")
+    name   = args.name or args.device
+    fmt    = DEVICE_DEFAULTS[args.device]["key_format"]
+    reader = RawReader(base, args.device, args.retries, args.pause)
+
+    print("=" * 70, file=sys.stderr)
+    print(f"Probing {args.device} {fmt_addr(args.start, fmt)}..{fmt_addr(args.end, fmt)} "
+          f"via {base}", file=sys.stderr)
+    print("=" * 70, file=sys.stderr)
+
+    # Progress lines go to stderr so `> profile.yaml` captures only YAML.
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        t0 = time.monotonic()
+        print("\nSweep for unreadable addresses")
+        illegal = find_illegal(reader, args.start, args.end, args.max_count)
+        runs    = readable_runs(args.start, args.end, illegal)
+        print(f"  {sum(n for _, n in runs)} readable in {len(runs)} run(s), {len(illegal)} illegal")
+
+        print("\nLargest accepted block")
+        max_block = find_max_block(reader, runs, args.max_count)
+        longest = max((n for _, n in runs), default=0)
+        note = (" (API cap — may be larger)" if max_block == API_MAX_COUNT
+                else " (= longest readable run — may be larger)" if max_block == longest
+                else "")
+        print(f"  max_block = {max_block}{note}")
+
+        latency: Dict[int, float] = {}
+        if not args.no_latency:
+            readable = [a for s, n in runs for a in range(s, s + n)]
+            print(f"\nPer-address latency ({len(readable)} reads)")
+            latency = measure_latency(reader, readable)
+            if latency:
+                vals = sorted(latency.values())
+                print(f"  min {vals[0]:.1f} ms  median {statistics.median(vals):.1f} ms  "
+                      f"max {vals[-1]:.1f} ms")
+        print(f"\nDone: {reader.requests} requests in {time.monotonic() - t0:.1f} s")
+    except ProbeAborted as e:
+        sys.stdout = stdout
+        print(f"\nABORTED: {e}", file=sys.stderr)
+        return 1
+    finally:
+        sys.stdout = stdout
+
+    profile = {
+        "function":      DEVICE_DEFAULTS[args.device]["function"],
+        "key_format":    fmt,
+        "baud":          args.baud,
+        "turnaround_ms": estimate_turnaround_ms(latency, args.baud),
+        "max_block":     max_block,
+        "illegal":       compress(illegal, fmt),
+        "probe": {
+            "date":       datetime.now().isoformat(timespec="seconds"),
+            "range":      [fmt_addr(args.start, fmt), fmt_addr(args.end, fmt)],
+            "latency_ms": {fmt_addr(a, fmt): ms for a, ms in sorted(latency.items())},
+        },
+    }
+    text = ("# Generated by scripts/probe_registers.py — paste into device_profiles.yaml.\n"
+            "# Addresses outside probe.range were not tested.\n"
+            + yaml.safe_dump({name: profile}, sort_keys=False, default_flow_style=False))
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+        print(f"Profile written to {args.out}", file=sys.stderr)
+    else:
+        print(text, end="")
+
+    if args.plan:
+        dp = DeviceProfile(
+            name=name, function=profile["function"], key_format=fmt, baud=args.baud,
+            turnaround_ms=profile["turnaround_ms"], max_block=max(1, max_block),
+            illegal=frozenset(illegal), raw_range=(),
+        )
+        try:
+            plan = build_plans(load_regmap(REGMAP_PATH), {name: dp})[name]
+        except ValueError as e:
+            print(f"\nPlan: {e}", file=sys.stderr)
+            return 1
+        print(f"\nPlan for regmap.yaml ({len(plan.blocks)} block(s), "
+              f"~{plan.cycle_s * 1000:.0f} ms/cycle):", file=sys.stderr)
+        print(f"  {format_blocks(plan.blocks, fmt)}", file=sys.stderr)
+        if plan.fast_blocks:
+            print(f"  fast: {format_blocks(plan.fast_blocks, fmt)}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
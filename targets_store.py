@@ -0,0 +1,146 @@
+"""Shared access to targets.json.
+
+targets.json is written by three processes — daily_target (nightly plan),
+battery_controller (daily values, full-charge bookkeeping, expired
+overrides) and modbus_api (the targets form) — and read by all of them.
+``TargetsStore`` is the one way in:
+
+  * reads keep a parsed copy and re-parse only when stat() says the file
+    changed (inode, mtime or size), so an unchanged file costs one stat;
+  * ``version`` increments whenever the content changes, so a reader can
+    skip work when nothing moved;
+  * ``update()`` is a read-modify-write under an exclusive flock on
+    ``<path>.lock``; the new content goes to a temp file in the same
+    directory, is fsynced, and replaces targets.json with one rename —
+    a concurrent reader sees the old file or the new one, never half of
+    either, and two writers never lose each other's keys.
+
+The lock is advisory and sits on a separate file because the rename swaps
+the inode of targets.json itself.  All three containers bind-mount the same
+directory, so the lock and the rename work across them.
+
+Log levels
+----------
+  DEBUG  — reloads and writes, with the new version
+  WARNING — an unreadable targets.json replaced on update
+"""
+from __future__ import annotations
+
+import copy
+import fcntl
+import json
+import os
+import stat
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from log_config import get_logger
+
+log = get_logger("targets_store")
+
+_Stamp = Tuple[int, int, int]   # (inode, mtime_ns, size)
+
+
+def _stamp(st: os.stat_result) -> _Stamp:
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class TargetsStore:
+    """Versioned, change-detected view of one targets.json.
+
+    Not thread-safe; each process uses it from one thread (or event loop).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path      = path
+        self.lock_path = f"{path}.lock"
+        self.version   = 0    # bumped on every content change seen or made
+        self.reloads   = 0
+        self.writes    = 0
+        self._data: Dict[str, Any] = {}
+        self._stamp: Optional[_Stamp] = None
+
+    def refresh(self) -> int:
+        """Re-parse the file if it changed on disk; return the current version.
+
+        Raises OSError / ValueError like open() + json.load() would; the
+        cached copy is left as it was.
+        """
+        if self._stamp is not None and _stamp(os.stat(self.path)) == self._stamp:
+            return self.version
+        with open(self.path, encoding="utf-8") as f:
+            stamp = _stamp(os.fstat(f.fileno()))
+            data  = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"{self.path}: expected a JSON object, got {type(data).__name__}")
+        first, self._stamp = self._stamp is None, stamp
+        self.reloads += 1
+        if first or data != self._data:
+            self._data = data
+            self.version += 1
+            log.debug("Loaded %s (version %d)", self.path, self.version)
+        return self.version
+
+    def load(self) -> Dict[str, Any]:
+        """A private copy of the current targets (see refresh() for errors)."""
+        self.refresh()
+        return copy.deepcopy(self._data)
+
+    def update(self, mutate: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+        """Apply *mutate* to the latest targets and write them atomically.
+
+        Runs under the write lock, so *mutate* sees every earlier writer's
+        keys. A missing or unreadable file starts from {}. Returns the
+        targets as written.
+        """
+        with self._locked():
+            try:
+                targets = self.load()
+            except FileNotFoundError:
+                targets = {}
+            except (OSError, ValueError) as e:
+                log.warning("%s unreadable (%s) — rewriting it from scratch", self.path, e)
+                targets = {}
+            mutate(targets)
+            self._write(targets)
+        return copy.deepcopy(targets)
+
+    # ── Internals ─────────────────────────────────────────────────────────
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)   # closing the descriptor releases the lock
+
+    def _write(self, targets: Dict[str, Any]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(prefix=f".{os.path.basename(self.path)}.", suffix=".tmp",
+                                   dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(targets, f)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                mode = stat.S_IMODE(os.stat(self.path).st_mode)
+            except OSError:
+                mode = 0o644
+            os.chmod(tmp, mode)
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        self._stamp = _stamp(os.stat(self.path))
+        self.writes += 1
+        if targets != self._data:
+            self._data = copy.deepcopy(targets)
+            self.version += 1
+        log.debug("Wrote %s (version %d)", self.path, self.version)